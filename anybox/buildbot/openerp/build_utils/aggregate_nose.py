@@ -0,0 +1,235 @@
+"""Aggregate nose coverage and profiling output across builds, master-side.
+
+This is run on the uploaded nose output directory of a build (see
+``collect_nose_output.py``), and updates the aggregates of its buildout,
+in the destination directory:
+
+- ``coverage/<revisions key>/``: executed lines per builder, and their
+  union in ``combined.json`` and ``summary.txt``. Builders of the same
+  buildout for the same addons revisions (e.g., for all PostgreSQL
+  versions) thus get their coverage merged. Reading coverage data needs
+  the ``coverage`` distribution on the master, in a version able to
+  read the data files written on the slaves.
+- ``profile-series.json``: per function time series of cProfile stats,
+  for the latest builds.
+- ``profile-report.txt``: the functions with the highest cumulative
+  times in the latest build, with their history.
+
+Paths are made relative to the buildout directory of each build, so that
+they are comparable across slaves.
+
+Concurrent runs for the same destination are serialized by an ``flock``.
+"""
+
+import os
+import sys
+import json
+import time
+import fcntl
+import pstats
+from argparse import ArgumentParser
+
+try:
+    import coverage
+except ImportError:
+    coverage = None
+
+parser = ArgumentParser()
+parser.add_argument('tree', help="Uploaded nose output directory")
+parser.add_argument('--dest', required=True,
+                    help="Directory of the aggregates for the buildout")
+parser.add_argument('--builder', required=True)
+parser.add_argument('--build', required=True)
+parser.add_argument('--history', type=int, default=50,
+                    help="Number of builds kept in profile time series "
+                    "(default: %(default)s)")
+parser.add_argument('--keep', type=int, default=200,
+                    help="Number of functions with the highest cumulative "
+                    "time recorded for each build (default: %(default)s)")
+parser.add_argument('--top', type=int, default=30,
+                    help="Number of functions in the profile report "
+                    "(default: %(default)s)")
+
+
+def relative(path, buildout_dir):
+    if path.startswith(buildout_dir + os.sep):
+        return path[len(buildout_dir) + 1:]
+    return path
+
+
+def read_json(path, default):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return default
+
+
+def write_json(obj, path):
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(obj, f)
+    os.chmod(tmp, 0644)
+    os.rename(tmp, path)
+
+
+def read_coverage_lines(path):
+    """Return a dict of executed line numbers per measured file."""
+    try:
+        data = coverage.CoverageData(basename=path)  # coverage >= 5
+        data.read()
+    except TypeError:
+        data = coverage.CoverageData()
+        data.read_file(path)
+    return dict((f, sorted(data.lines(f) or ()))
+                for f in data.measured_files())
+
+
+def combine_coverage(directory):
+    """Merge the executed lines of all builders recorded in directory."""
+    builders = []
+    files = {}
+    for fname in sorted(os.listdir(directory)):
+        if not fname.endswith('.builder.json'):
+            continue
+        builders.append(fname[:-len('.builder.json')])
+        for path, lines in read_json(os.path.join(directory, fname),
+                                     {}).items():
+            files.setdefault(path, set()).update(lines)
+    files = dict((p, sorted(l)) for p, l in files.items())
+    write_json(dict(builders=builders, files=files),
+               os.path.join(directory, 'combined.json'))
+
+    with open(os.path.join(directory, 'summary.txt'), 'w') as f:
+        f.write("Executed lines, merged from %s\n\n" % ', '.join(builders))
+        for path in sorted(files):
+            f.write("%6d  %s\n" % (len(files[path]), path))
+    os.chmod(os.path.join(directory, 'summary.txt'), 0644)
+    return len(files)
+
+
+def aggregate_coverage(arguments, info):
+    data_path = os.path.join(arguments.tree, 'coverage.data')
+    if not os.path.isfile(data_path):
+        return
+    if coverage is None:
+        print "coverage is not installed on the master, skipping coverage"
+        return
+    buildout_dir = info['buildout_dir']
+    lines = dict((relative(p, buildout_dir), l)
+                 for p, l in read_coverage_lines(data_path).items())
+
+    directory = os.path.join(arguments.dest, 'coverage',
+                             info['revisions_key'])
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    write_json(lines, os.path.join(directory,
+                                   arguments.builder + '.builder.json'))
+    nb_files = combine_coverage(directory)
+    print "Coverage for %s merged, %d files" % (info['revisions_key'],
+                                                nb_files)
+
+
+def function_label(func, buildout_dir):
+    path, line, name = func
+    return '%s:%d(%s)' % (relative(path, buildout_dir), line, name)
+
+
+def profile_entries(stats_path, buildout_dir, keep):
+    """Return the list of (label, calls, total time, cumulative time).
+
+    Only the keep ones with the highest cumulative time are returned.
+    """
+    stats = pstats.Stats(stats_path).stats
+    entries = [(function_label(func, buildout_dir), nc, tt, ct)
+               for func, (cc, nc, tt, ct, callers) in stats.items()]
+    entries.sort(key=lambda e: e[3], reverse=True)
+    return entries[:keep]
+
+
+def update_series(series, build_id, entries, history):
+    """Add the entries of a build to the series and forget the oldest builds.
+    """
+    builds = [b for b in series['builds'] if b['id'] != build_id]
+    builds.append(dict(id=build_id, time=time.time()))
+    builds = builds[-history:]
+    kept = set(b['id'] for b in builds)
+
+    functions = {}
+    for label, points in series['functions'].items():
+        points = [p for p in points if p[0] in kept and p[0] != build_id]
+        if points:
+            functions[label] = points
+    for label, calls, tt, ct in entries:
+        functions.setdefault(label, []).append([build_id, calls, tt, ct])
+    series['builds'] = builds
+    series['functions'] = functions
+    return series
+
+
+def profile_report(series, top):
+    """Return the report lines for the functions of the latest build."""
+    latest = series['builds'][-1]['id']
+    rows = []
+    for label, points in series['functions'].items():
+        cumulative = [p[3] for p in points]
+        last = [p for p in points if p[0] == latest]
+        if not last:
+            continue
+        mean = sum(cumulative) / len(cumulative)
+        rows.append((last[0][3], mean, min(cumulative), max(cumulative),
+                     len(points), label))
+    rows.sort(reverse=True)
+
+    lines = ["Cumulative times in seconds, latest build %s, "
+             "history of %d builds" % (latest, len(series['builds'])),
+             "",
+             "%10s %10s %10s %10s %6s  %s" % (
+                 'latest', 'mean', 'min', 'max', 'builds', 'function')]
+    for last, mean, low, high, count, label in rows[:top]:
+        lines.append("%10.3f %10.3f %10.3f %10.3f %6d  %s" % (
+            last, mean, low, high, count, label))
+    return lines
+
+
+def aggregate_profile(arguments, info):
+    stats_path = os.path.join(arguments.tree, 'cprofile.stats')
+    if not os.path.isfile(stats_path):
+        return
+    entries = profile_entries(stats_path, info['buildout_dir'],
+                              arguments.keep)
+    series_path = os.path.join(arguments.dest, 'profile-series.json')
+    series = read_json(series_path, dict(builds=[], functions={}))
+    build_id = '%s/%s' % (arguments.builder, arguments.build)
+    update_series(series, build_id, entries, arguments.history)
+    write_json(series, series_path)
+
+    report_path = os.path.join(arguments.dest, 'profile-report.txt')
+    with open(report_path, 'w') as f:
+        f.write('\n'.join(profile_report(series, arguments.top)) + '\n')
+    os.chmod(report_path, 0644)
+    print "Profile of %s added to the time series" % build_id
+
+
+def main():
+    arguments = parser.parse_args()
+    info = read_json(os.path.join(arguments.tree, 'build-info.json'), None)
+    if info is None:
+        print "No build information in %r, nothing to aggregate" % (
+            arguments.tree)
+        return 0
+
+    if not os.path.isdir(arguments.dest):
+        os.makedirs(arguments.dest)
+    with open(os.path.join(arguments.dest, '.lock'), 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            aggregate_coverage(arguments, info)
+            aggregate_profile(arguments, info)
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,50 +1,470 @@
 """Analyse the tests log file given as argument.
 
 Print a report and return status code 1 if failures are detected
+
+The log is scanned line by line, in one pass, so that memory usage does
+not depend on the size of the log: for each kind of failure, only the
+total and the first lines are kept for the report (see ``--max-examples``).
+
+Optionally, the results of the individual tests (unittest and YAML tests)
+are extracted from the log, and written in JSON and/or JUnit XML format.
+Durations of modules loading and of tests can also be reported, with a
+comparison against a previous run.
+
+This module is also imported master-side, to analyse the logs while they
+are streamed (see :class:`anybox.buildbot.openerp.steps.OdooLogObserver`).
 """
 
+import os
 import sys
 import re
+import json
+from datetime import datetime
+from argparse import ArgumentParser
+from xml.sax.saxutils import quoteattr
+
+# (label, literal, regexp) triplets. The literal must be part of any line
+# matching the regexp: it is used to discard most lines without
+# running the regexp engine at all.
+FAILURE_PATTERNS = (
+    ('Failure in Python block',
+     'tests.', r'WARNING:tests[.].*AssertionError'),
+    ('Errors during x/yml tests', 'tests.', r'ERROR:tests[.]'),
+    ('Errors or failures during unittest2 tests',
+     'at least one error occurred in a test',
+     r'at least one error occurred in a test'),
+    ('Errors loading addons',
+     'Failed to load', r'ERROR.*openerp: Failed to load'),
+    ('Critical logs', 'CRITICAL', r'CRITICAL'),
+    ('Error init db', 'Failed to initialize database',
+     r'Failed to initialize database'),
+    ('Tests failed to excute', 'Tests failed to execute',
+     r'openerp.modules.loading: Tests failed to execute'),
+    ('At least one test failed when loading the modules',
+     'At least one test failed',
+     r'openerp.modules.loading: At least one test '
+     r'failed when loading the modules.'),
+)
+
+PREFILTER_LITERALS = tuple(sorted(set(p[1] for p in FAILURE_PATTERNS)))
+
+# failures after which it's pointless to wait for the end of the run
+FATAL_LABELS = frozenset(('Critical logs', 'Error init db',
+                          'Errors loading addons'))
+
+# All patterns in one regexp, with a named group for each. A line matching
+# several patterns counts as one failure only, reported for the pattern
+# whose match starts first in the line (the first in FAILURE_PATTERNS if
+# several start at the same position).
+COMBINED_REGEXP = re.compile('|'.join(
+    '(?P<f%d>%s)' % (i, p[2]) for i, p in enumerate(FAILURE_PATTERNS)))
+
+GROUP_LABELS = dict(('f%d' % i, p[0]) for i, p in enumerate(FAILURE_PATTERNS))
+
+# Standard log format of Odoo/OpenERP: time, pid, level, db, logger: message
+LOG_LINE_REGEXP = re.compile(
+    r'^(?P<time>\d{4}-\d\d-\d\d \d\d:\d\d:\d\d,\d{3}) \d+ '
+    r'(?P<level>[A-Z]+) \S+ (?P<logger>[\w.]+): (?P<msg>.*)$')
+
+# unittest runner (verbosity 2), as relayed line by line to the logger:
+# "test_name (dotted.TestClass) ... " when the test starts, then "ok",
+# "FAIL", "ERROR", "skipped 'reason'" or "expected failure" when it ends,
+# possibly on the same line.
+UNITTEST_REGEXP = re.compile(
+    r'^(?P<name>\w+) \((?P<cls>[\w.]+)\)(?: \.\.\. ?(?P<status>.*))?$')
+UNITTEST_SUMMARY_REGEXP = re.compile(
+    r'^(?P<status>FAIL|ERROR): (?P<name>\w+) \((?P<cls>[\w.]+)\)$')
+UNITTEST_STATUSES = {'ok': 'success',
+                     'FAIL': 'failure',
+                     'ERROR': 'error',
+                     'expected failure': 'success',
+                     'unexpected success': 'failure'}
+
+YAML_TEST_REGEXP = re.compile(
+    r'module (?P<module>\w+): (?:loading|executing) (?P<name>\S*test\S*\.yml)')
+
+ADDON_REGEXP = re.compile(r'(?:openerp|odoo)\.addons\.(\w+)')
+
+# lines telling which module is being loaded, and end of modules loading
+MODULE_LOADING_REGEXP = re.compile(r'^(?:module (\w+):|loading (\w+)/)')
+MODULES_LOADED_REGEXP = re.compile(
+    r'^(?:\d+ modules loaded|loading \d+ modules)')
+
+parser = ArgumentParser()
+parser.add_argument('logfile')
+parser.add_argument('--max-examples', type=int, default=20,
+                    help="Maximum number of lines to report for each kind of "
+                    "failure (default: %(default)s)")
+parser.add_argument('--json-output',
+                    help="Write the results of individual tests in this file, "
+                    "in JSON format")
+parser.add_argument('--junit-output',
+                    help="Write the results of individual tests in this file, "
+                    "in JUnit XML format")
+parser.add_argument('--timing-output',
+                    help="Write the durations of modules loading and of "
+                    "individual tests in this file, in JSON format")
+parser.add_argument('--timing-report',
+                    help="Write a report of the slowest modules and tests in "
+                    "this file. Its first line is a summary.")
+parser.add_argument('--timing-previous',
+                    help="Output of --timing-output for a previous run, to "
+                    "report regressions against (ignored if missing)")
+parser.add_argument('--timing-top', type=int, default=10,
+                    help="Number of entries in the timing report "
+                    "(default: %(default)s)")
+parser.add_argument('--timing-threshold', type=float, default=20,
+                    help="Minimal slowdown, in percent, to report a "
+                    "regression (default: %(default)s)")
+parser.add_argument('--timing-min-delta', type=float, default=1,
+                    help="Minimal slowdown, in seconds, to report a "
+                    "regression (default: %(default)s)")
+
+
+def match_label(line):
+    """Return the label of the failure pattern matching line, or None.
+    """
+    for literal in PREFILTER_LITERALS:
+        if literal in line:
+            break
+    else:
+        return None
+    match = COMBINED_REGEXP.search(line)
+    if match is None:
+        return None
+    return GROUP_LABELS[match.lastgroup]
+
+
+class FailureScanner(object):
+    """Accumulate failures from log lines, with bounded memory."""
+
+    def __init__(self, max_examples=20):
+        self.max_examples = max_examples
+        self.counts = {}  # label -> number of lines
+        self.examples = {}  # label -> first lines
+
+    def feed(self, line):
+        label = match_label(line)
+        if label is None:
+            return None
+        self.counts[label] = self.counts.get(label, 0) + 1
+        examples = self.examples.setdefault(label, [])
+        if len(examples) < self.max_examples:
+            examples.append(line)
+        return label
+
+    def total(self):
+        return sum(self.counts.values())
+
+    def report(self, out=sys.stdout):
+        if not self.counts:
+            out.write("No failure detected\n")
+            return
+
+        out.write("FAILURES DETECTED\n\n")
+        for label, _, _ in FAILURE_PATTERNS:
+            count = self.counts.get(label)
+            if not count:
+                continue
+            out.write(label + ':\n')
+            for line in self.examples[label]:
+                out.write('    ' + line.rstrip('\n') + '\n')
+            if count > len(self.examples[label]):
+                out.write('    ... (%d more)\n' % (
+                    count - len(self.examples[label])))
+            out.write('\n')
+
+        out.write("Total: %d failures \n" % self.total())
+
+
+def parse_log_line(line):
+    """Return (time, level, logger, message) or None for non standard lines.
+    """
+    match = LOG_LINE_REGEXP.match(line.rstrip('\n'))
+    if match is None:
+        return None
+    t = match.group('time')
+    # much faster than strptime()
+    time = datetime(int(t[0:4]), int(t[5:7]), int(t[8:10]), int(t[11:13]),
+                    int(t[14:16]), int(t[17:19]), int(t[20:23]) * 1000)
+    return (time, match.group('level'), match.group('logger'),
+            match.group('msg'))
+
+
+def seconds(delta):
+    return delta.days * 86400 + delta.seconds + delta.microseconds / 1e6
+
+
+class ResultsCollector(object):
+    """Extract the results of individual tests from log lines.
+
+    Durations are derived from the log timestamps, hence have the
+    precision of the log (milliseconds) and include the logging overhead.
+    """
+
+    def __init__(self):
+        self.results = []  # list of dicts, in order of appearance
+        self.by_key = {}  # (cls, name) -> result for unittest results
+        self.running = None  # current unittest or YAML test result
+        self.running_logger = None
+
+    def add(self, module, cls, name, start):
+        result = dict(module=module, classname=cls, name=name,
+                      status='running', duration=0.0, start=start)
+        self.results.append(result)
+        return result
+
+    def finish(self, result, status, time):
+        result['status'] = status
+        result['duration'] = seconds(time - result['start'])
+        if result is self.running:
+            self.running = None
+
+    def feed(self, line):
+        parsed = parse_log_line(line)
+        if parsed is not None:
+            self.feed_parsed(*parsed)
+
+    def feed_parsed(self, time, level, logger, msg):
+        yaml_match = YAML_TEST_REGEXP.search(msg)
+        if yaml_match is not None:
+            self.finish_yaml(time)
+            self.running = self.add(yaml_match.group('module'), 'yaml',
+                                    yaml_match.group('name'), time)
+            return
+
+        match = UNITTEST_REGEXP.match(msg)
+        running = self.running
+        if running is not None and running['classname'] == 'yaml':
+            if level in ('ERROR', 'CRITICAL'):
+                running['status'] = 'error'
+                return
+            if match is None and not logger.endswith('modules.loading'):
+                return
+            self.finish_yaml(time)
+            running = None
+
+        if match is not None:
+            cls, name = match.group('cls'), match.group('name')
+            module = ADDON_REGEXP.search(cls)
+            module = module and module.group(1) or logger
+            result = self.add(module, cls, name, time)
+            self.by_key[cls, name] = result
+            self.running = result
+            self.running_logger = logger
+            if match.group('status'):
+                self.finish_unittest(result, match.group('status'), time)
+            return
+
+        match = UNITTEST_SUMMARY_REGEXP.match(msg)
+        if match is not None:
+            result = self.by_key.get((match.group('cls'), match.group('name')))
+            if result is not None and result['status'] in ('running',
+                                                           'success'):
+                result['status'] = UNITTEST_STATUSES[match.group('status')]
+            return
+
+        # other loggers can emit lines while the test runs
+        status = msg.strip()
+        if (running is not None and logger == self.running_logger and
+                (status in UNITTEST_STATUSES or
+                 status.startswith('skipped'))):
+            self.finish_unittest(running, status, time)
+
+    def finish_unittest(self, result, status, time):
+        if status.startswith('skipped'):
+            status = 'skipped'
+        else:
+            status = UNITTEST_STATUSES[status]
+        self.finish(result, status, time)
+
+    def finish_yaml(self, time):
+        running = self.running
+        if running is None or running['classname'] != 'yaml':
+            return
+        status = running['status']
+        self.finish(running, status == 'running' and 'success' or status,
+                    time)
+
+    def totals(self):
+        totals = {}
+        for result in self.results:
+            totals[result['status']] = totals.get(result['status'], 0) + 1
+        return totals
+
+    def modules(self):
+        """Return the results grouped by module, as an ordered list."""
+        modules = []
+        by_name = {}
+        for result in self.results:
+            module = result['module']
+            if module not in by_name:
+                by_name[module] = []
+                modules.append((module, by_name[module]))
+            by_name[module].append(result)
+        return modules
+
+    def write_json(self, path):
+        modules = []
+        for module, results in self.modules():
+            modules.append(dict(name=module, tests=[
+                dict((k, v) for k, v in r.items() if k != 'start')
+                for r in results]))
+        with open(path, 'w') as f:
+            json.dump(dict(totals=self.totals(), modules=modules), f,
+                      indent=2, sort_keys=True)
+
+    def write_junit(self, path):
+        with open(path, 'w') as f:
+            f.write('<?xml version="1.0" encoding="utf-8"?>\n<testsuites>\n')
+            for module, results in self.modules():
+                counts = dict(failure=0, error=0, skipped=0)
+                for r in results:
+                    if r['status'] in counts:
+                        counts[r['status']] += 1
+                f.write('  <testsuite name=%s tests="%d" failures="%d" '
+                        'errors="%d" skipped="%d" time="%.3f">\n' % (
+                            quoteattr(module), len(results),
+                            counts['failure'], counts['error'],
+                            counts['skipped'],
+                            sum(r['duration'] for r in results)))
+                for r in results:
+                    f.write('    <testcase classname=%s name=%s '
+                            'time="%.3f"' % (quoteattr(r['classname']),
+                                             quoteattr(r['name']),
+                                             r['duration']))
+                    if r['status'] in counts:
+                        f.write('>\n      <%s/>\n    </testcase>\n' % (
+                            r['status']))
+                    else:
+                        f.write('/>\n')
+                f.write('  </testsuite>\n')
+            f.write('</testsuites>\n')
+
+
+class ModulesTiming(object):
+    """Measure the time spent loading each module, from log timestamps.
+
+    The time between two log lines is attributed to the module mentioned
+    in the latest line telling which one is being loaded, until the end of
+    the loading of the whole modules graph. Tests run while loading a module
+    are therefore included.
+    """
+
+    def __init__(self):
+        self.durations = {}
+        self.current = None
+        self.since = None
+
+    def feed_parsed(self, time, level, logger, msg):
+        if self.current is not None:
+            self.durations[self.current] = self.durations.get(
+                self.current, 0.0) + seconds(time - self.since)
+        self.since = time
+
+        match = MODULE_LOADING_REGEXP.match(msg)
+        if match is not None:
+            self.current = match.group(1) or match.group(2)
+        elif MODULES_LOADED_REGEXP.match(msg):
+            self.current = None
+
+
+def timing_data(modules_timing, results_collector):
+    tests = {}
+    for r in results_collector.results:
+        key = '%s: %s.%s' % (r['module'], r['classname'], r['name'])
+        tests[key] = r['duration']
+    return dict(modules=modules_timing.durations, tests=tests)
+
+
+def timing_report(timing, previous=None, top=10, threshold=20, min_delta=1):
+    """Return the timing report, as a list of lines."""
+    lines = []
+    slowest = {}
+    for kind in ('modules', 'tests'):
+        entries = sorted(timing[kind].items(), key=lambda e: e[1],
+                         reverse=True)
+        slowest[kind] = entries[0] if entries else None
+        lines.append('')
+        lines.append("Slowest %s:" % kind)
+        for name, duration in entries[:top]:
+            lines.append("  %9.3fs  %s" % (duration, name))
+
+    summary = []
+    for kind in ('modules', 'tests'):
+        if slowest[kind] is not None:
+            summary.append("slowest %s: %s (%.1fs)" % (
+                kind[:-1], slowest[kind][0], slowest[kind][1]))
+
+    if previous is not None:
+        regressions = []
+        for kind in ('modules', 'tests'):
+            before = previous.get(kind, {})
+            for name, duration in timing[kind].items():
+                prev = before.get(name)
+                if prev is None:
+                    continue
+                delta = duration - prev
+                if delta >= min_delta and delta * 100 >= prev * threshold:
+                    regressions.append((delta, name, prev, duration))
+        regressions.sort(reverse=True)
+        lines.append('')
+        lines.append("Regressions since previous run: %d" % len(regressions))
+        for delta, name, prev, duration in regressions[:top]:
+            lines.append("  %+9.3fs  %s (%.3fs -> %.3fs)" % (
+                delta, name, prev, duration))
+        summary.append("%d regressions" % len(regressions))
+
+    return ['; '.join(summary) or "no timing information"] + lines
+
+
+def main():
+    arguments = parser.parse_args()
+    scanner = FailureScanner(max_examples=arguments.max_examples)
+    timing = arguments.timing_output or arguments.timing_report
+    consumers = []
+    if arguments.json_output or arguments.junit_output or timing:
+        collector = ResultsCollector()
+        consumers.append(collector)
+    if timing:
+        modules_timing = ModulesTiming()
+        consumers.append(modules_timing)
+
+    with open(arguments.logfile, 'r') as test_log:
+        for line in test_log:
+            scanner.feed(line)
+            if not consumers:
+                continue
+            parsed = parse_log_line(line)
+            if parsed is not None:
+                for consumer in consumers:
+                    consumer.feed_parsed(*parsed)
+
+    if arguments.json_output:
+        collector.write_json(arguments.json_output)
+    if arguments.junit_output:
+        collector.write_junit(arguments.junit_output)
+    if timing:
+        data = timing_data(modules_timing, collector)
+        if arguments.timing_output:
+            with open(arguments.timing_output, 'w') as f:
+                json.dump(data, f, indent=2, sort_keys=True)
+        if arguments.timing_report:
+            previous = None
+            if (arguments.timing_previous and
+                    os.path.exists(arguments.timing_previous)):
+                with open(arguments.timing_previous) as f:
+                    previous = json.load(f)
+            with open(arguments.timing_report, 'w') as f:
+                for line in timing_report(
+                        data, previous=previous, top=arguments.timing_top,
+                        threshold=arguments.timing_threshold,
+                        min_delta=arguments.timing_min_delta):
+                    f.write(line + '\n')
+
+    scanner.report()
+    return scanner.total() and 1 or 0
+
 
-FAILURE_REGEXPS = {
-    'Failure in Python block': re.compile(r'WARNING:tests[.].*AssertionError'),
-    'Errors during x/yml tests': re.compile(r'ERROR:tests[.]'),
-    'Errors or failures during unittest2 tests': re.compile(
-        r'at least one error occurred in a test'),
-    'Errors loading addons': re.compile(r'ERROR.*openerp: Failed to load'),
-    'Critical logs': re.compile(r'CRITICAL'),
-    'Error init db': re.compile(r'Failed to initialize database'),
-    'Tests failed to excute': re.compile(
-        r'openerp.modules.loading: Tests failed to execute'),
-    'At least one test failed when loading the modules': re.compile(
-        r'openerp.modules.loading: At least one test '
-        r'failed when loading the modules.'),
-}
-
-test_log = open(sys.argv[1], 'r')
-
-failures = {}  # label -> extracted line
-
-for line in test_log.readlines():
-    for label, regexp in FAILURE_REGEXPS.items():
-        if regexp.search(line):
-            failures.setdefault(label, []).append(line)
-
-if not failures:
-    print "No failure detected"
-    sys.exit(0)
-
-total = 0
-
-print 'FAILURES DETECTED'
-print
-
-for label, failed_lines in failures.items():
-    print label + ':'
-    for line in failed_lines:
-        print '    ' + line
-    print
-    total += len(failed_lines)
-
-print "Total: %d failures " % total
-sys.exit(1)
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,154 @@
+"""Fetch, verify and extract a buildout archive in a single pass.
+
+The archive is read only once, either from a local file or streamed from an
+HTTP(S) URL: its digest is computed on the fly while the bytes are fed to a
+decompression and extraction pipeline working in a temporary directory.
+
+Once the extraction and verification are successful, the extracted directory
+replaces the target directory, by a pair of renames.
+Otherwise, the target directory is left untouched.
+"""
+
+import os
+import sys
+import shutil
+import hashlib
+import tempfile
+import urllib2
+from distutils.spawn import find_executable
+from subprocess import Popen
+from subprocess import PIPE
+from argparse import ArgumentParser
+
+CHUNK_SIZE = 1 << 20
+
+DECOMPRESSORS = {  # format -> list of candidates, by order of preference
+    'tar.bz2': (('lbzip2', '-dc'), ('pbzip2', '-dc'), ('bzip2', '-dc')),
+    'tar.gz': (('pigz', '-dc'), ('gzip', '-dc')),
+    'tar.xz': (('xz', '-dc'),),
+    'tar.zst': (('zstd', '-dc', '-q'),),
+}
+
+parser = ArgumentParser()
+parser.add_argument('source',
+                    help="Path or HTTP(S) URL of the archive")
+parser.add_argument('--checksum-file', required=True,
+                    help="Path to the checksum file, "
+                    "in the format of md5sum and the likes")
+parser.add_argument('--checksum-type', default='md5')
+parser.add_argument('--target', default='build',
+                    help="The directory to replace with the archive "
+                    "contents (default: %(default)s)")
+parser.add_argument('--format',
+                    help="Archive format, one of %s. Default is to deduce it "
+                    "from the source name" % ', '.join(sorted(DECOMPRESSORS)))
+
+
+def archive_format(source, fmt=None):
+    if fmt is not None:
+        fmt = fmt.lstrip('.')
+        if fmt not in DECOMPRESSORS:
+            parser.error("Unsupported archive format %r" % fmt)
+        return fmt
+    for fmt in DECOMPRESSORS:
+        if source.endswith('.' + fmt):
+            return fmt
+    parser.error("Can't deduce archive format of %r" % source)
+
+
+def decompressor(fmt):
+    """Return the command line of the best available decompressor for fmt."""
+    for candidate in DECOMPRESSORS[fmt]:
+        if find_executable(candidate[0]) is not None:
+            return list(candidate)
+    parser.error("No decompressor found for format %r" % fmt)
+
+
+def open_source(source):
+    if source.startswith(('http://', 'https://')):
+        return urllib2.urlopen(source)
+    return open(source, 'rb')
+
+
+def read_checksum(path):
+    with open(path) as checksum_file:
+        return checksum_file.read().split()[0].strip().lower()
+
+
+def extract(source, decompressor, tmp_dir, digest):
+    """Feed the source to the decompression and tar pipeline.
+
+    :return: ``True`` if the whole pipeline was successful
+    """
+    decompress = Popen(decompressor, stdin=PIPE, stdout=PIPE)
+    untar = Popen(['tar', 'xf', '-', '-C', tmp_dir],
+                  stdin=decompress.stdout)
+    decompress.stdout.close()  # now owned by tar only
+
+    try:
+        while True:
+            chunk = source.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+            decompress.stdin.write(chunk)
+    except IOError, exc:
+        sys.stderr.write("Error while extracting: %s\n" % exc)
+    finally:
+        decompress.stdin.close()
+        source.close()
+
+    return decompress.wait() == 0 and untar.wait() == 0
+
+
+def swap(extracted, target):
+    """Put the extracted directory in place of target."""
+    parent = os.path.dirname(os.path.abspath(target))
+    old = None
+    if os.path.lexists(target):
+        old = tempfile.mkdtemp(prefix='.old-', dir=parent)
+        os.rename(target, os.path.join(old, 'previous'))
+    os.rename(extracted, target)
+    if old is not None:
+        shutil.rmtree(old, ignore_errors=True)
+
+
+def main():
+    arguments = parser.parse_args()
+    fmt = archive_format(arguments.source, arguments.format)
+    expected = read_checksum(arguments.checksum_file)
+    digest = hashlib.new(arguments.checksum_type)
+
+    target = arguments.target.rstrip('/')
+    tmp_dir = tempfile.mkdtemp(
+        prefix='.extract-', dir=os.path.dirname(os.path.abspath(target)))
+    try:
+        if not extract(open_source(arguments.source), decompressor(fmt),
+                       tmp_dir, digest):
+            sys.stderr.write("Extraction of %r failed\n" % arguments.source)
+            return 1
+
+        if digest.hexdigest() != expected:
+            sys.stderr.write("Checksum mismatch for %r: expected %s, "
+                             "got %s\n" % (arguments.source, expected,
+                                           digest.hexdigest()))
+            return 1
+
+        # archives have a single root directory, whose name does not matter
+        contents = os.listdir(tmp_dir)
+        if len(contents) == 1 and os.path.isdir(
+                os.path.join(tmp_dir, contents[0])):
+            extracted = os.path.join(tmp_dir, contents[0])
+        else:
+            extracted = tmp_dir
+        swap(extracted, target)
+        print "%s checksum OK, extracted to %r" % (arguments.checksum_type,
+                                                   target)
+        return 0
+    finally:
+        if os.path.exists(tmp_dir):
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,90 @@
+"""Create a compressed tarball and its checksum files in a single pass.
+
+The tarball is produced by a ``tar | compressor`` pipeline, whose output
+is hashed while being written, so that no further read of the archive is
+needed to produce the checksum files.
+
+Multi-threaded compressors are used whenever possible. For bzip2, that means
+``lbzip2`` or ``pbzip2`` if one of them is installed (the result is readable
+by plain ``bzip2``).
+
+For each wished checksum type, a file is written next to the archive,
+in the format of ``md5sum`` and the likes.
+"""
+
+import os
+import sys
+import hashlib
+from distutils.spawn import find_executable
+from subprocess import Popen
+from subprocess import PIPE
+from argparse import ArgumentParser
+
+CHUNK_SIZE = 1 << 20
+
+COMPRESSORS = {  # format -> list of candidates, by order of preference
+    'tar.bz2': (('lbzip2', '-c'), ('pbzip2', '-c'), ('bzip2', '-c')),
+    'tar.gz': (('pigz', '-c'), ('gzip', '-c')),
+    'tar.xz': (('xz', '-c', '-T0'),),
+    'tar.zst': (('zstd', '-c', '-q', '-T0'),),
+}
+
+parser = ArgumentParser()
+parser.add_argument('directory', help="The directory to archive")
+parser.add_argument('--format', default='tar.bz2',
+                    choices=sorted(COMPRESSORS),
+                    help="Archive format (default: %(default)s)")
+parser.add_argument('--output',
+                    help="Path to the produced archive. Defaults to the "
+                    "directory name with the format suffix")
+parser.add_argument('--checksum', action='append', dest='checksums',
+                    help="Checksum type for which to produce a file. "
+                    "Can be repeated, defaults to md5 and sha256")
+
+
+def compressor(fmt):
+    """Return the command line of the best available compressor for fmt."""
+    for candidate in COMPRESSORS[fmt]:
+        if find_executable(candidate[0]) is not None:
+            return list(candidate)
+    parser.error("No compressor found for format %r" % fmt)
+
+
+def main():
+    arguments = parser.parse_args()
+    directory = arguments.directory.rstrip('/')
+    output = arguments.output or directory + '.' + arguments.format
+    checksums = arguments.checksums or ['md5', 'sha256']
+    digests = [hashlib.new(c) for c in checksums]
+
+    compress_cmd = compressor(arguments.format)
+    print "Archiving %r to %r with %r" % (directory, output, compress_cmd[0])
+    tar = Popen(['tar', 'cf', '-', directory], stdout=PIPE)
+    compress = Popen(compress_cmd, stdin=tar.stdout, stdout=PIPE)
+    tar.stdout.close()  # now owned by the compressor only
+
+    with open(output, 'wb') as archive:
+        while True:
+            chunk = compress.stdout.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            for digest in digests:
+                digest.update(chunk)
+            archive.write(chunk)
+
+    if tar.wait() != 0 or compress.wait() != 0:
+        sys.stderr.write("Archiving of %r failed\n" % directory)
+        os.unlink(output)
+        return 1
+
+    archive_name = os.path.basename(output)
+    for checksum, digest in zip(checksums, digests):
+        with open(output + '.' + checksum, 'w') as checksum_file:
+            checksum_file.write('%s  %s\n' % (digest.hexdigest(),
+                                              archive_name))
+        print "%s: %s" % (checksum, digest.hexdigest())
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
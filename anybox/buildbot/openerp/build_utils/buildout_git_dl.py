@@ -1,8 +1,25 @@
-"""Utility to retrieve the buildout dir from git."""
+"""Utility to retrieve the buildout dir from git.
+
+With ``--reference-dir``, a bare mirror of the remote repository is
+maintained in that directory (one per URL), and the buildout clone borrows
+its objects through git alternates. The reference directory is meant to be
+shared by all builders of the slave, so that only the first of them actually
+downloads the whole history.
+
+Automatic garbage collection is disabled in the mirrors, but they are
+repacked every ``--gc-interval`` days, dropping objects that have been
+unreachable for more than ``--gc-prune-age`` days (e.g., after a force push
+upstream). A clone still relying on such objects has to be removed, which
+happens anyway after a force push, since clones are updated with
+``--ff-only``.
+"""
 
 import os
 import sys
+import time
 import shutil
+import fcntl
+import hashlib
 from subprocess import check_call
 from argparse import ArgumentParser
 
@@ -21,6 +38,108 @@ parser.add_argument('--force-remove-subdir', action='store_true',
 parser.add_argument('--git-repo-dir', help="(used only with --subdir): "
                     "path to the produced git repo, relative to current "
                     "working directory", default="git_buildout_repo")
+parser.add_argument('--reference-dir',
+                    help="Directory holding bare reference mirrors, shared "
+                    "by all builders of the slave. The clone borrows objects "
+                    "from the mirror of its URL (git alternates).")
+parser.add_argument('--filter',
+                    help="Object filter for partial clones, "
+                    "e.g., 'blob:none'. Requires git >= 2.19 on the slave "
+                    "and server-side support.")
+parser.add_argument('--single-branch', action='store_true',
+                    help="Clone and fetch only the wished branch")
+parser.add_argument('--gc-interval', type=float, default=7,
+                    help="Days between two garbage collections of the "
+                    "reference mirror (0 to disable, default: %(default)s)")
+parser.add_argument('--gc-prune-age', type=int, default=30,
+                    help="Unreachable objects are pruned from the reference "
+                    "mirror after that many days (default: %(default)s)")
+
+
+def url_digest(url):
+    if not isinstance(url, bytes):
+        url = url.encode('utf-8')
+    return hashlib.sha1(url).hexdigest()
+
+
+def update_mirror(reference_dir, url, revspec, single_branch=False,
+                  gc_interval=7, gc_prune_age=30):
+    """Create or update the bare mirror for url, return its path.
+
+    Fetched heads are stored under ``refs/buildbot`` and automatic garbage
+    collection is disabled, so that objects borrowed by clones through
+    alternates don't get pruned at random times. Instead, garbage
+    collection is run every ``gc_interval`` days (see :func:`maybe_gc`).
+
+    The mirror is locked during the whole operation, since several builders
+    can fetch the same URL concurrently.
+    """
+    if not os.path.isdir(reference_dir):
+        try:
+            os.makedirs(reference_dir)
+        except OSError:
+            # concurrent creation
+            if not os.path.isdir(reference_dir):
+                raise
+
+    mirror = os.path.join(reference_dir, url_digest(url))
+    with open(mirror + '.lock', 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        if not os.path.exists(os.path.join(mirror, 'objects')):
+            if os.path.exists(mirror):
+                shutil.rmtree(mirror)
+            check_call(['git', 'init', '--bare', '--quiet', mirror])
+            check_call(['git', 'config', 'gc.auto', '0'], cwd=mirror)
+            check_call(['git', 'config', 'buildbot.url', url], cwd=mirror)
+
+        if single_branch:
+            refspecs = ['+%s:refs/buildbot/%s' % (revspec, revspec)]
+        else:
+            refspecs = ['+refs/heads/*:refs/buildbot/*',
+                        '+refs/tags/*:refs/tags/*']
+        check_call(['git', 'fetch', '--quiet', url] + refspecs, cwd=mirror)
+        maybe_gc(mirror, gc_interval, gc_prune_age)
+    return mirror
+
+
+def maybe_gc(mirror, interval, prune_age):
+    """Run ``git gc`` in mirror if not done for ``interval`` days.
+
+    The time of the latest run is the one of a stamp file besides the
+    mirror. To be called with the mirror lock held.
+    """
+    if interval <= 0:
+        return
+    stamp = mirror + '.gc-stamp'
+    if not os.path.exists(stamp):
+        # first call: start counting from now
+        open(stamp, 'w').close()
+        return
+    if time.time() - os.path.getmtime(stamp) < interval * 86400:
+        return
+    check_call(['git', 'gc', '--quiet',
+                '--prune=%d.days.ago' % prune_age], cwd=mirror)
+    os.utime(stamp, None)
+
+
+def add_alternate(repo_dir, mirror):
+    """Make an existing clone borrow objects from mirror, if not done yet."""
+    alternates = os.path.join(repo_dir, '.git', 'objects', 'info',
+                              'alternates')
+    mirror_objects = os.path.abspath(os.path.join(mirror, 'objects'))
+    if os.path.exists(alternates):
+        with open(alternates) as alt_file:
+            if mirror_objects in (l.strip() for l in alt_file):
+                return
+    else:
+        info_dir = os.path.dirname(alternates)
+        if not os.path.isdir(info_dir):
+            os.makedirs(info_dir)
+    sys.stderr.write("Adding %r to alternates of %r\n" % (
+        mirror_objects, repo_dir))
+    with open(alternates, 'a') as alt_file:
+        alt_file.write(mirror_objects + '\n')
+
 
 arguments = parser.parse_args()
 url = arguments.url
@@ -34,9 +153,25 @@ if os.path.exists(repo_dir) and not os.path.exists(
         os.path.join(repo_dir, '.git')):
     shutil.rmtree(repo_dir)
 
+mirror = None
+if arguments.reference_dir:
+    mirror = update_mirror(arguments.reference_dir, url, revspec,
+                           single_branch=arguments.single_branch,
+                           gc_interval=arguments.gc_interval,
+                           gc_prune_age=arguments.gc_prune_age)
+
 if not os.path.exists(repo_dir):
-    check_call(['git', 'clone', '--branch', revspec, url, repo_dir])
+    clone_cmd = ['git', 'clone', '--branch', revspec]
+    if mirror is not None:
+        clone_cmd.extend(('--reference', mirror))
+    if arguments.filter:
+        clone_cmd.append('--filter=' + arguments.filter)
+    if arguments.single_branch:
+        clone_cmd.append('--single-branch')
+    check_call(clone_cmd + [url, repo_dir])
 else:
+    if mirror is not None:
+        add_alternate(repo_dir, mirror)
     check_call(['git', 'pull', '--ff-only', url, revspec], cwd=repo_dir)
 
 if subdir:
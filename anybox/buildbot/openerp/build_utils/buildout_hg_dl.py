@@ -3,15 +3,25 @@
 This has the advantage over the Mercurial source step to be inconditionnal,
 and always retrieve the head of the wanted branch.
 
+With ``--share-dir``, changesets are pulled into a pooled repository (one per
+URL) inside that directory, and the working directory is a share of it
+(Mercurial's share extension). The pool is meant to be common to all builders
+of the slave, so that only new changesets get transferred.
+
 This may become useless once multi-repo is there and we use it.
 """
 
 import os
+import sys
+import fcntl
+import hashlib
 from subprocess import check_call
 from subprocess import Popen
 from subprocess import PIPE
 from argparse import ArgumentParser
 
+SHARE_EXT = ('--config', 'extensions.share=')
+
 parser = ArgumentParser()
 parser.add_argument('url')
 parser.add_argument('revspec')
@@ -20,22 +30,58 @@ parser.add_argument('--cwd', '--change-directory',
                     default='.',
                     help="Instead of working on current directory, use the "
                     "given one")
+parser.add_argument('--share-dir',
+                    help="Directory holding pooled repositories, shared by "
+                    "all builders of the slave.")
+
+
+def pull(url, revspec, rev_type, cwd=None):
+    if rev_type == 'branch':
+        check_call(['hg', 'pull', '-b', revspec, url], cwd=cwd)
+    else:
+        check_call(['hg', 'pull', url], cwd=cwd)
+
 
 arguments = parser.parse_args()
 url = arguments.url
 revspec = arguments.revspec
 cwd = arguments.cwd
+share_dir = arguments.share_dir
+if share_dir is not None:
+    share_dir = os.path.abspath(share_dir)
+    if not os.path.isdir(share_dir):
+        try:
+            os.makedirs(share_dir)
+        except OSError:
+            # concurrent creation
+            if not os.path.isdir(share_dir):
+                raise
+
 if not os.path.exists(cwd):
     os.makedirs(cwd)
 os.chdir(cwd)
 
-if not os.path.exists(os.path.join('.hg')):
-    check_call(['hg', 'init'])
-
-if arguments.type == 'branch':
-    check_call(['hg', 'pull', '-b', revspec, url])
+if share_dir is None:
+    if not os.path.exists(os.path.join('.hg')):
+        check_call(['hg', 'init'])
+    pull(url, revspec, arguments.type)
 else:
-    check_call(['hg', 'pull', url])
+    pool = os.path.join(share_dir, hashlib.sha1(url).hexdigest())
+    # the lock covers the pull only: working directory updates of shares
+    # are protected by Mercurial's own store lock
+    with open(pool + '.lock', 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        if not os.path.exists(os.path.join(pool, '.hg')):
+            check_call(['hg', 'init', pool])
+        pull(url, revspec, arguments.type, cwd=pool)
+
+    if not os.path.exists('.hg'):
+        check_call(['hg'] + list(SHARE_EXT) +
+                   ['share', '--noupdate', pool, '.'])
+    elif not os.path.exists(os.path.join('.hg', 'sharedpath')):
+        sys.stderr.write("Existing repository in %r is not a share of %r, "
+                         "pulling directly into it\n" % (os.getcwd(), pool))
+        pull(url, revspec, arguments.type)
 
 if arguments.type == 'tag':
     print "Tag mode: checking that %r is a tag" % revspec
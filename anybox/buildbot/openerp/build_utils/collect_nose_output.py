@@ -0,0 +1,42 @@
+"""Prepare nose output for aggregation on the master.
+
+Copies the coverage data file into the nose output directory, and writes
+there a ``build-info.json`` file, with the key of the addons revisions
+(see ``odoo_addons.revisions_key``) and the buildout directory, needed to
+make paths comparable across slaves.
+"""
+
+import os
+import sys
+import json
+import shutil
+from argparse import ArgumentParser
+
+import odoo_addons
+
+parser = ArgumentParser()
+parser.add_argument('--config', required=True,
+                    help="Path to the Odoo configuration file")
+parser.add_argument('--output-dir', default='nose_output')
+parser.add_argument('--coverage-file', default='.coverage')
+
+
+def main():
+    arguments = parser.parse_args()
+    buildout_dir = os.getcwd()
+    # identical for all builders and slaves testing the same code
+    key = odoo_addons.revisions_key(
+        odoo_addons.read_addons_path(arguments.config),
+        base_dir=buildout_dir)
+    if os.path.isfile(arguments.coverage_file):
+        shutil.copy(arguments.coverage_file,
+                    os.path.join(arguments.output_dir, 'coverage.data'))
+    with open(os.path.join(arguments.output_dir, 'build-info.json'),
+              'w') as f:
+        json.dump(dict(revisions_key=key, buildout_dir=buildout_dir), f)
+    print "Revisions key: %s" % key
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,157 @@
+"""Deferred dropping of databases.
+
+Dropping a big database can take a long time, because PostgreSQL has to
+remove all its files. This script can instead rename the database as a
+*tombstone*, which is immediate, and drop the tombstones in a detached
+background process (the *reaper*).
+
+Only one reaper runs at a time for a given slave and cluster. It drops
+tombstones with limited concurrency until there are none left. Tombstones
+that appear while it exits will be dropped by the next reaper.
+
+PostgreSQL connection parameters are taken from the environment.
+"""
+
+import os
+import sys
+import time
+import fcntl
+import threading
+from subprocess import call
+from subprocess import Popen
+from subprocess import PIPE
+from argparse import ArgumentParser
+
+TOMBSTONE_PREFIX = 'buildbot_tombstone_'
+
+parser = ArgumentParser()
+parser.add_argument('--tombstone', metavar='DB',
+                    help="Rename this database as a tombstone first")
+parser.add_argument('--jobs', '-j', type=int, default=2,
+                    help="Maximum number of concurrent drops "
+                    "(default: %(default)s)")
+parser.add_argument('--state-dir', default='.',
+                    help="Where to put the reaper lock and log files")
+parser.add_argument('--detach', action='store_true',
+                    help="Reap in a detached background process")
+parser.add_argument('--no-reap', action='store_true',
+                    help="Don't reap at all (useful with --tombstone)")
+
+
+def psql(sql):
+    proc = Popen(['psql', '-X', '-qAt', '-d', 'postgres', '-c', sql],
+                 stdout=PIPE)
+    out, _ = proc.communicate()
+    if proc.returncode != 0:
+        raise RuntimeError("psql failed on %r" % sql)
+    return out.splitlines()
+
+
+def quote_ident(name):
+    return '"%s"' % name.replace('"', '""')
+
+
+def tombstone(db):
+    """Rename db as a tombstone. Return the new name, or None."""
+    if not psql("SELECT 1 FROM pg_database WHERE datname = '%s'" %
+                db.replace("'", "''")):
+        print "Database %r does not exist" % db
+        return
+    name = '%s%d_%d' % (TOMBSTONE_PREFIX, time.time() * 1000, os.getpid())
+    psql('ALTER DATABASE %s RENAME TO %s' % (quote_ident(db),
+                                             quote_ident(name)))
+    print "Renamed database %r to %r" % (db, name)
+    return name
+
+
+def list_tombstones():
+    return psql("SELECT datname FROM pg_database WHERE datname LIKE '%s%%'"
+                % TOMBSTONE_PREFIX.replace('_', r'\_'))
+
+
+def reap(jobs):
+    """Drop all tombstones, with at most ``jobs`` concurrent drops."""
+    while True:
+        tombstones = list_tombstones()
+        if not tombstones:
+            return
+        semaphore = threading.BoundedSemaphore(jobs)
+        threads = []
+
+        def drop(name):
+            try:
+                print "%s dropping %r" % (time.ctime(), name)
+                rc = call(['psql', '-X', '-q', '-d', 'postgres', '-c',
+                           'DROP DATABASE IF EXISTS %s' % quote_ident(name)])
+                if rc != 0:
+                    print "Failed to drop %r" % name
+            finally:
+                semaphore.release()
+
+        for name in tombstones:
+            semaphore.acquire()
+            thread = threading.Thread(target=drop, args=(name,))
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+
+        failed = set(list_tombstones()).intersection(tombstones)
+        if failed:
+            print "Could not drop %r, giving up for now" % sorted(failed)
+            return
+
+
+def cluster_id():
+    return '%s_%s' % (os.environ.get('PGHOST', 'default').replace('/', '_'),
+                      os.environ.get('PGPORT', 'default'))
+
+
+def detach(log_path):
+    """Double fork, so that the reaper survives the end of the build step.
+
+    All standard streams are redirected, so that the slave does not wait
+    for the reaper.
+    """
+    if os.fork() != 0:
+        return False
+    os.setsid()
+    if os.fork() != 0:
+        os._exit(0)
+    devnull = os.open(os.devnull, os.O_RDONLY)
+    os.dup2(devnull, 0)
+    log_fd = os.open(log_path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0644)
+    os.dup2(log_fd, 1)
+    os.dup2(log_fd, 2)
+    return True
+
+
+def main():
+    arguments = parser.parse_args()
+    if arguments.tombstone:
+        tombstone(arguments.tombstone)
+
+    if arguments.no_reap:
+        return 0
+
+    base = os.path.join(arguments.state_dir, 'db-reaper-' + cluster_id())
+    if arguments.detach:
+        sys.stdout.flush()
+        if not detach(base + '.log'):
+            print "Reaper detached, see %s.log" % base
+            return 0
+
+    with open(base + '.lock', 'w') as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError:
+            print "Another reaper is running"
+            return 0
+        reap(arguments.jobs)
+    if arguments.detach:
+        os._exit(0)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,165 @@
+"""Create the testing database from a pool of pre-built templates.
+
+Templates are databases in which a given set of modules has been installed.
+They are identified by a hash of the addons revisions and of the module list
+(see ``odoo_addons.revisions_key``), and kept in the PostgreSQL cluster
+itself, so that the pool is naturally separated by cluster.
+
+The last usage time of each template is stored as the database comment, and
+used for LRU eviction once the pool has more than ``--pool-size`` templates.
+
+PostgreSQL connection parameters are taken from the environment
+(``PGHOST``, ``PGPORT``...), as for ``psql``.
+"""
+
+import sys
+import time
+from subprocess import call
+from subprocess import check_call
+from subprocess import Popen
+from subprocess import PIPE
+from argparse import ArgumentParser
+
+import odoo_addons
+
+COMMENT_PREFIX = 'buildbot template pool, last used: '
+
+parser = ArgumentParser()
+parser.add_argument('--db', required=True,
+                    help="Name of the testing database to create")
+parser.add_argument('--config', required=True,
+                    help="Path to the Odoo configuration file, to read the "
+                    "addons path from")
+parser.add_argument('--install-command', required=True,
+                    help="Odoo server command used to fill the templates")
+parser.add_argument('--modules', default='base',
+                    help="Comma separated list of modules to install in "
+                    "templates (default: %(default)s)")
+parser.add_argument('--without-demo', action='store_true')
+parser.add_argument('--source-template', default='template1',
+                    help="Template of the template databases "
+                    "(default: %(default)s)")
+parser.add_argument('--prefix', default='buildbot_tpl',
+                    help="Name prefix of pooled templates "
+                    "(default: %(default)s)")
+parser.add_argument('--pool-size', type=int, default=5,
+                    help="Maximum number of templates to keep "
+                    "(default: %(default)s)")
+parser.add_argument('--post-install-sql',
+                    help="SQL to run on templates after module installation")
+
+
+def psql(sql, db='postgres'):
+    """Run sql and return the list of output rows."""
+    proc = Popen(['psql', '-X', '-qAt', '-F', '\t', '-v', 'ON_ERROR_STOP=1',
+                  '-d', db, '-c', sql], stdout=PIPE)
+    out, _ = proc.communicate()
+    if proc.returncode != 0:
+        raise RuntimeError("psql failed on %r" % sql)
+    return [line.split('\t') for line in out.splitlines() if line]
+
+
+def quote_ident(name):
+    return '"%s"' % name.replace('"', '""')
+
+
+def quote_literal(value):
+    return "'%s'" % value.replace("'", "''")
+
+
+def drop(db):
+    psql('DROP DATABASE IF EXISTS %s' % quote_ident(db))
+
+
+def pooled_templates(prefix):
+    """Return a list of (last usage, name), most recently used first."""
+    rows = psql("SELECT datname, shobj_description(oid, 'pg_database') "
+                "FROM pg_database WHERE datname LIKE %s" % quote_literal(
+                    prefix.replace('_', r'\_') + r'\_%'))
+    res = []
+    for name, comment in rows:
+        if not comment.startswith(COMMENT_PREFIX):
+            continue  # most probably an unfinished template
+        try:
+            used = float(comment[len(COMMENT_PREFIX):])
+        except ValueError:
+            used = 0
+        res.append((used, name))
+    res.sort(reverse=True)
+    return res
+
+
+def build_template(arguments, template):
+    """Create template and install the wished modules in it.
+
+    The work is done in a temporary database that gets renamed at the
+    end, so that an incomplete template can't be used.
+    """
+    wip = template + '_wip'
+    drop(wip)
+    psql('CREATE DATABASE %s TEMPLATE %s' % (
+        quote_ident(wip), quote_ident(arguments.source_template)))
+    cmd = [arguments.install_command, '-d', wip,
+           '-i', arguments.modules, '--stop-after-init']
+    if arguments.without_demo:
+        cmd.append('--without-demo=all')
+    print "Building template %r: %r" % (template, cmd)
+    if call(cmd) != 0:
+        drop(wip)
+        raise RuntimeError("Installation of modules in template failed")
+    if arguments.post_install_sql:
+        psql(arguments.post_install_sql, db=wip)
+    psql('ALTER DATABASE %s RENAME TO %s' % (quote_ident(wip),
+                                             quote_ident(template)))
+
+
+def template_name(arguments, base_dir=None):
+    """Return the name of the template for these arguments and addons.
+
+    It is the same for all builders of the slave having identical addons
+    (see ``odoo_addons.revisions_key``), so that they share templates.
+
+    :param base_dir: the buildout directory (defaults to the current one)
+    """
+    modules = ','.join(sorted(m.strip()
+                              for m in arguments.modules.split(',')))
+    key = odoo_addons.revisions_key(
+        odoo_addons.read_addons_path(arguments.config),
+        base_dir=base_dir,
+        extra=(modules, str(arguments.without_demo),
+               arguments.source_template, arguments.post_install_sql or ''))
+    # PostgreSQL identifiers are limited to 63 chars
+    return '%s_%s' % (arguments.prefix, key[:16])
+
+
+def main(argv=None):
+    arguments = parser.parse_args(argv)
+    template = template_name(arguments)
+
+    if psql("SELECT 1 FROM pg_database WHERE datname = %s" % quote_literal(
+            template)):
+        print "Reusing template %r" % template
+    else:
+        build_template(arguments, template)
+
+    psql('COMMENT ON DATABASE %s IS %s' % (
+        quote_ident(template),
+        quote_literal(COMMENT_PREFIX + repr(time.time()))))
+
+    drop(arguments.db)
+    check_call(['psql', '-X', '-d', 'postgres', '-c',
+                'CREATE DATABASE %s TEMPLATE %s' % (
+                    quote_ident(arguments.db), quote_ident(template))])
+
+    for used, name in pooled_templates(arguments.prefix)[
+            arguments.pool_size:]:
+        if name == template:
+            continue
+        print "Evicting template %r (last used at %s)" % (
+            name, time.ctime(used))
+        drop(name)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,292 @@
+"""Restore a reference database dump, through a local content-addressed cache.
+
+The dump source can be:
+
+- an HTTP(S) URL,
+- a path on a remote host, reachable by SSH (``[user@]host:/path``),
+- a local path (typically on a network file system).
+
+A cheap freshness check is made against the source (HTTP headers, remote or
+local ``stat``). If the source did not change since it was last fetched, the
+cached copy is restored directly. Otherwise the dump is streamed to the cache,
+and stored under its SHA256 digest, so that identical dumps from different
+sources are stored only once. Transfers are checked for completeness, and
+happen without holding the cache lock, so that they don't block concurrent
+builds.
+
+Dumps in PostgreSQL custom format are restored with parallel ``pg_restore``,
+plain SQL dumps (possibly gzipped) with ``psql``.
+
+The cache is bounded in size: least recently used dumps get evicted.
+PostgreSQL connection parameters are taken from the environment.
+"""
+
+import os
+import sys
+import json
+import time
+import fcntl
+import hashlib
+import tempfile
+import urllib2
+from subprocess import call
+from subprocess import Popen
+from subprocess import PIPE
+from argparse import ArgumentParser
+
+CHUNK_SIZE = 1 << 20
+
+parser = ArgumentParser()
+parser.add_argument('--db', required=True,
+                    help="Name of the database to create")
+parser.add_argument('--source', required=True,
+                    help="URL, [user@]host:/path or local path of the dump")
+parser.add_argument('--cache-dir', required=True)
+parser.add_argument('--max-size', type=int, default=10240,
+                    help="Maximum size of the cache, in MB "
+                    "(default: %(default)s)")
+parser.add_argument('--jobs', '-j', type=int, default=4,
+                    help="Number of parallel pg_restore jobs "
+                    "(default: %(default)s)")
+
+
+def is_http(source):
+    return source.startswith(('http://', 'https://'))
+
+
+def ssh_split(source):
+    """Return (host, path) if source is a SSH location, else None."""
+    if is_http(source) or os.path.isabs(source):
+        return
+    host, sep, path = source.partition(':')
+    if sep and host and '/' not in host:
+        return host, path
+
+
+def freshness_token(source):
+    """Return a string that changes whenever the source dump does."""
+    if is_http(source):
+        req = urllib2.Request(source)
+        req.get_method = lambda: 'HEAD'
+        headers = urllib2.urlopen(req).info()
+        return ' '.join(headers.get(h, '') for h in (
+            'ETag', 'Last-Modified', 'Content-Length'))
+    ssh = ssh_split(source)
+    if ssh is not None:
+        host, path = ssh
+        proc = Popen(['ssh', host, 'stat', '-L', '-c', '%s-%Y', path],
+                     stdout=PIPE)
+        out, _ = proc.communicate()
+        if proc.returncode != 0:
+            raise RuntimeError("Could not stat %r" % source)
+        return out.strip()
+    st = os.stat(source)
+    return '%d-%d' % (st.st_size, st.st_mtime)
+
+
+def open_source(source):
+    """Open the source dump for reading.
+
+    :return: (file-like object, SSH process or None, expected size or None)
+    """
+    if is_http(source):
+        response = urllib2.urlopen(source)
+        length = response.info().get('Content-Length')
+        return response, None, length and int(length)
+    ssh = ssh_split(source)
+    if ssh is not None:
+        host, path = ssh
+        proc = Popen(['ssh', host, 'cat', path], stdout=PIPE)
+        return proc.stdout, proc, None
+    src = open(source, 'rb')
+    return src, None, os.fstat(src.fileno()).st_size
+
+
+class DumpCache(object):
+    """The content-addressed store and its index.
+
+    The index maps sources to their last freshness token and digest, and
+    digests to their size and last usage time.
+    All operations on the index must happen with the cache locked, whereas
+    :meth:`fetch` must not, so that concurrent builds aren't blocked
+    during a transfer.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.blobs_dir = os.path.join(path, 'blobs')
+        if not os.path.isdir(self.blobs_dir):
+            os.makedirs(self.blobs_dir)
+        self.index_path = os.path.join(path, 'index.json')
+        self.lock_file = open(os.path.join(path, 'lock'), 'w')
+
+    def __enter__(self):
+        fcntl.flock(self.lock_file, fcntl.LOCK_EX)
+        try:
+            with open(self.index_path) as index_file:
+                self.index = json.load(index_file)
+        except (IOError, ValueError):
+            self.index = dict(sources={}, blobs={})
+        return self
+
+    def __exit__(self, *exc_info):
+        tmp = self.index_path + '.tmp'
+        with open(tmp, 'w') as index_file:
+            json.dump(self.index, index_file, indent=2)
+        os.rename(tmp, self.index_path)
+        fcntl.flock(self.lock_file, fcntl.LOCK_UN)
+
+    def blob_path(self, digest):
+        return os.path.join(self.blobs_dir, digest)
+
+    def lookup(self, source, token):
+        """Return the digest of a cached, fresh dump of source, or None."""
+        cached = self.index['sources'].get(source)
+        if cached is None or cached['token'] != token:
+            return
+        digest = cached['digest']
+        if os.path.exists(self.blob_path(digest)):
+            return digest
+
+    def fetch(self, source):
+        """Stream source into a temporary file of the store.
+
+        The transfer is checked for completeness (exit code of ``ssh``,
+        announced or initial size). On failure, nothing is left behind.
+        To be called without the lock.
+
+        :return: temporary path, digest and size, to be passed to
+                 :meth:`store`.
+        """
+        digest = hashlib.sha256()
+        size = 0
+        fd, tmp = tempfile.mkstemp(dir=self.blobs_dir, prefix='.fetch-')
+        try:
+            with os.fdopen(fd, 'wb') as blob:
+                src, proc, expected_size = open_source(source)
+                while True:
+                    chunk = src.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    digest.update(chunk)
+                    blob.write(chunk)
+                    size += len(chunk)
+                src.close()
+            if proc is not None and proc.wait() != 0:
+                raise RuntimeError("Transfer of %r failed (ssh exit code "
+                                   "%d)" % (source, proc.returncode))
+            if expected_size is not None and size != expected_size:
+                raise RuntimeError("Transfer of %r incomplete: got %d bytes "
+                                   "instead of %d" % (source, size,
+                                                      expected_size))
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        return tmp, digest.hexdigest(), size
+
+    def store(self, source, token, tmp, digest, size):
+        """Move a fetched dump in place and record it, return its digest."""
+        path = self.blob_path(digest)
+        if os.path.exists(path):
+            os.unlink(tmp)  # same content from another source or build
+        else:
+            os.rename(tmp, path)
+        self.index['sources'][source] = dict(token=token, digest=digest)
+        self.index['blobs'][digest] = dict(size=size)
+        return digest
+
+    def touch(self, digest):
+        self.index['blobs'][digest]['last_used'] = time.time()
+
+    def acquire(self, digest, max_size):
+        """Return the dump file, read-locked, evicting others if needed."""
+        self.touch(digest)
+        self.evict(max_size, keep=digest)
+        dump = open(self.blob_path(digest), 'rb')
+        fcntl.flock(dump, fcntl.LOCK_SH)
+        return dump
+
+    def evict(self, max_size, keep):
+        """Remove least recently used dumps until size is below max_size.
+
+        Dumps currently being restored (see :meth:`reading`) are skipped.
+        """
+        blobs = self.index['blobs']
+        total = sum(b['size'] for b in blobs.values())
+
+        def last_used(digest):
+            return blobs[digest].get('last_used', 0)
+
+        for digest in sorted(blobs, key=last_used):
+            if total <= max_size:
+                break
+            if digest == keep:
+                continue
+            path = self.blob_path(digest)
+            if os.path.exists(path):
+                with open(path) as blob:
+                    try:
+                        fcntl.flock(blob, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except IOError:
+                        continue  # in use
+                    os.unlink(path)
+            print "Evicting cached dump %s" % digest
+            total -= blobs.pop(digest)['size']
+            for source, cached in self.index['sources'].items():
+                if cached['digest'] == digest:
+                    del self.index['sources'][source]
+
+
+def restore(dump, db, jobs):
+    """Create db and restore the dump in it.
+
+    :param dump: open file object for the dump, read-locked in order to
+                 prevent its eviction from the cache by concurrent builds.
+    """
+    path = dump.name
+    magic = dump.read(5)
+
+    if call(['createdb', db]) != 0:
+        return False
+    if magic == 'PGDMP':
+        return call(['pg_restore', '--no-owner', '--no-privileges',
+                     '-j', str(jobs), '-d', db, path]) == 0
+    psql_cmd = ['psql', '-X', '-q', '-v', 'ON_ERROR_STOP=1', '-d', db]
+    if magic.startswith('\x1f\x8b'):
+        gunzip = Popen(['gzip', '-dc', path], stdout=PIPE)
+        psql = Popen(psql_cmd, stdin=gunzip.stdout)
+        gunzip.stdout.close()
+        return psql.wait() == 0 and gunzip.wait() == 0
+    return call(psql_cmd + ['-f', path]) == 0
+
+
+def main():
+    arguments = parser.parse_args()
+    source = arguments.source
+    token = freshness_token(source)
+
+    max_size = arguments.max_size << 20
+
+    cache = DumpCache(arguments.cache_dir)
+    with cache:
+        digest = cache.lookup(source, token)
+        if digest is not None:
+            print "Dump of %r is fresh in cache (%s)" % (source, digest)
+            dump = cache.acquire(digest, max_size)
+
+    if digest is None:
+        print "Fetching %r (freshness token %r)" % (source, token)
+        fetched = cache.fetch(source)
+        with cache:
+            digest = cache.store(source, token, *fetched)
+            dump = cache.acquire(digest, max_size)
+
+    with dump:
+        if not restore(dump, arguments.db, arguments.jobs):
+            sys.stderr.write("Restoration of %r failed\n" % source)
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
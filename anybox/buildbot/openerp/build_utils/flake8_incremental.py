@@ -0,0 +1,143 @@
+"""Run flake8 on the files that changed since the previous run only.
+
+The results are cached per file, keyed by the hash of the file contents.
+The cache is invalidated as a whole if the flake8 options, the flake8
+executable or the flake8 configuration files change.
+
+Files to analyze are split in chunks, run by concurrent flake8 processes.
+The output is the same as a global flake8 run would give, sorted by file,
+and so is the exit code.
+"""
+
+import os
+import sys
+import json
+import hashlib
+from subprocess import Popen
+from subprocess import PIPE
+from argparse import ArgumentParser
+
+CONFIG_FILES = ('setup.cfg', 'tox.ini', '.flake8')
+
+parser = ArgumentParser()
+parser.add_argument('directories', nargs='+')
+parser.add_argument('--flake8', default='bin/flake8')
+parser.add_argument('--flake8-arg', action='append', default=[],
+                    dest='flake8_args',
+                    help="Option to pass to flake8 (can be repeated)")
+parser.add_argument('--cache-file', default='flake8-cache.json')
+parser.add_argument('--jobs', type=int, default=0,
+                    help="Number of concurrent flake8 processes "
+                    "(defaults to the number of CPUs)")
+
+
+def file_hash(path):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(65536), ''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def python_files(directories):
+    for directory in directories:
+        if os.path.isfile(directory):
+            yield directory
+            continue
+        for dirpath, dirnames, filenames in os.walk(directory):
+            dirnames.sort()
+            for fname in sorted(filenames):
+                if fname.endswith('.py'):
+                    yield os.path.join(dirpath, fname)
+
+
+def cache_key(arguments):
+    """Return a key for everything but the files that influences results."""
+    digest = hashlib.sha1()
+    digest.update(repr(arguments.flake8_args))
+    st = os.stat(arguments.flake8)
+    digest.update('%s %d %d\n' % (arguments.flake8, st.st_size, st.st_mtime))
+    for directory in ['.'] + arguments.directories:
+        for name in CONFIG_FILES:
+            path = os.path.join(directory, name)
+            if os.path.isfile(path):
+                digest.update('%s %s\n' % (path, file_hash(path)))
+    return digest.hexdigest()
+
+
+def split_output(output, paths):
+    """Return a dict of output lines per path.
+
+    Lines not starting with a path (e.g, from ``--show-source``) belong to
+    the previous one.
+    """
+    results = dict((p, []) for p in paths)
+    current = None
+    for line in output.splitlines():
+        path = line.split(':', 1)[0]
+        if path in results:
+            current = path
+        if current is not None:
+            results[current].append(line)
+    return results
+
+
+def run_flake8(arguments, paths):
+    """Run flake8 on paths with concurrent processes, return output per path.
+    """
+    jobs = arguments.jobs or os.sysconf('SC_NPROCESSORS_ONLN')
+    chunks = [paths[i::jobs] for i in range(jobs) if paths[i::jobs]]
+    processes = [(chunk, Popen([arguments.flake8] + arguments.flake8_args +
+                               chunk, stdout=PIPE))
+                 for chunk in chunks]
+    results = {}
+    for chunk, proc in processes:
+        out, _ = proc.communicate()
+        if proc.returncode not in (0, 1):
+            raise RuntimeError("flake8 failed with exit code %d" % (
+                proc.returncode))
+        results.update(split_output(out, chunk))
+    return results
+
+
+def main():
+    arguments = parser.parse_args()
+    key = cache_key(arguments)
+    try:
+        with open(arguments.cache_file) as f:
+            cache = json.load(f)
+    except (IOError, ValueError):
+        cache = {}
+    if cache.get('key') != key:
+        cache = dict(key=key, files={})
+    cached = cache['files']
+
+    hashes = dict((p, file_hash(p)) for p in python_files(
+        arguments.directories))
+    to_analyze = sorted(p for p, h in hashes.items()
+                        if cached.get(p, (None,))[0] != h)
+    print >> sys.stderr, "Analyzing %d files out of %d" % (len(to_analyze),
+                                                           len(hashes))
+    if to_analyze:
+        for path, lines in run_flake8(arguments, to_analyze).items():
+            cached[path] = (hashes[path], lines)
+
+    # forget about removed files
+    for path in set(cached).difference(hashes):
+        del cached[path]
+
+    tmp = arguments.cache_file + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(cache, f)
+    os.rename(tmp, arguments.cache_file)
+
+    status = 0
+    for path in sorted(hashes):
+        for line in cached[path][1]:
+            print line
+            status = 1
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,104 @@
+"""Run an installation command only if its inputs have changed.
+
+The inputs are files, and the outputs of commands, typically
+``bin/buildout annotate``, that prints the fully resolved configuration,
+including ``extends`` (local or remote) and versions pins. They are hashed
+together with the installation command line. The hash is stored in a stamp
+file after a successful run, and the command is skipped next time if the
+hash is the same and all the expected outputs still exist.
+
+If an input command fails, the installation command is run anyway.
+
+Usage::
+
+  install_if_changed.py --stamp STAMP \\
+                        --input-command 'bin/buildout -c b.cfg annotate' \\
+                        --output bin/flake8 -- bin/buildout install part
+"""
+
+import os
+import sys
+import shlex
+import hashlib
+from subprocess import call
+from subprocess import Popen
+from subprocess import PIPE
+from argparse import ArgumentParser
+
+parser = ArgumentParser()
+parser.add_argument('--stamp', required=True)
+parser.add_argument('--input', action='append', default=[],
+                    help="File whose changes trigger the command. Can be "
+                    "repeated, and can be a directory, meaning all "
+                    "files in it (not recursively).")
+parser.add_argument('--input-command', action='append', default=[],
+                    help="Command whose output changes trigger the "
+                    "command (can be repeated)")
+parser.add_argument('--output', action='append', default=[],
+                    help="File that the command must have produced (can be "
+                    "repeated)")
+parser.add_argument('command', nargs='+')
+
+
+def command_output(cmd):
+    """Return the standard output of cmd, or None if it failed."""
+    try:
+        proc = Popen(shlex.split(cmd), stdout=PIPE)
+    except OSError:
+        return None
+    out, _ = proc.communicate()
+    if proc.returncode != 0:
+        return None
+    return out
+
+
+def inputs_hash(inputs, command, input_commands=()):
+    """Return the hash of all inputs, or None if it can't be computed."""
+    digest = hashlib.sha1()
+    digest.update('\0'.join(command))
+    for path in inputs:
+        if os.path.isdir(path):
+            paths = sorted(os.path.join(path, name)
+                           for name in os.listdir(path))
+        else:
+            paths = [path]
+        for p in paths:
+            if not os.path.isfile(p):
+                continue
+            with open(p, 'rb') as f:
+                digest.update('%s %s\n' % (
+                    p, hashlib.sha1(f.read()).hexdigest()))
+    for cmd in input_commands:
+        out = command_output(cmd)
+        if out is None:
+            return None
+        digest.update('%s %s\n' % (cmd, hashlib.sha1(out).hexdigest()))
+    return digest.hexdigest()
+
+
+def main(argv=None):
+    arguments = parser.parse_args(argv)
+    digest = inputs_hash(arguments.input, arguments.command,
+                         input_commands=arguments.input_command)
+    try:
+        with open(arguments.stamp) as f:
+            previous = f.read().strip()
+    except IOError:
+        previous = None
+
+    if digest is not None and previous == digest and all(
+            os.path.exists(p) for p in arguments.output):
+        print "Inputs unchanged, skipping %r" % ' '.join(arguments.command)
+        return 0
+
+    if os.path.exists(arguments.stamp):
+        os.unlink(arguments.stamp)
+    code = call(arguments.command)
+    if code == 0 and digest is not None:
+        with open(arguments.stamp, 'w') as f:
+            f.write(digest + '\n')
+    return code
+
+
+if __name__ == '__main__':
+    sys.exit(main())
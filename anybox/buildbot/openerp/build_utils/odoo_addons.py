@@ -0,0 +1,243 @@
+"""Slave-side helpers about the addons of an Odoo/OpenERP buildout.
+
+This module is meant to be downloaded next to the build utilities that
+import it.
+"""
+
+import os
+import ast
+import hashlib
+from ConfigParser import ConfigParser
+from subprocess import Popen
+from subprocess import PIPE
+
+MANIFEST_NAMES = ('__manifest__.py', '__openerp__.py', '__terp__.py')
+
+VCS_REVISION_COMMANDS = (
+    ('.git', ('git', 'rev-parse', 'HEAD')),
+    ('.hg', ('hg', 'id', '-i')),
+    ('.bzr', ('bzr', 'revision-info', '--tree')),
+)
+
+# list modified, untracked and ignored files below a path
+VCS_STATUS_COMMANDS = dict((
+    ('.git', ('git', 'status', '--porcelain', '--ignored', '--')),
+    ('.hg', ('hg', 'status', '-mardui')),
+    ('.bzr', ('bzr', 'status', '--short')),
+))
+
+BYTECODE_SUFFIXES = ('.pyc', '.pyo', '__pycache__', '__pycache__/')
+
+
+def read_addons_path(config_path):
+    """Return the list of addons directories from an Odoo config file.
+
+    Relative paths are interpreted from the current working directory, as
+    the recipe writes absolute ones anyway.
+    """
+    parser = ConfigParser()
+    parser.read(config_path)
+    return [os.path.abspath(p.strip())
+            for p in parser.get('options', 'addons_path').split(',')
+            if p.strip()]
+
+
+def vcs_root(path, stop=None):
+    """Return the closest VCS controlled ancestor of path and its VCS marker.
+
+    :param stop: if not ``None``, the search doesn't go above that directory
+    :return: (root, marker) or (None, None)
+    """
+    path = os.path.abspath(path)
+    if stop is not None:
+        stop = os.path.abspath(stop)
+    while True:
+        for marker, _ in VCS_REVISION_COMMANDS:
+            if os.path.exists(os.path.join(path, marker)):
+                return path, marker
+        parent = os.path.dirname(path)
+        if parent == path or path == stop:
+            return None, None
+        path = parent
+
+
+def command_output(cmd, cwd):
+    """Return the standard output of cmd, or None if it failed."""
+    try:
+        proc = Popen(cmd, cwd=cwd, stdout=PIPE, stderr=PIPE)
+    except OSError:
+        return None
+    out, _ = proc.communicate()
+    if proc.returncode != 0:
+        return None
+    return out
+
+
+def vcs_revision(path, stop=None, clean=False):
+    """Return the revision identifier of the VCS holding path, or None.
+
+    :param stop: passed to :func:`vcs_root`
+    :param clean: if ``True``, None is also returned unless all files below
+                  path are tracked and unmodified (bytecode files aside), so
+                  that the revision fully identifies them.
+    """
+    root, marker = vcs_root(path, stop=stop)
+    if root is None:
+        return None
+    if clean:
+        status = command_output(
+            VCS_STATUS_COMMANDS[marker] + (os.path.abspath(path),), root)
+        if status is None or any(
+                not line.rstrip().endswith(BYTECODE_SUFFIXES)
+                for line in status.splitlines() if line.strip()):
+            return None
+    out = command_output(dict(VCS_REVISION_COMMANDS)[marker], root)
+    return out and out.strip() or None
+
+
+def tree_fingerprint(path):
+    """Fallback for directories whose revision doesn't identify them.
+
+    Based on relative names and contents, so that identical trees have the
+    same fingerprint wherever they are.
+    """
+    digest = hashlib.sha1()
+    for dirpath, dirnames, filenames in os.walk(path):
+        dirnames.sort()
+        for fname in sorted(filenames):
+            if fname.endswith(('.pyc', '.pyo')):
+                continue
+            full = os.path.join(dirpath, fname)
+            try:
+                with open(full, 'rb') as f:
+                    content = hashlib.sha1(f.read()).hexdigest()
+            except IOError:
+                continue
+            digest.update('%s %s\n' % (os.path.relpath(full, path), content))
+    return digest.hexdigest()
+
+
+def revisions_key(addons_path, base_dir=None, extra=()):
+    """Return a hash identifying the addons revisions and extra data.
+
+    The key doesn't depend on where the buildout is, so that identical
+    addons give the same key for all builders and slaves: paths are taken
+    relative to ``base_dir``, and addons directories are identified by the
+    revision of the repository holding them, up to ``base_dir`` included,
+    if all their files are tracked and unmodified.
+    The others are identified by :func:`tree_fingerprint`.
+
+    :param base_dir: the buildout directory (defaults to the current one)
+    :param extra: iterable of strings that must also be part of the key
+                  (modules lists, options...)
+    """
+    if base_dir is None:
+        base_dir = os.getcwd()
+    base_dir = os.path.abspath(base_dir)
+    digest = hashlib.sha1()
+    for path in addons_path:
+        path = os.path.abspath(path)
+        revision = vcs_revision(path, stop=base_dir, clean=True)
+        if revision is None:
+            revision = tree_fingerprint(path)
+        if path == base_dir or path.startswith(base_dir + os.sep):
+            path = os.path.relpath(path, base_dir)
+        digest.update('%s %s\n' % (path, revision))
+    for item in extra:
+        digest.update(item + '\n')
+    return digest.hexdigest()
+
+
+class ManifestError(ValueError):
+    """Raised if a manifest can't be read without executing it."""
+
+
+def parse_manifest(source, path='<manifest>',
+                   required=('depends', 'installable')):
+    """Return the manifest dict from its source, without executing it.
+
+    Entries whose values aren't Python literals, e.g.,
+    ``open('README.rst').read()``, are left out, unless their key is in
+    ``required``, in which case :class:`ManifestError` is raised.
+    """
+    try:
+        tree = ast.parse(source, path, 'eval')
+    except SyntaxError, exc:
+        raise ManifestError("Could not parse %r: %s" % (path, exc))
+    if not isinstance(tree.body, ast.Dict):
+        raise ManifestError("Manifest %r is not a dict" % path)
+    manifest = {}
+    for key, value in zip(tree.body.keys, tree.body.values):
+        try:
+            key = ast.literal_eval(key)
+        except ValueError:
+            continue
+        try:
+            manifest[key] = ast.literal_eval(value)
+        except ValueError:
+            if key in required:
+                raise ManifestError("Value of %r is not a literal in %r" % (
+                    key, path))
+    return manifest
+
+
+def read_manifest(module_path):
+    """Return the manifest dict of the module at module_path, or None.
+
+    See :func:`parse_manifest` about non literal values.
+    """
+    for name in MANIFEST_NAMES:
+        path = os.path.join(module_path, name)
+        if os.path.isfile(path):
+            with open(path) as f:
+                return parse_manifest(f.read(), path)
+
+
+def find_modules(addons_path):
+    """Return a dict mapping module names to their paths.
+
+    As in Odoo, the first occurrence of a module along the addons path wins.
+    """
+    modules = {}
+    for addons_dir in addons_path:
+        if not os.path.isdir(addons_dir):
+            continue
+        for name in sorted(os.listdir(addons_dir)):
+            path = os.path.join(addons_dir, name)
+            if name in modules or not os.path.isdir(path):
+                continue
+            if any(os.path.isfile(os.path.join(path, m))
+                   for m in MANIFEST_NAMES):
+                modules[name] = path
+    return modules
+
+
+def dependency_graph(addons_path):
+    """Return a dict mapping module names to the list of their dependencies.
+
+    Modules whose manifest is not installable are left out.
+    Raise :class:`ManifestError` if a manifest can't be read.
+    """
+    graph = {}
+    for name, path in find_modules(addons_path).items():
+        manifest = read_manifest(path)
+        if not manifest.get('installable', True):
+            continue
+        graph[name] = list(manifest.get('depends', ()))
+    return graph
+
+
+def dependency_closure(graph, modules):
+    """Return the set of modules and all their direct or indirect dependencies.
+
+    Unknown modules are kept in the result, with no dependencies.
+    """
+    closure = set()
+    stack = list(modules)
+    while stack:
+        module = stack.pop()
+        if module in closure:
+            continue
+        closure.add(module)
+        stack.extend(graph.get(module, ()))
+    return closure
@@ -0,0 +1,145 @@
+"""Start and stop a throwaway PostgreSQL cluster.
+
+The cluster is meant to live in a RAM-backed directory (tmpfs) for the
+duration of a build, and runs with all durability settings disabled.
+
+The ``start`` command outputs the connection parameters on stdout, in the
+form of buildbot capability properties::
+
+   cap_postgresql_port=15432
+   cap_postgresql_host=/dev/shm/buildbot-pg-XXXXXX
+
+All other messages go to stderr. Connection through the Unix socket in the
+data directory is preferred, but the server also listens on localhost,
+on a port leased in the given range (see ``port_lease.py``, that must be
+downloaded alongside). The lease is released by the ``stop`` command.
+
+PostgreSQL binaries (``initdb``, ``pg_ctl``) are looked up in the ``PATH``.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+from subprocess import call
+from argparse import ArgumentParser
+from argparse import Namespace
+
+import port_lease
+
+DURABILITY_OFF = ('fsync=off', 'synchronous_commit=off',
+                  'full_page_writes=off')
+
+parser = ArgumentParser()
+parser.add_argument('action', choices=('start', 'stop'))
+parser.add_argument('--state-file', default='ephemeral-pg.json',
+                    help="Where to store the cluster details between "
+                    "start and stop (default: %(default)s)")
+parser.add_argument('--base-dir', default='/dev/shm',
+                    help="Directory in which to create the data directory "
+                    "(default: %(default)s)")
+parser.add_argument('--lease-file', default='port-leases.json',
+                    help="Port leases file shared by all builds of the slave "
+                    "(default: %(default)s)")
+parser.add_argument('--owner', default=os.getcwd(),
+                    help="Owner of the port lease (default: current "
+                    "directory)")
+parser.add_argument('--port-min', type=int, default=15432)
+parser.add_argument('--port-max', type=int, default=16432)
+
+
+def log(msg):
+    sys.stderr.write(msg + '\n')
+
+
+def lease_port(lease_file, owner, port_min, port_max):
+    """Lease a port for owner, replacing its previous lease, if any.
+
+    :return: the port, or None
+    """
+    lease_args = Namespace(owner=owner, interface='localhost',
+                           port_min=port_min, port_max=port_max,
+                           block_size=1, blocks=1, ttl=86400)
+    with port_lease.LeaseFile(lease_file) as leases:
+        return port_lease.acquire(leases, lease_args, time.time())
+
+
+def release_port(lease_file, owner):
+    with port_lease.LeaseFile(lease_file) as leases:
+        leases.pop(owner, None)
+
+
+def stop(state_file):
+    try:
+        with open(state_file) as f:
+            state = json.load(f)
+    except IOError:
+        log("No ephemeral cluster state in %r" % state_file)
+        return 0
+    datadir = state['datadir']
+    if os.path.exists(datadir):
+        call(['pg_ctl', '-D', datadir, '-m', 'immediate', '-w', 'stop'],
+             stdout=sys.stderr)
+        shutil.rmtree(datadir, ignore_errors=True)
+    if 'lease_file' in state:
+        release_port(state['lease_file'], state['owner'])
+    os.unlink(state_file)
+    log("Ephemeral cluster in %r removed" % datadir)
+    return 0
+
+
+def start(arguments):
+    if os.path.exists(arguments.state_file):
+        log("Removing leftover ephemeral cluster")
+        stop(arguments.state_file)
+
+    datadir = tempfile.mkdtemp(prefix='buildbot-pg-', dir=arguments.base_dir)
+    state = dict(datadir=datadir,
+                 lease_file=os.path.abspath(arguments.lease_file),
+                 owner=arguments.owner)
+    with open(arguments.state_file, 'w') as f:
+        json.dump(state, f)
+
+    if call(['initdb', '-D', datadir, '-A', 'trust', '-E', 'UTF8'],
+            stdout=sys.stderr) != 0:
+        log("initdb failed")
+        return 1
+
+    options = ' '.join(['-k', datadir, '-c', "listen_addresses=localhost"] +
+                       ['-c ' + o for o in DURABILITY_OFF])
+    server_log = os.path.join(datadir, 'server.log')
+    # a process unaware of the leases may bind the port between the check
+    # and the start: in that case we lease the next one
+    port_min = arguments.port_min
+    while True:
+        port = lease_port(arguments.lease_file, arguments.owner,
+                          port_min, arguments.port_max)
+        if port is None:
+            log("Could not start the ephemeral cluster, see %r" % server_log)
+            return 1
+        if call(['pg_ctl', '-D', datadir, '-w', '-l', server_log,
+                 '-o', '-p %d %s' % (port, options), 'start'],
+                stdout=sys.stderr) == 0:
+            break
+        log("Could not start on port %d" % port)
+        port_min = port + 1
+
+    state['port'] = port
+    with open(arguments.state_file, 'w') as f:
+        json.dump(state, f)
+    print 'cap_postgresql_port=%d' % port
+    print 'cap_postgresql_host=%s' % datadir
+    return 0
+
+
+def main():
+    arguments = parser.parse_args()
+    if arguments.action == 'stop':
+        return stop(arguments.state_file)
+    return start(arguments)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+"""Lease blocks of consecutive ports to builds, without any global lock.
+
+Leases are recorded in a JSON file shared by all builders of the slave,
+whose updates are serialized by an ``flock`` on a companion lock file, held
+only for the time of the update itself.
+
+A lease belongs to an owner, typically the build directory, so that a
+new lease by the same owner replaces the one of a previous build that
+could not release it (crash, lost slave connection). Leases also
+expire after a configurable time, for the builders that don't run anymore.
+
+Ports are still checked by binding on them, to avoid those that are used
+by processes unaware of the leases, but a leased port can't be handed out
+to another build, even if it has not been bound yet.
+
+The ``acquire`` command prints the first port of the leased block on
+standard output. With ``--blocks``, the leased block is made of that many
+blocks of ``--block-size`` ports, e.g., one per concurrent server of the
+build.
+"""
+
+import os
+import sys
+import json
+import time
+import fcntl
+import socket
+from argparse import ArgumentParser
+
+parser = ArgumentParser()
+parser.add_argument('action', choices=('acquire', 'release'))
+parser.add_argument('--lease-file', required=True)
+parser.add_argument('--owner', required=True)
+parser.add_argument('--interface', default='localhost',
+                    help="Interface to look for free ports on "
+                    "(defaults to %(default)s)")
+parser.add_argument('--port-min', type=int, default=8000)
+parser.add_argument('--port-max', type=int, default=9000)
+parser.add_argument('--block-size', type=int, default=1,
+                    help="Number of consecutive ports to lease "
+                    "(defaults to %(default)s)")
+parser.add_argument('--blocks', type=int, default=1,
+                    help="Number of blocks of --block-size ports to lease "
+                    "at once, 0 meaning the number of CPUs "
+                    "(defaults to %(default)s)")
+parser.add_argument('--ttl', type=int, default=86400,
+                    help="Lease expiry, in seconds (defaults to %(default)s)")
+
+
+class LeaseFile(object):
+    """Context manager giving exclusive access to the leases."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def __enter__(self):
+        self.lock = open(self.path + '.lock', 'a')
+        fcntl.flock(self.lock, fcntl.LOCK_EX)
+        try:
+            with open(self.path) as f:
+                self.leases = json.load(f)
+        except (IOError, ValueError):
+            self.leases = {}
+        return self.leases
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        try:
+            if exc_type is None:
+                tmp = self.path + '.tmp'
+                with open(tmp, 'w') as f:
+                    json.dump(self.leases, f)
+                os.rename(tmp, self.path)
+        finally:
+            fcntl.flock(self.lock, fcntl.LOCK_UN)
+            self.lock.close()
+
+
+def bindable(interface, port):
+    s = socket.socket()
+    try:
+        s.bind((interface, port))
+    except socket.error:
+        return False
+    finally:
+        s.close()
+    return True
+
+
+def lease_size(arguments):
+    blocks = arguments.blocks or os.sysconf('SC_NPROCESSORS_ONLN')
+    return arguments.block_size * blocks
+
+
+def acquire(leases, arguments, now):
+    """Record a lease in leases and return its first port, or None."""
+    for owner, lease in leases.items():
+        if lease['expires'] < now:
+            del leases[owner]
+    leases.pop(arguments.owner, None)
+
+    taken = set()
+    for lease in leases.values():
+        taken.update(xrange(lease['port'], lease['port'] + lease['size']))
+
+    size = lease_size(arguments)
+    for port in xrange(arguments.port_min, arguments.port_max - size + 1,
+                       size):
+        block = range(port, port + size)
+        if taken.intersection(block):
+            continue
+        if all(bindable(arguments.interface, p) for p in block):
+            leases[arguments.owner] = dict(port=port, size=size,
+                                           expires=now + arguments.ttl)
+            return port
+
+
+def main():
+    arguments = parser.parse_args()
+    with LeaseFile(arguments.lease_file) as leases:
+        if arguments.action == 'release':
+            leases.pop(arguments.owner, None)
+            return 0
+        port = acquire(leases, arguments, time.time())
+
+    if port is None:
+        sys.stderr.write("Could not find any free block of %d ports, "
+                         "sorry.\n" % lease_size(arguments))
+        return 2
+    print(port)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
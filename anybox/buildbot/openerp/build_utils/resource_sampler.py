@@ -0,0 +1,158 @@
+"""Run a command and report the resource usage of its process tree.
+
+The process tree is sampled at regular intervals through ``/proc`` for
+its resident memory and block I/O, and CPU times are those of the
+command and all its descendants once they are over (``getrusage``).
+
+The summary is printed as a last line on standard output, starting with
+``SUMMARY_PREFIX`` and followed by a JSON object, with keys:
+
+- ``wall``: wall clock time, in seconds
+- ``cpu_user``, ``cpu_system``: CPU times, in seconds
+- ``rss_peak``: peak of the sum of resident memories of the tree, in kB
+- ``io_read``, ``io_write``: bytes read from and written to block devices
+  (only for the processes that could be sampled, missing if ``/proc``
+  doesn't provide them)
+- ``load_avg``: the mean of the 1 minute load average of the host along
+  the run, and ``cpus`` the number of processors
+- ``disk_free``: available space at the end of the run, in kB, on the
+  filesystem of the current directory.
+
+The exit code is the one of the command, or 128 plus the signal number if
+it has been killed by a signal, as with shells.
+"""
+
+import os
+import sys
+import json
+import time
+import signal
+import resource
+from subprocess import Popen
+from argparse import ArgumentParser
+
+SUMMARY_PREFIX = 'RESOURCE USAGE: '
+
+parser = ArgumentParser()
+parser.add_argument('--interval', type=float, default=1.0,
+                    help="Sampling interval in seconds "
+                    "(default: %(default)s)")
+parser.add_argument('command', nargs='+')
+
+
+def children_map():
+    """Return a dict of direct children pids per parent pid."""
+    children = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open('/proc/%s/stat' % entry) as f:
+                stat = f.read()
+        except IOError:
+            continue
+        # the command name, between parentheses, may contain spaces
+        ppid = int(stat[stat.rindex(')') + 2:].split()[1])
+        children.setdefault(ppid, []).append(int(entry))
+    return children
+
+
+def process_tree(pid):
+    children = children_map()
+    tree = []
+    stack = [pid]
+    while stack:
+        current = stack.pop()
+        tree.append(current)
+        stack.extend(children.get(current, ()))
+    return tree
+
+
+def rss(pid):
+    """Resident memory of pid, in kB."""
+    try:
+        with open('/proc/%d/status' % pid) as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except IOError:
+        pass
+    return 0
+
+
+def io_counters(pid):
+    """Return (read_bytes, write_bytes) of pid, or None."""
+    try:
+        with open('/proc/%d/io' % pid) as f:
+            counters = dict(line.split(':') for line in f if ':' in line)
+        return (int(counters['read_bytes']), int(counters['write_bytes']))
+    except (IOError, KeyError, ValueError):
+        return None
+
+
+class Sampler(object):
+
+    def __init__(self, pid):
+        self.pid = pid
+        self.rss_peak = 0
+        self.io = {}  # pid -> latest (read, write) counters
+        self.loads = []
+
+    def sample(self):
+        tree = process_tree(self.pid)
+        self.rss_peak = max(self.rss_peak, sum(rss(p) for p in tree))
+        for pid in tree:
+            counters = io_counters(pid)
+            if counters is not None:
+                self.io[pid] = counters
+        self.loads.append(os.getloadavg()[0])
+
+    def summary(self, wall, cpu_user, cpu_system):
+        summary = dict(wall=round(wall, 1),
+                       cpu_user=round(cpu_user, 1),
+                       cpu_system=round(cpu_system, 1),
+                       rss_peak=self.rss_peak)
+        if self.io:
+            summary['io_read'] = sum(c[0] for c in self.io.values())
+            summary['io_write'] = sum(c[1] for c in self.io.values())
+        if self.loads:
+            summary['load_avg'] = round(sum(self.loads) / len(self.loads), 2)
+        summary['cpus'] = os.sysconf('SC_NPROCESSORS_ONLN')
+        st = os.statvfs('.')
+        summary['disk_free'] = st.f_bavail * st.f_frsize // 1024
+        return summary
+
+
+def main():
+    arguments = parser.parse_args()
+    start = time.time()
+    before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    try:
+        proc = Popen(arguments.command)
+    except OSError, exc:
+        sys.stderr.write("Could not run %r: %s\n" % (arguments.command, exc))
+        return 127
+
+    def forward(signum, frame):
+        proc.send_signal(signum)
+    signal.signal(signal.SIGTERM, forward)
+    signal.signal(signal.SIGINT, forward)
+
+    sampler = Sampler(proc.pid)
+    while proc.poll() is None:
+        sampler.sample()
+        time.sleep(arguments.interval)
+
+    after = resource.getrusage(resource.RUSAGE_CHILDREN)
+    summary = sampler.summary(time.time() - start,
+                              after.ru_utime - before.ru_utime,
+                              after.ru_stime - before.ru_stime)
+    sys.stdout.flush()
+    print SUMMARY_PREFIX + json.dumps(summary, sort_keys=True)
+    if proc.returncode < 0:  # killed by a signal, same code as a shell
+        return 128 - proc.returncode
+    return proc.returncode
+
+
+if __name__ == '__main__':
+    sys.exit(main())
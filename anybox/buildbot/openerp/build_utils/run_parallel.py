@@ -0,0 +1,83 @@
+"""Run functional testing commands concurrently against the same server.
+
+Each command is called with the server port and the database name as
+arguments, and its output is written to ``<prefix><log name>.log`` (see
+:func:`log_names`).
+A summary of exit codes is printed at the end, and the exit code is 1 if
+any of the commands failed.
+"""
+
+import os
+import sys
+import time
+import threading
+from subprocess import Popen
+from subprocess import STDOUT
+from argparse import ArgumentParser
+
+parser = ArgumentParser()
+parser.add_argument('--jobs', type=int, default=2,
+                    help="Maximum number of concurrent commands "
+                    "(default: %(default)s)")
+parser.add_argument('--port', required=True)
+parser.add_argument('--db', required=True)
+parser.add_argument('--log-prefix', default='functional-')
+parser.add_argument('commands', nargs='+')
+
+
+def log_names(commands):
+    """Return a distinct log name for each of commands, in the same order.
+
+    The log name is the base name of the command, unless several commands
+    share it: then the whole path is used, with slashes replaced by
+    underscores, and suffixed with the position of the command if it is
+    given more than once.
+
+    This is also used master-side, to declare the logs of the step.
+    """
+    basenames = [os.path.basename(cmd) for cmd in commands]
+    names = [basenames.count(base) > 1 and cmd.strip('./').replace('/', '_')
+             or base for cmd, base in zip(commands, basenames)]
+    return [names.count(name) > 1 and '%s-%d' % (name, i + 1) or name
+            for i, name in enumerate(names)]
+
+
+def run(index, command, log_name, arguments, semaphore, results):
+    with semaphore:
+        start = time.time()
+        with open(arguments.log_prefix + log_name + '.log', 'w') as log:
+            try:
+                code = Popen([command, arguments.port, arguments.db],
+                             stdout=log, stderr=STDOUT).wait()
+            except OSError, exc:
+                log.write("Could not run %r: %s\n" % (command, exc))
+                code = 127
+        results[index] = code, time.time() - start
+
+
+def main(argv=None):
+    arguments = parser.parse_args(argv)
+    semaphore = threading.BoundedSemaphore(arguments.jobs)
+    results = {}
+    commands = arguments.commands
+    threads = [threading.Thread(target=run,
+                                args=(i, cmd, name, arguments, semaphore,
+                                      results))
+               for i, (cmd, name) in enumerate(zip(commands,
+                                                   log_names(commands)))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    status = 0
+    for i, command in enumerate(commands):
+        code, duration = results[i]
+        print "%s: exit code %d (%.1fs)" % (command, code, duration)
+        if code != 0:
+            status = 1
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,95 @@
+"""Restrict a list of addons to those affected by a set of changed files.
+
+The changed files are read from a JSON file, as written master-side by
+:class:`anybox.buildbot.openerp.steps.ChangedFilesDownload`. Their paths
+are relative to the root of the repository they belong to, and are mapped
+to the addons directories according to the position of these in their own
+repositories.
+
+The selection is made of the addons from the given list that are changed,
+or that depend directly or indirectly on a changed addon. It is printed on
+standard output, as a comma separated list.
+
+In the following cases, the given list is printed as is:
+
+- there is no restriction (``null`` JSON value, for forced or periodic
+  builds),
+- the given list is ``all``,
+- some changed file does not belong to an addon (buildout configuration,
+  core Odoo/OpenERP code...)
+- some manifest can't be read without executing it (non literal
+  dependencies),
+- the selection is empty.
+"""
+
+import os
+import sys
+import json
+from argparse import ArgumentParser
+
+from odoo_addons import read_addons_path
+from odoo_addons import find_modules
+from odoo_addons import dependency_graph
+from odoo_addons import dependency_closure
+from odoo_addons import vcs_root
+from odoo_addons import ManifestError
+
+parser = ArgumentParser()
+parser.add_argument('--config', required=True,
+                    help="Odoo configuration file, to read the addons path")
+parser.add_argument('--addons', required=True,
+                    help="Comma separated list of addons to select from")
+parser.add_argument('--changed-files', default='changed_files.json')
+
+
+def changed_modules(addons_path, changed_files):
+    """Return the set of modules containing the changed files.
+
+    :return: ``None`` if some of the files does not belong to any module.
+    """
+    prefixes = []
+    for name, path in find_modules(addons_path).items():
+        root, _ = vcs_root(path)
+        if root is not None:
+            prefixes.append((os.path.relpath(path, root) + '/', name))
+
+    modules = set()
+    for changed in changed_files:
+        for prefix, name in prefixes:
+            if changed.startswith(prefix):
+                modules.add(name)
+                break
+        else:
+            sys.stderr.write("%r is not part of any addon\n" % changed)
+            return None
+    return modules
+
+
+def select(addons_path, addons, changed_files):
+    changed = changed_modules(addons_path, changed_files)
+    if changed is None:
+        return addons
+    try:
+        graph = dependency_graph(addons_path)
+    except ManifestError, exc:
+        sys.stderr.write("%s, selecting all addons\n" % exc)
+        return addons
+    selection = [a for a in addons
+                 if changed.intersection(dependency_closure(graph, (a,)))]
+    return selection or addons
+
+
+def main():
+    arguments = parser.parse_args()
+    addons = [a.strip() for a in arguments.addons.split(',') if a.strip()]
+    with open(arguments.changed_files) as f:
+        changed_files = json.load(f)
+
+    if changed_files is not None and 'all' not in addons:
+        addons_path = read_addons_path(arguments.config)
+        addons = select(addons_path, addons, changed_files)
+    print ','.join(addons)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,196 @@
+"""Run the tests of a list of addons in several concurrent shards.
+
+The addons are partitioned along the dependency graph: addons that depend
+on each other are kept in the same shard, and the resulting groups are
+spread over the shards so as to balance the number of modules each shard
+has to install, dependencies included.
+
+Each shard runs the test command against its own copy of the testing
+database, on its own port. The ports are taken every ``--port-step`` from
+``--port``, the start of a block of ports leased to the build for all the
+shards (see ``port_lease.py``). The shards logs are merged into the main
+log file as they grow, so that the analysis can be made live. The shard
+databases are dropped in the end, even if the run is interrupted.
+"""
+
+import os
+import re
+import sys
+import time
+import signal
+from subprocess import Popen
+from subprocess import call
+from argparse import ArgumentParser
+
+from odoo_addons import read_addons_path
+from odoo_addons import dependency_graph
+from odoo_addons import dependency_closure
+from odoo_addons import ManifestError
+
+POLL_INTERVAL = 1
+
+RECORD_START = re.compile(r'^\d{4}-\d\d-\d\d \d\d:\d\d:\d\d', re.MULTILINE)
+
+parser = ArgumentParser()
+parser.add_argument('--config', required=True,
+                    help="Odoo configuration file, to read the addons path")
+parser.add_argument('--db', required=True,
+                    help="The testing database, to be cloned for each shard")
+parser.add_argument('--addons', required=True,
+                    help="Comma separated list of addons to test")
+parser.add_argument('--shards', type=int, default=0,
+                    help="Number of shards (defaults to the number of CPUs)")
+parser.add_argument('--test-command', required=True)
+parser.add_argument('--logfile', default='test.log')
+parser.add_argument('--port', type=int, required=True,
+                    help="First port of the block leased for all shards")
+parser.add_argument('--port-step', type=int, default=5)
+
+
+def psql(sql):
+    return call(['psql', '-X', '-q', '-v', 'ON_ERROR_STOP=1',
+                 'postgres', '-c', sql])
+
+
+def groups(graph, addons):
+    """Group the addons that depend on each other.
+
+    :return: list of (addons, closure) pairs, where closure is the set of
+             all modules to install for these addons.
+    """
+    closures = dict((a, dependency_closure(graph, (a,))) for a in addons)
+    result = []
+    for addon in addons:
+        merged = [addon], set(closures[addon])
+        remaining = []
+        for group in result:
+            if addon in group[1] or any(g in merged[1] for g in group[0]):
+                merged[0].extend(group[0])
+                merged[1].update(group[1])
+            else:
+                remaining.append(group)
+        result = remaining + [merged]
+    return result
+
+
+def partition(graph, addons, nb_shards):
+    """Spread the addons over at most nb_shards lists.
+
+    Groups are taken by decreasing size and each is put in the shard for
+    which it adds the least modules to install, so that shards that have
+    dependencies in common tend to be chosen first.
+    """
+    shards = [([], set()) for _ in range(nb_shards)]
+    for addons, closure in sorted(groups(graph, addons),
+                                  key=lambda g: len(g[1]), reverse=True):
+        best = min(shards, key=lambda s: (len(s[1] | closure), len(s[0])))
+        best[0].extend(addons)
+        best[1].update(closure)
+    return [sorted(s[0]) for s in shards if s[0]]
+
+
+class ShardLog(object):
+    """Incremental reader of the log of a running shard.
+
+    Only complete records are given out, a record being a line starting
+    with a timestamp and the lines that follow it (tracebacks...), so that
+    records of concurrent shards don't get interleaved in the merged log.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.offset = 0
+        self.pending = ''
+
+    def read(self, final=False):
+        try:
+            with open(self.path) as f:
+                f.seek(self.offset)
+                data = f.read()
+        except IOError:
+            data = ''
+        self.offset += len(data)
+        self.pending += data
+        if final:
+            cut = len(self.pending)
+        else:
+            # the last record may still be continued
+            starts = [m.start() for m in RECORD_START.finditer(self.pending)]
+            cut = starts[-1] if starts else 0
+        out, self.pending = self.pending[:cut], self.pending[cut:]
+        return out
+
+
+def main():
+    arguments = parser.parse_args()
+    addons = [a.strip() for a in arguments.addons.split(',') if a.strip()]
+    nb_shards = arguments.shards or os.sysconf('SC_NPROCESSORS_ONLN')
+
+    if 'all' in addons:
+        print "Can't shard the 'all' pseudo addon, running a single shard"
+        shards = [addons]
+    else:
+        try:
+            graph = dependency_graph(read_addons_path(arguments.config))
+        except ManifestError, exc:
+            print "%s, running a single shard" % exc
+            shards = [addons]
+        else:
+            shards = partition(graph, addons, nb_shards)
+
+    # buildbot interrupts steps with SIGTERM first: clean up all the same
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(128 + signum))
+
+    ports = [arguments.port + i * arguments.port_step
+             for i in range(len(shards))]
+    logfile = os.path.abspath(arguments.logfile)
+    processes = []
+    status = 0
+    # the merged log is followed by the step while the shards run
+    merged = open(logfile, 'w')
+    try:
+        for i, (shard, port) in enumerate(zip(shards, ports)):
+            db = '%s_shard%d' % (arguments.db, i)
+            shard_log = '%s.shard%d' % (logfile, i)
+            if os.path.exists(shard_log):
+                os.unlink(shard_log)
+            psql('DROP DATABASE IF EXISTS "%s"' % db)
+            sql = 'CREATE DATABASE "%s" TEMPLATE "%s"' % (db, arguments.db)
+            if psql(sql) != 0:
+                print "Could not create database %r for shard %d" % (db, i)
+                status = 1
+                break
+            print "Shard %d (database %r, port %d): %s" % (
+                i, db, port, ','.join(shard))
+            sys.stdout.flush()
+            processes.append((db, ShardLog(shard_log), Popen(
+                arguments.test_command.split() + [
+                    '-d', db, '-i', ','.join(shard),
+                    '--logfile=' + shard_log,
+                    '--xmlrpc-port=%d' % port])))
+
+        running = dict((i, proc) for i, (db, log, proc)
+                       in enumerate(processes))
+        while running:
+            time.sleep(POLL_INTERVAL)
+            for i, (db, log, proc) in enumerate(processes):
+                code = proc.poll() if i in running else None
+                merged.write(log.read(final=code is not None))
+                if code is not None:
+                    del running[i]
+                    print "Shard %d finished with exit code %d" % (i, code)
+                    sys.stdout.flush()
+                    status = status or code
+            merged.flush()
+    finally:
+        merged.close()
+        for db, log, proc in processes:
+            if proc.poll() is None:
+                proc.terminate()
+                proc.wait()
+            psql('DROP DATABASE IF EXISTS "%s"' % db)
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
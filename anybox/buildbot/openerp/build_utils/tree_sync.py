@@ -0,0 +1,336 @@
+"""Upload a directory tree to the master, transferring changed files only.
+
+This is made of two halves, the ``pack`` command being run slave-side, and
+the ``apply`` command master-side.
+
+The master keeps a manifest of the content hashes of the uploaded files,
+as ``.tree-manifest.json`` in the target directory. The slave compares it
+to the tree to upload, and packs the new and changed files in an archive,
+along with the new manifest. Then the master extracts the archive in the
+target directory, removes the files that aren't in the new manifest
+anymore, and sets the permissions on the written files only (readable by
+all, directories being also traversable by all).
+
+For trees that are uploaded in a new place for each build, and are
+largely identical from one build to the next (coverage HTML reports, for
+instance), the deduplicating variant relies on a content-addressed store of
+blobs on the master:
+
+- ``manifest`` (slave): computes the manifest of the tree
+- ``missing`` (master): lists the hashes from the manifest that aren't in
+  the store yet
+- ``pack-blobs`` (slave): packs the missing blobs in an archive, named
+  after their hashes
+- ``link`` (master): adds the blobs to the store, with their final
+  permissions, and creates the tree as hard links to them.
+
+Blobs that aren't used by any tree anymore have a link count of 1, and can
+be removed from the store with ``find STORE -type f -links 1 -delete``.
+"""
+
+import os
+import sys
+import errno
+import json
+import shutil
+import hashlib
+import tarfile
+import tempfile
+from argparse import ArgumentParser
+
+MANIFEST_NAME = '.tree-manifest.json'
+
+parser = ArgumentParser()
+subparsers = parser.add_subparsers(dest='command')
+
+pack_parser = subparsers.add_parser(
+    'pack', help="Slave-side: pack the changes of a tree")
+pack_parser.add_argument('tree')
+pack_parser.add_argument('--previous',
+                         help="Master manifest of the previous upload. "
+                         "It gets removed once read, so that a failed "
+                         "download can't make it stale.")
+pack_parser.add_argument('--manifest', required=True,
+                         help="Where to write the new manifest")
+pack_parser.add_argument('--archive', required=True,
+                         help="Where to write the archive of changed files")
+pack_parser.add_argument('--exclude', action='append', default=[],
+                         help="Name of files or directories to ignore, "
+                         "wherever they are in the tree (can be repeated)")
+
+apply_parser = subparsers.add_parser(
+    'apply', help="Master-side: apply packed changes to the target")
+apply_parser.add_argument('target')
+apply_parser.add_argument('--manifest', required=True)
+apply_parser.add_argument('--archive', required=True)
+
+manifest_parser = subparsers.add_parser(
+    'manifest', help="Slave-side: write the manifest of a tree")
+manifest_parser.add_argument('tree')
+manifest_parser.add_argument('--manifest', required=True)
+manifest_parser.add_argument('--exclude', action='append', default=[])
+
+missing_parser = subparsers.add_parser(
+    'missing', help="Master-side: list the blobs missing from the store")
+missing_parser.add_argument('--store', required=True)
+missing_parser.add_argument('--manifest', required=True)
+missing_parser.add_argument('--missing', required=True,
+                            help="Where to write the list of missing hashes")
+
+blobs_parser = subparsers.add_parser(
+    'pack-blobs', help="Slave-side: pack the blobs missing from the store")
+blobs_parser.add_argument('tree')
+blobs_parser.add_argument('--manifest', required=True)
+blobs_parser.add_argument('--missing', required=True)
+blobs_parser.add_argument('--archive', required=True)
+
+link_parser = subparsers.add_parser(
+    'link', help="Master-side: store the blobs and link the tree to them")
+link_parser.add_argument('target')
+link_parser.add_argument('--store', required=True)
+link_parser.add_argument('--manifest', required=True)
+link_parser.add_argument('--archive', required=True)
+
+
+def file_hash(path):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(65536), ''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def tree_manifest(tree, exclude=()):
+    """Return a dict mapping relative paths of files in tree to their hashes.
+    """
+    manifest = {}
+    for dirpath, dirnames, filenames in os.walk(tree):
+        dirnames[:] = [d for d in dirnames if d not in exclude]
+        for fname in filenames:
+            if fname in exclude:
+                continue
+            path = os.path.join(dirpath, fname)
+            if os.path.islink(path):
+                continue
+            manifest[os.path.relpath(path, tree)] = file_hash(path)
+    return manifest
+
+
+def read_manifest(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return {}
+
+
+def write_json(obj, path):
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(obj, f)
+    os.rename(tmp, path)
+
+
+def pack(arguments):
+    previous = {}
+    if arguments.previous is not None:
+        previous = read_manifest(arguments.previous)
+        if os.path.exists(arguments.previous):
+            os.unlink(arguments.previous)
+
+    manifest = tree_manifest(arguments.tree, exclude=arguments.exclude)
+    changed = sorted(p for p, h in manifest.items() if previous.get(p) != h)
+    with tarfile.open(arguments.archive, 'w:gz') as archive:
+        for path in changed:
+            archive.add(os.path.join(arguments.tree, path), arcname=path,
+                        recursive=False)
+    write_json(manifest, arguments.manifest)
+    print "%d files changed out of %d" % (len(changed), len(manifest))
+    return 0
+
+
+def safe_path(target, relpath):
+    """Return the path of relpath in target, refusing to escape from it."""
+    path = os.path.normpath(os.path.join(target, relpath))
+    if os.path.isabs(relpath) or not path.startswith(
+            os.path.join(target, '')):
+        raise ValueError("Unsafe path in archive: %r" % relpath)
+    return path
+
+
+def makedirs(path):
+    """Create the missing parent directories of path, with mode 755."""
+    missing = []
+    parent = os.path.dirname(path)
+    while not os.path.isdir(parent):
+        missing.append(parent)
+        parent = os.path.dirname(parent)
+    for directory in reversed(missing):
+        os.mkdir(directory)
+        os.chmod(directory, 0755)
+
+
+def write_file(target, relpath, fileobj, mode=0644):
+    """Write atomically, concurrent writes of the same path being safe."""
+    path = safe_path(target, relpath)
+    makedirs(path)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path),
+                               prefix='.tree-sync-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            shutil.copyfileobj(fileobj, f)
+        os.chmod(tmp, mode)
+        os.rename(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def remove_obsolete(target, previous, manifest):
+    for relpath in set(previous).difference(manifest):
+        path = safe_path(target, relpath)
+        if os.path.exists(path):
+            os.unlink(path)
+
+
+def apply_changes(arguments):
+    target = os.path.abspath(arguments.target)
+    if not os.path.isdir(target):
+        os.makedirs(target)
+        os.chmod(target, 0755)
+    manifest_path = os.path.join(target, MANIFEST_NAME)
+    previous = read_manifest(manifest_path)
+    manifest = read_manifest(arguments.manifest)
+
+    written = 0
+    with tarfile.open(arguments.archive, 'r:*') as archive:
+        for member in archive:
+            if not member.isfile():
+                continue
+            write_file(target, member.name, archive.extractfile(member))
+            written += 1
+
+    remove_obsolete(target, previous, manifest)
+    write_json(manifest, manifest_path)
+    os.chmod(manifest_path, 0644)
+    os.unlink(arguments.archive)
+    os.unlink(arguments.manifest)
+    print "%d files written, %d files in tree" % (written, len(manifest))
+    return 0
+
+
+def write_manifest(arguments):
+    manifest = tree_manifest(arguments.tree, exclude=arguments.exclude)
+    write_json(manifest, arguments.manifest)
+    print "%d files in tree" % len(manifest)
+    return 0
+
+
+def blob_path(store, digest):
+    return os.path.join(store, digest[:2], digest[2:])
+
+
+def list_missing(arguments):
+    manifest = read_manifest(arguments.manifest)
+    missing = sorted(set(h for h in manifest.values()
+                         if not os.path.exists(blob_path(arguments.store, h))))
+    write_json(missing, arguments.missing)
+    print "%d blobs missing out of %d" % (len(missing), len(manifest))
+    return 0
+
+
+def pack_blobs(arguments):
+    missing = set(read_manifest(arguments.missing))
+    manifest = read_manifest(arguments.manifest)
+    with tarfile.open(arguments.archive, 'w:gz') as archive:
+        for path, digest in sorted(manifest.items()):
+            if digest in missing:
+                archive.add(os.path.join(arguments.tree, path),
+                            arcname=digest, recursive=False)
+                missing.discard(digest)
+    if missing:
+        sys.stderr.write("%d blobs not found in tree\n" % len(missing))
+        return 1
+    return 0
+
+
+def link(path, blob):
+    """Make path a hard link to blob, or a copy if links are impossible."""
+    if os.path.exists(path) and os.path.samefile(path, blob):
+        return
+    tmp = path + '.tree-sync-tmp'
+    if os.path.lexists(tmp):
+        os.unlink(tmp)
+    try:
+        os.link(blob, tmp)
+    except OSError, exc:
+        if exc.errno not in (errno.EXDEV, errno.EMLINK, errno.EPERM):
+            raise
+        shutil.copy(blob, tmp)
+    os.rename(tmp, path)
+    if os.path.lexists(tmp):
+        # rename() does nothing if both are links to the same file
+        os.unlink(tmp)
+
+
+def link_tree(arguments):
+    store = os.path.abspath(arguments.store)
+    target = os.path.abspath(arguments.target)
+    if not os.path.isdir(target):
+        os.makedirs(target)
+        os.chmod(target, 0755)
+    manifest_path = os.path.join(target, MANIFEST_NAME)
+    previous = read_manifest(manifest_path)
+    manifest = read_manifest(arguments.manifest)
+
+    stored = 0
+    with tarfile.open(arguments.archive, 'r:*') as archive:
+        for member in archive:
+            if not member.isfile():
+                continue
+            if os.path.exists(blob_path(store, member.name)):
+                continue  # stored meanwhile by a concurrent upload
+            # a blob is named after its hash, we check it before storing
+            digest = hashlib.sha1()
+            blob = archive.extractfile(member)
+            for chunk in iter(lambda: blob.read(65536), ''):
+                digest.update(chunk)
+            if digest.hexdigest() != member.name:
+                raise ValueError("Corrupted blob %r" % member.name)
+            blob = archive.extractfile(member)
+            write_file(store, blob_path('', member.name), blob)
+            stored += 1
+
+    for relpath, digest in manifest.items():
+        if previous.get(relpath) == digest:
+            continue
+        path = safe_path(target, relpath)
+        makedirs(path)
+        link(path, blob_path(store, digest))
+
+    remove_obsolete(target, previous, manifest)
+    write_json(manifest, manifest_path)
+    os.chmod(manifest_path, 0644)
+    os.unlink(arguments.archive)
+    os.unlink(arguments.manifest)
+    print "%d blobs stored, %d files in tree" % (stored, len(manifest))
+    return 0
+
+
+COMMANDS = {
+    'pack': pack,
+    'apply': apply_changes,
+    'manifest': write_manifest,
+    'missing': list_missing,
+    'pack-blobs': pack_blobs,
+    'link': link_tree,
+}
+
+
+def main():
+    arguments = parser.parse_args()
+    return COMMANDS[arguments.command](arguments)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
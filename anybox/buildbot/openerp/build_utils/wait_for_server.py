@@ -0,0 +1,110 @@
+"""Wait for an Odoo/OpenERP server to be ready to serve requests.
+
+The server is first probed at the TCP level, then by an XML-RPC call to
+the ``version`` method of the ``common`` service, with exponential backoff
+between attempts. Any XML-RPC answer, even a fault, means the server is
+ready.
+
+On timeout, or if the server process is gone, the end of the server log is
+printed and the exit code is 1.
+"""
+
+import os
+import sys
+import time
+import errno
+import socket
+import xmlrpclib
+from argparse import ArgumentParser
+
+parser = ArgumentParser()
+parser.add_argument('--host', default='localhost')
+parser.add_argument('--port', type=int, required=True)
+parser.add_argument('--timeout', type=float, default=30,
+                    help="Maximum time to wait, in seconds "
+                    "(default: %(default)s)")
+parser.add_argument('--pidfile',
+                    help="Server pid file, to stop waiting if the process "
+                    "is gone")
+parser.add_argument('--logfile',
+                    help="Server log file, to report on failure")
+parser.add_argument('--log-lines', type=int, default=50,
+                    help="Number of server log lines to report on failure "
+                    "(default: %(default)s)")
+
+
+def tcp_ready(host, port):
+    try:
+        sock = socket.create_connection((host, port), timeout=2)
+    except socket.error:
+        return False
+    sock.close()
+    return True
+
+
+def xmlrpc_ready(host, port):
+    proxy = xmlrpclib.ServerProxy('http://%s:%d/xmlrpc/common' % (host, port))
+    try:
+        proxy.version()
+    except xmlrpclib.Fault:
+        return True
+    except (socket.error, xmlrpclib.ProtocolError):
+        return False
+    return True
+
+
+def process_alive(pidfile):
+    try:
+        with open(pidfile) as f:
+            pid = int(f.read().strip())
+    except (IOError, ValueError):
+        # start-stop-daemon may not have written it yet
+        return True
+    try:
+        os.kill(pid, 0)
+    except OSError, exc:
+        return exc.errno != errno.ESRCH
+    return True
+
+
+def tail(path, nb_lines):
+    try:
+        with open(path) as f:
+            return f.readlines()[-nb_lines:]
+    except IOError:
+        return ["(no log file %r)\n" % path]
+
+
+def wait(arguments):
+    start = time.time()
+    deadline = start + arguments.timeout
+    delay = 0.2
+    while True:
+        if arguments.pidfile and not process_alive(arguments.pidfile):
+            print "Server process is gone"
+            return False
+        if (tcp_ready(arguments.host, arguments.port) and
+                xmlrpc_ready(arguments.host, arguments.port)):
+            print "Server ready after %.1fs" % (time.time() - start)
+            return True
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            print "Server not ready after %.1fs" % arguments.timeout
+            return False
+        time.sleep(min(delay, remaining))
+        delay = min(delay * 2, 5)
+
+
+def main():
+    arguments = parser.parse_args()
+    socket.setdefaulttimeout(10)
+    if wait(arguments):
+        return 0
+    if arguments.logfile:
+        print "Last lines of the server log:"
+        sys.stdout.writelines(tail(arguments.logfile, arguments.log_lines))
+    return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,5 +1,9 @@
 import random
+from collections import deque
 from twisted.python import log
+from buildbot.status.base import StatusReceiverMultiService
+from buildbot.status.results import SUCCESS
+from buildbot.status.results import WARNINGS
 
 
 def loggingNextSlave(builder, slaves):
@@ -44,3 +48,172 @@ def priorityAwareNextSlave(builder, slaves, get_priority=slaveBuilderPriority):
             highest_slaves.append(slave)
 
     return random.choice(highest_slaves)
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+class SlaveStats(object):
+    """In-memory statistics about the slaves, for their selection.
+
+    These are the durations of the latest successful steps, per builder,
+    step and slave, and the latest resource usage summary of each slave
+    (see ``build_utils/resource_sampler.py``), that tells about its load
+    average and free disk space.
+    """
+
+    def __init__(self, history=20):
+        self.history = history
+        self.durations = {}  # (builder, step) -> {slave: deque of durations}
+        self.resources = {}  # slave -> latest resource usage summary
+
+    def record_step(self, builder, step, slave, duration):
+        per_slave = self.durations.setdefault((builder, step), {})
+        per_slave.setdefault(slave, deque(maxlen=self.history)).append(
+            duration)
+
+    def record_resources(self, slave, usage):
+        self.resources[slave] = usage
+
+    def slowness(self, slave, builder=None):
+        """Ratio of the slave's step durations to those of all slaves.
+
+        This is the mean over all steps run by the slave and at least
+        another one, of the ratio of medians. If builder is specified, only
+        its steps are considered, unless there aren't any.
+        Return 1.0 if there's no data to compare to.
+        """
+        keys = self.durations.keys()
+        if builder is not None:
+            keys = [k for k in keys if k[0] == builder] or keys
+        ratios = []
+        for key in keys:
+            per_slave = self.durations[key]
+            if slave not in per_slave or len(per_slave) < 2:
+                continue
+            overall = median(d for ds in per_slave.values() for d in ds)
+            if overall > 0:
+                ratios.append(float(median(per_slave[slave])) / overall)
+        if not ratios:
+            return 1.0
+        return sum(ratios) / len(ratios)
+
+
+SLAVE_STATS = SlaveStats()
+
+
+class SlaveStatsReceiver(StatusReceiverMultiService):
+    """Feed a :class:`SlaveStats` instance from build and step events."""
+
+    compare_attrs = ('stats',)
+
+    def __init__(self, stats=SLAVE_STATS):
+        StatusReceiverMultiService.__init__(self)
+        self.stats = stats
+
+    def setServiceParent(self, parent):
+        StatusReceiverMultiService.setServiceParent(self, parent)
+        self.master_status = self.parent
+        self.master_status.subscribe(self)
+        # builds running across a reconfig have been subscribed to by the
+        # previous instance only
+        for name in self.master_status.getBuilderNames():
+            builder = self.master_status.getBuilder(name)
+            for build in builder.getCurrentBuilds():
+                build.subscribe(self)
+
+    def disownServiceParent(self):
+        self.master_status.unsubscribe(self)
+        return StatusReceiverMultiService.disownServiceParent(self)
+
+    def builderAdded(self, name, builder):
+        return self  # subscribe to builds
+
+    def buildStarted(self, name, build):
+        return self  # subscribe to steps
+
+    def stepFinished(self, build, step, results):
+        start, end = step.getTimes()
+        if start is None or end is None or results[0] not in (SUCCESS,
+                                                              WARNINGS):
+            return
+        self.stats.record_step(build.getBuilder().getName(), step.getName(),
+                               build.getSlavename(), end - start)
+
+    def buildFinished(self, name, build, results):
+        for prop, value, source in build.getProperties().asList():
+            if prop.startswith('resources_') and isinstance(value, dict):
+                self.stats.record_resources(build.getSlavename(), value)
+
+
+def default_score(slave_builder, stats, builder_name=None,
+                  busy_weight=1.0, slowness_weight=0.5, load_weight=0.5,
+                  min_disk_free=1024 * 1024, disk_penalty=10.0):
+    """Score a slave for a build: the higher, the better.
+
+    Starts from the ``slave_priority`` property, and subtracts:
+
+    - the fraction of ``max_builds`` (or the number if unlimited) of running
+      builds, times ``busy_weight``
+    - how much slower than the others the slave has been recently
+      (see :meth:`SlaveStats.slowness`), times ``slowness_weight``
+    - the latest reported load average per CPU, times ``load_weight``
+    - ``disk_penalty`` if the latest reported free disk space is below
+      ``min_disk_free`` (in kB).
+
+    Use :func:`functools.partial` to change the weights.
+    """
+    slave = slave_builder.slave
+    score = slaveBuilderPriority(slave_builder)
+
+    busy = sum(1 for sb in slave.slavebuilders.values() if sb.isBusy())
+    if slave.max_builds:
+        busy = float(busy) / slave.max_builds
+    score -= busy_weight * busy
+
+    score -= slowness_weight * (
+        stats.slowness(slave.slavename, builder=builder_name) - 1)
+
+    usage = stats.resources.get(slave.slavename, {})
+    if 'load_avg' in usage:
+        score -= load_weight * usage['load_avg'] / (usage.get('cpus') or 1)
+    if usage.get('disk_free', min_disk_free) < min_disk_free:
+        score -= disk_penalty
+    return score
+
+
+def rank_slaves(builder, slaves, score=default_score, stats=SLAVE_STATS):
+    """Return (score, slave builder) pairs, the best ones first."""
+    builder_name = getattr(builder, 'name', None)
+    scored = [(score(slb, stats, builder_name=builder_name), slb)
+              for slb in slaves]
+    scored.sort(key=lambda s: s[0], reverse=True)
+    return scored
+
+
+class LoadAwareNextSlave(object):
+    """A ``nextSlave`` function taking the slaves load into account.
+
+    It picks randomly among the slaves having the best score, according to
+    the ``score`` function (see :func:`default_score` for the signature),
+    that relies on the statistics gathered by a :class:`SlaveStatsReceiver`
+    (the configurator adds one when the instance is its ``next_slave``).
+    """
+
+    def __init__(self, score=default_score, stats=SLAVE_STATS):
+        self.score = score
+        self.stats = stats
+
+    def __call__(self, builder, slaves):
+        if not slaves:
+            return
+        ranked = rank_slaves(builder, slaves, score=self.score,
+                             stats=self.stats)
+        best = ranked[0][0]
+        return random.choice([slb for score, slb in ranked
+                              if best - score < 1e-6])
+
+
+loadAwareNextSlave = LoadAwareNextSlave()
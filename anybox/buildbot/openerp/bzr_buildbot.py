@@ -210,7 +210,7 @@ if DEFINE_POLLER:
                 url = 'bzr+ssh://bazaar.launchpad.net/' + url[3:]
             self.url = url
             self.poll_interval = poll_interval
-            self.loop = twisted.internet.task.LoopingCall(self.poll)
+            self.loop = twisted.internet.task.LoopingCall(self.doPoll)
             self.blame_merge_author = blame_merge_author
             self.branch_name = branch_name
             self.category = category
@@ -295,6 +295,15 @@ if DEFINE_POLLER:
         def describe(self):
             return "BzrPoller watching %s" % self.url
 
+        def doPoll(self):
+            """Called by the loop, looking up poll() at each call.
+
+            Failures are logged, and polling goes on.
+            """
+            d = twisted.internet.defer.maybeDeferred(self.poll)
+            d.addErrback(twisted.python.log.err, 'while polling for changes')
+            return d
+
         @twisted.internet.defer.inlineCallbacks
         def poll(self):
             if self.polling: # this is called in a loop, and the loop might
@@ -307,19 +316,14 @@ if DEFINE_POLLER:
                 # On a big tree, even individual elements of the bzr commands
                 # can take awhile. So we just push the bzr work off to a
                 # thread.
-                try:
-                    changes = yield twisted.internet.threads.deferToThread(
-                        self.getRawChanges)
-                except (SystemExit, KeyboardInterrupt):
-                    raise
-                except:
-                    # we'll try again next poll.  Meanwhile, let's report.
-                    twisted.python.log.err()
-                else:
-                    for change in changes:
-                        yield self.addChange(change)
-                        self.last_revision = change['revision']
-                        yield self._setLastRevision(self.last_revision)
+                # Failures are reported by doPoll(), and we'll try again
+                # next poll.
+                changes = yield twisted.internet.threads.deferToThread(
+                    self.getRawChanges)
+                for change in changes:
+                    yield self.addChange(change)
+                    self.last_revision = change['revision']
+                    yield self._setLastRevision(self.last_revision)
             finally:
                 self.polling = False
 
@@ -1,4 +1,5 @@
 import os
+import time
 import logging
 import warnings
 from collections import OrderedDict
@@ -10,6 +11,7 @@ from buildbot.buildslave import BuildSlave
 from buildbot import locks
 from buildbot.process.factory import BuildFactory
 from steps import PgSetProperties
+from steps import ObservedShellCommand
 from buildbot.steps.shell import ShellCommand
 from buildbot.steps.transfer import FileDownload
 from buildbot.steps.transfer import FileUpload
@@ -22,8 +24,14 @@ from . import capability
 from . import watch
 from . import subfactories
 from . import buildouts
+from . import telemetry
+from . import metrics
+from . import buildslave
 
 from .utils import BUILD_UTILS_PATH
+from .utils import BUILDOUT_CACHES
+from .utils import bool_opt
+from .subfactories.postbuildout import resource_sampling
 from .constants import DEFAULT_BUILDOUT_PART
 from .buildslave import priorityAwareNextSlave
 from .version import VersionFilter
@@ -75,6 +83,30 @@ class BuildoutsConfigurator(object):
 
     tree_stable_timer = 600
 
+    telemetry_db = None
+    """Path to the SQLite database of steps timings, relative to buildmaster.
+
+    If set, a status receiver recording them is added by :meth:`populate`
+    (see :mod:`telemetry`).
+    """
+
+    next_slave = staticmethod(priorityAwareNextSlave)
+    """The ``nextSlave`` function of all builders.
+
+    For load-aware slave selection, set it to
+    :data:`buildslave.loadAwareNextSlave`, or to another instance of
+    :class:`buildslave.LoadAwareNextSlave` with a custom scoring function.
+    :meth:`populate` then adds the status receiver that gathers the
+    statistics it needs.
+    """
+
+    metrics_port = None
+    """Port to serve the master metrics on, as a strports description.
+
+    For instance, ``'tcp:9101:interface=127.0.0.1'``. If set, a status
+    receiver serving them is added by :meth:`populate` (see :mod:`metrics`).
+    """
+
     def __init__(self, buildmaster_dir,
                  manifest_paths=('buildouts/MANIFEST.cfg',),
                  slaves_path='slaves.cfg',
@@ -97,6 +129,7 @@ class BuildoutsConfigurator(object):
         self.capabilities[capability_name] = options2environ
 
     def populate(self, config):
+        start = time.time()
         config.setdefault('slaves', []).extend(
             self.make_slaves(self.slaves_path))
         map(self.register_build_factories, self.manifest_paths)
@@ -105,6 +138,25 @@ class BuildoutsConfigurator(object):
         self.init_watch()
         config.setdefault('change_source', []).extend(self.make_pollers())
         config.setdefault('schedulers', []).extend(self.make_schedulers())
+        if self.telemetry_db is not None:
+            config.setdefault('status', []).append(
+                telemetry.TelemetryStatusReceiver(
+                    self.path_from_buildmaster(self.telemetry_db),
+                    capability_properties=[
+                        cap['version_prop']
+                        for cap in self.capabilities.values()
+                        if 'version_prop' in cap]))
+        slave_stats = getattr(self.next_slave, 'stats', None)
+        if slave_stats is not None:
+            config.setdefault('status', []).append(
+                buildslave.SlaveStatsReceiver(slave_stats))
+        if self.metrics_port is not None:
+            config.setdefault('status', []).append(
+                metrics.MetricsStatusReceiver(self.metrics_port))
+        metrics.REGISTRY.set('buildbot_reconfig_duration_seconds',
+                             time.time() - start)
+        metrics.REGISTRY.set('buildbot_reconfig_timestamp_seconds',
+                             time.time())
 
     def path_from_buildmaster(self, path):
         """Interpret a path relatively to buildmaster_dir.
@@ -254,6 +306,8 @@ class BuildoutsConfigurator(object):
                         download
         :db-steps: list of subfactories to call for database
                    initialisation. Defaults to ``['simple_create']``.
+                   Those having a ``pre_buildout_steps`` attribute get
+                   it called to insert steps right before the buildout.
         :post-buildout-steps: list of subfactories to call for actual
                               test/build once the buildout is ready. Defaults
                               to ``['install-modules-test']``,
@@ -268,11 +322,18 @@ class BuildoutsConfigurator(object):
                      to the master so that watch directives can be updated.
                      This depends on the master being reconfig'ed regularly
                      enough, e.g, by a cron job.
+        :resources.sample: if ``True``, the buildout and main testing steps
+                           report their resource usage (see
+                           ``resource_sampling`` in
+                           :mod:`subfactories.postbuildout`)
         """
         factory = BuildFactory()
         self.register_build_factory(name, factory)
         options = self.build_manifests[name]['options']
 
+        # the builder's parent directory is the slave's base directory:
+        # all bzr branches created by builds on this slave (buildout, addons)
+        # end up in this slave-wide shared repository
         factory.addStep(ShellCommand(command=['bzr', 'init-repo', '..'],
                                      name="bzr repo",
                                      description="init bzr repo",
@@ -307,6 +368,11 @@ class BuildoutsConfigurator(object):
             mastersrc=os.path.join(
                 BUILD_UTILS_PATH, 'analyze_oerp_tests.py'),
             slavedest='analyze_oerp_tests.py'))
+        if bool_opt(options, 'resources.sample'):
+            factory.addStep(FileDownload(
+                mastersrc=os.path.join(BUILD_UTILS_PATH,
+                                       'resource_sampler.py'),
+                slavedest='resource_sampler.py'))
 
         factory.addStep(PgSetProperties(
             name, description=["Setting", "Testing DB", "property"],
@@ -314,8 +380,21 @@ class BuildoutsConfigurator(object):
             name="pg_cluster_props",
         ))
 
+        db_subfactories = [
+            subfactories.db_handling[line.strip()]
+            for line in options.get('db-steps',
+                                    'simple_create').split(os.linesep)
+            if line]
+        for subfactory in db_subfactories:
+            # some database subfactories have to act before buildout, e.g.,
+            # to provide the PostgreSQL cluster it will be configured with
+            pre_buildout_fun = getattr(subfactory, 'pre_buildout_steps', None)
+            if pre_buildout_fun is not None:
+                map(factory.addStep, pre_buildout_fun(self, options,
+                                                      environ=capability_env))
+
         buildout_part = options.get('buildout-part', DEFAULT_BUILDOUT_PART)
-        cache = '%(builddir)s/../buildout-caches'
+        cache = BUILDOUT_CACHES
         eggs_cache = cache + '/eggs'
         openerp_cache = cache + '/openerp'
         factory.addStep(ShellCommand(command=['mkdir', '-p',
@@ -355,14 +434,18 @@ class BuildoutsConfigurator(object):
         buildout_db_name_option = WithProperties(
             buildout_part + ':options.db_name=%(testing_db)s')
 
+        buildout_cmd, sampling_observers = resource_sampling(
+            options,
+            ['bin/buildout', '-c', buildout_slave_path] +
+            buildout_cache_options +
+            buildout_vcs_options + buildout_pgcnx_options +
+            [buildout_part + ':with_devtools=true',
+             'buildout:unzip=true',
+             buildout_db_name_option])
         factory.addStep(
-            ShellCommand(
-                command=['bin/buildout', '-c', buildout_slave_path] +
-                buildout_cache_options +
-                buildout_vcs_options + buildout_pgcnx_options +
-                [buildout_part + ':with_devtools=true',
-                 'buildout:unzip=true',
-                 buildout_db_name_option],
+            ObservedShellCommand(
+                command=buildout_cmd,
+                log_observers=sampling_observers,
                 name="buildout",
                 description="buildout",
                 timeout=3600 * 4,
@@ -398,12 +481,7 @@ class BuildoutsConfigurator(object):
                 masterdest=watch.watchfile_path(self.buildmaster_dir, name),
                 mode=0644))
 
-        for line in options.get('db-steps',
-                                'simple_create').split(os.linesep):
-            if not line:
-                continue
-
-            subfactory = subfactories.db_handling[line.strip()]
+        for subfactory in db_subfactories:
             map(factory.addStep, subfactory(self, options,
                                             environ=capability_env))
             register_cleanups(subfactory)
@@ -514,7 +592,7 @@ class BuildoutsConfigurator(object):
                     'build-category', '').strip(),
                 build_for=factory.build_for,
                 build_requires=factory.build_requires,
-                next_slave=priorityAwareNextSlave,
+                next_slave=self.next_slave,
             )
             builders.extend(fact_builders)
             fact_to_builders[fact_name] = [b.name for b in fact_builders]
@@ -1,2 +1,3 @@
 CAPABILITY_PROP_FMT = 'cap_%s_%s'
 DEFAULT_BUILDOUT_PART = 'openerp'
+ARCHIVE_FORMATS = ('tar.bz2', 'tar.gz', 'tar.xz', 'tar.zst')
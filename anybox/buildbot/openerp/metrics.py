@@ -0,0 +1,185 @@
+"""In-memory metrics about the master health, in text exposition format.
+
+Metrics are kept in a module level :data:`REGISTRY`, fed by:
+
+- :meth:`BuildoutsConfigurator.populate`: duration and time of the latest
+  reconfig,
+- the pollers, once wrapped by :func:`instrument_poller`: duration of the
+  latest poll, number of polls and of errors,
+- :class:`MetricsStatusReceiver`: unclaimed build requests per builder and
+  slaves per state, refreshed at a regular interval, so that serving the
+  metrics never queries the database.
+
+The :class:`MetricsStatusReceiver` also serves them over HTTP, in the
+Prometheus text exposition format, typically bound to the loopback
+interface only.
+"""
+
+import time
+from collections import OrderedDict
+
+from twisted.python import log
+from twisted.internet import defer
+from twisted.application import internet
+from twisted.application import strports
+from twisted.web import resource
+from twisted.web import server
+from buildbot.status.base import StatusReceiverMultiService
+
+METRICS = (
+    ('buildbot_pending_build_requests', 'gauge',
+     "Unclaimed build requests per builder"),
+    ('buildbot_slaves', 'gauge',
+     "Number of slaves per state (busy, idle, disconnected)"),
+    ('buildbot_poll_duration_seconds', 'gauge',
+     "Duration of the latest poll"),
+    ('buildbot_polls_total', 'counter', "Number of polls"),
+    ('buildbot_poll_errors_total', 'counter', "Number of failed polls"),
+    ('buildbot_reconfig_duration_seconds', 'gauge',
+     "Duration of the latest configuration population"),
+    ('buildbot_reconfig_timestamp_seconds', 'gauge',
+     "Time of the latest configuration population"),
+)
+
+
+def escape_label(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace(
+        '\n', r'\n')
+
+
+class MetricsRegistry(object):
+    """Gauges and counters, with labels."""
+
+    def __init__(self, metrics=METRICS):
+        self.metrics = OrderedDict()
+        for name, kind, doc in metrics:
+            self.metrics[name] = (kind, doc, {})
+
+    def samples(self, name):
+        """Return the dict of values by sorted (label, value) tuples."""
+        return self.metrics[name][2]
+
+    def set(self, name, value, **labels):
+        self.samples(name)[tuple(sorted(labels.items()))] = value
+
+    def inc(self, name, amount=1, **labels):
+        samples = self.samples(name)
+        key = tuple(sorted(labels.items()))
+        samples[key] = samples.get(key, 0) + amount
+
+    def get(self, name, **labels):
+        return self.samples(name).get(tuple(sorted(labels.items())))
+
+    def clear(self, name):
+        self.samples(name).clear()
+
+    def render(self):
+        lines = []
+        for name, (kind, doc, samples) in self.metrics.items():
+            lines.append('# HELP %s %s' % (name, doc))
+            lines.append('# TYPE %s %s' % (name, kind))
+            for labels, value in sorted(samples.items()):
+                if labels:
+                    lines.append('%s{%s} %r' % (name, ','.join(
+                        '%s="%s"' % (k, escape_label(v)) for k, v in labels),
+                        float(value)))
+                else:
+                    lines.append('%s %r' % (name, float(value)))
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = MetricsRegistry()
+
+
+def instrument_poller(poller, registry=REGISTRY, **labels):
+    """Wrap the ``poll`` method of poller to record metrics with labels.
+
+    Return the poller, for convenience.
+    """
+    poll = poller.poll
+
+    def instrumented_poll():
+        start = time.time()
+
+        def done(result, failed=False):
+            registry.set('buildbot_poll_duration_seconds',
+                         time.time() - start, **labels)
+            registry.inc('buildbot_polls_total', **labels)
+            if failed:
+                registry.inc('buildbot_poll_errors_total', **labels)
+            return result
+
+        d = defer.maybeDeferred(poll)
+        d.addCallbacks(done, done, errbackKeywords=dict(failed=True))
+        return d
+
+    poller.poll = instrumented_poll
+    # errors appear even if no poll has failed yet
+    registry.inc('buildbot_poll_errors_total', amount=0, **labels)
+    return poller
+
+
+class MetricsResource(resource.Resource):
+
+    isLeaf = True
+
+    def __init__(self, registry=REGISTRY):
+        resource.Resource.__init__(self)
+        self.registry = registry
+
+    def render_GET(self, request):
+        request.setHeader('Content-Type', 'text/plain; version=0.0.4')
+        return self.registry.render()
+
+
+class MetricsStatusReceiver(StatusReceiverMultiService):
+    """Serve the metrics, and refresh those that come from the master.
+
+    :param port: a strports description, e.g., ``'tcp:9101:interface=::1'``
+    :param refresh_interval: seconds between two refreshes of the build
+                             requests and slaves metrics.
+    """
+
+    compare_attrs = ('port', 'refresh_interval')
+
+    def __init__(self, port, refresh_interval=30, registry=REGISTRY):
+        StatusReceiverMultiService.__init__(self)
+        self.port = port
+        self.refresh_interval = refresh_interval
+        self.registry = registry
+        strports.service(port, server.Site(MetricsResource(registry))
+                         ).setServiceParent(self)
+        internet.TimerService(refresh_interval, self.refresh
+                              ).setServiceParent(self)
+
+    @defer.inlineCallbacks
+    def refresh(self):
+        botmaster = self.master.botmaster
+        try:
+            requests = yield self.master.db.buildrequests.getBuildRequests(
+                claimed=False, complete=False)
+        except Exception:
+            log.err(None, "Could not refresh build requests metrics")
+        else:
+            pending = dict((name, 0) for name in botmaster.builderNames)
+            for request in requests:
+                name = request['buildername']
+                pending[name] = pending.get(name, 0) + 1
+            self.registry.clear('buildbot_pending_build_requests')
+            for name, count in pending.items():
+                self.registry.set('buildbot_pending_build_requests', count,
+                                  builder=name)
+
+        states = dict(busy=0, idle=0, disconnected=0)
+        for slave in botmaster.slaves.values():
+            states[slave_state(slave)] += 1
+        for state, count in states.items():
+            self.registry.set('buildbot_slaves', count, state=state)
+
+
+def slave_state(slave):
+    if not slave.isConnected():
+        return 'disconnected'
+    if any(sb.isBusy() for sb in slave.slavebuilders.values()):
+        return 'busy'
+    return 'idle'
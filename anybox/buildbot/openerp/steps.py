@@ -1,10 +1,16 @@
 """Common build steps."""
 
+import json
 from buildbot.process.buildstep import BuildStep
+from buildbot.process.buildstep import LogLineObserver
+from buildbot.steps.shell import ShellCommand
+from buildbot.steps.transfer import StringDownload
 from buildbot.process.buildstep import SUCCESS
 from buildbot.process.buildstep import FAILURE  # NOQA
 
 from .constants import CAPABILITY_PROP_FMT
+from .build_utils import analyze_oerp_tests
+from .build_utils import resource_sampler
 from .version import Version, VersionFilter
 
 
@@ -130,3 +136,143 @@ class SetCapabilityProperties(DescriptionBuildStep):
             self.setProperty(CAPABILITY_PROP_FMT % (self.capability_name, k),
                              v, 'capability')
         self.finished(SUCCESS)
+
+
+class ChangedFilesDownload(StringDownload):
+    """Download the list of files changed by the build changes, as JSON.
+
+    The JSON value is ``null`` if the build has no changes (forced or
+    periodic builds), meaning that there is no restriction to apply.
+    """
+
+    def __init__(self, slavedest='changed_files.json', **kw):
+        StringDownload.__init__(self, '', slavedest, **kw)
+
+    def changed_files(self):
+        changes = list(self.build.allChanges())
+        if not changes:
+            return None
+        return sorted(set(f for c in changes for f in c.files))
+
+    def start(self):
+        self.s = json.dumps(self.changed_files())
+        StringDownload.start(self)
+
+
+class ObservedShellCommand(ShellCommand):
+    """A ShellCommand with observers of its logs.
+
+    The observers can also contribute to the step text, through their
+    ``summary()`` method, if they have one.
+    """
+
+    def __init__(self, log_observers=(), **kw):
+        """
+
+        log_observers is an iterable of (log name, observer factory) pairs.
+        They are instantiated for each build.
+        """
+        ShellCommand.__init__(self, **kw)
+        self.log_observers = []
+        for logname, observer_factory in log_observers:
+            observer = observer_factory()
+            self.log_observers.append(observer)
+            self.addLogObserver(logname, observer)
+
+    def observers_summary(self):
+        text = []
+        for observer in self.log_observers:
+            summary = getattr(observer, 'summary', None)
+            if summary is not None:
+                text.extend(summary())
+        return text
+
+    def getText(self, cmd, results):
+        return ShellCommand.getText(self, cmd, results) + (
+            self.observers_summary())
+
+    def update_text(self):
+        """Refresh the running step text from all observers' summaries."""
+        self.step_status.setText(self.describe() + self.observers_summary())
+
+
+def update_step_text(observer):
+    """Have the step of observer display its summary.
+
+    On an ``ObservedShellCommand``, the text is composed by the step itself
+    from the summaries of all its observers, so that they don't overwrite
+    each other.
+    """
+    step = observer.step
+    update_text = getattr(step, 'update_text', None)
+    if update_text is not None:
+        update_text()
+    else:
+        step.step_status.setText(step.describe() + observer.summary())
+
+
+class OdooLogObserver(LogLineObserver):
+    """Detect failures in Odoo/OpenERP logs as they are streamed.
+
+    This uses the same patterns as ``build_utils/analyze_oerp_tests.py``.
+    If ``fail_fast`` is ``True``, the step is interrupted as soon as one of
+    the fatal patterns is met.
+    """
+
+    def __init__(self, fail_fast=False):
+        LogLineObserver.__init__(self)
+        self.fail_fast = fail_fast
+        self.scanner = analyze_oerp_tests.FailureScanner(max_examples=0)
+        self.interrupted = False
+
+    def outLineReceived(self, line):
+        label = self.scanner.feed(line)
+        if label is None:
+            return
+        update_step_text(self)
+
+        step = self.step
+        if (self.fail_fast and not self.interrupted and
+                label in analyze_oerp_tests.FATAL_LABELS):
+            self.interrupted = True
+            step.interrupt("Fail fast: %s" % line.strip())
+
+    def summary(self):
+        total = self.scanner.total()
+        if not total:
+            return []
+        return ["%d failure%s" % (total, total > 1 and 's' or '')]
+
+
+class ResourceUsageObserver(LogLineObserver):
+    """Collect the summary of ``build_utils/resource_sampler.py``.
+
+    The resource usage gets stored as step statistics, and as a build
+    property named after the step, e.g., ``resources_buildout``, for
+    later processing (telemetry, capacity planning).
+    """
+
+    def __init__(self):
+        LogLineObserver.__init__(self)
+        self.usage = None
+
+    def outLineReceived(self, line):
+        if not line.startswith(resource_sampler.SUMMARY_PREFIX):
+            return
+        try:
+            usage = json.loads(line[len(resource_sampler.SUMMARY_PREFIX):])
+        except ValueError:
+            return
+        self.usage = usage
+        step = self.step
+        for name, value in usage.items():
+            step.setStatistic(name, value)
+        step.setProperty('resources_' + step.name, usage, 'ResourceSampler')
+        update_step_text(self)
+
+    def summary(self):
+        if self.usage is None:
+            return []
+        return ["cpu %.0fs" % (self.usage['cpu_user'] +
+                               self.usage['cpu_system']),
+                "rss %dMB" % (self.usage['rss_peak'] // 1024)]
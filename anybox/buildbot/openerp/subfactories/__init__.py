@@ -13,7 +13,10 @@ buildout_download = dict(standalone=download.standalone_buildout,
                          )
 
 db_handling = dict(simple_create=db.simple_create,
-                   pg_remote_copy=db.pg_remote_copy)
+                   pg_remote_copy=db.pg_remote_copy,
+                   template_pool=db.template_pool,
+                   dump_cache=db.dump_cache,
+                   ephemeral_cluster=db.ephemeral_cluster)
 
 
 def deprecate(name, replacement, subfactory):
@@ -38,6 +41,7 @@ def deprecate(name, replacement, subfactory):
 
 post_buildout = {
     'install-modules-test': postbuildout.install_modules_test,
+    'install-modules-test-sharded': postbuildout.install_modules_test_sharded,
     'install-modules': postbuildout.install_modules,
     'update-openerp': postbuildout.update_modules,
     'nose': postbuildout.install_modules_nose,
@@ -1,6 +1,22 @@
+import os
+from buildbot import locks
 from buildbot.steps.shell import ShellCommand
+from buildbot.steps.shell import SetPropertyFromCommand
+from buildbot.steps.transfer import FileDownload
 from buildbot.process.properties import WithProperties
 from buildbot.process.properties import Property
+from ..utils import BUILD_UTILS_PATH
+from ..utils import BUILDOUT_CACHES
+from ..utils import PORT_LEASE_FILE
+from ..constants import DEFAULT_BUILDOUT_PART
+
+template_pool_lock = locks.SlaveLock("db-template-pool")
+
+DISABLED_MAIL_SERVER_SQL = (
+    "INSERT INTO ir_mail_server "
+    "(smtp_host, smtp_port, name, smtp_encryption) VALUES "
+    "('disabled.test', 25, "
+    "'Disabled (adresses in .test are unroutable)', 'none')")
 
 
 def simple_create(configurator, options, environ=()):
@@ -31,12 +47,7 @@ def simple_create(configurator, options, environ=()):
     steps.append(ShellCommand(
         command=[
             'psql', 'postgres', '-d', '{}'.format(Property('testing_db')), '-c',
-            WithProperties(
-                "INSERT INTO ir_mail_server "
-                "(smtp_host, smtp_port, name, smtp_encryption) VALUES "
-                "('disabled.test', 25, "
-                "'Disabled (adresses in .test are unroutable)', 'none'"
-            ),
+            WithProperties(DISABLED_MAIL_SERVER_SQL),
         ],
         name='create_disabled_outgoing_mail_server',
         description=["create_disabled_outgoing_mail_server", Property('testing_db')],
@@ -47,6 +58,42 @@ def simple_create(configurator, options, environ=()):
 
 
 def final_dropdb(configurator, options, environ=()):
+    """Final cleanup steps to drop the testing database.
+
+    options:
+
+    :db-cleanup: ``drop`` (the default) to drop the database synchronously,
+                 or ``deferred`` to rename it as a tombstone, to be dropped
+                 by a detached background reaper process.
+                 See ``build_utils/db_reaper.py``.
+    :db-cleanup.jobs: maximum number of concurrent drops by the reaper
+                      (defaults to 2)
+    """
+    mode = options.get('db-cleanup', 'drop').strip()
+    if mode == 'deferred':
+        return [
+            FileDownload(
+                mastersrc=os.path.join(BUILD_UTILS_PATH, 'db_reaper.py'),
+                slavedest='db_reaper.py',
+                haltOnFailure=False,
+                flunkOnFailure=False),
+            ShellCommand(
+                command=[
+                    'python', 'db_reaper.py',
+                    '--tombstone', Property('testing_db'),
+                    '--jobs', options.get('db-cleanup.jobs', '2').strip(),
+                    '--state-dir', WithProperties('%(builddir)s/..'),
+                    '--detach',
+                ],
+                name='final_dropdb',
+                description=["tombstone", Property('testing_db')],
+                env=environ,
+                haltOnFailure=False,
+                flunkOnFailure=False,
+            )]
+    elif mode != 'drop':
+        raise ValueError("db-cleanup must be either 'drop' or 'deferred'")
+
     return [
         ShellCommand(
             command=[
@@ -83,6 +130,9 @@ def pg_remote_copy(configurator, options, environ=()):
     :pg_remote_copy.timeout: time (seconds) allowed to complete the step.
                              Default is to use buildbot's default (1200 at the
                              time of this writing).
+
+    See also :func:`dump_cache`, for the case where the reference dump
+    is directly reachable from the slave.
     """
 
     steps = []
@@ -122,3 +172,213 @@ def pg_remote_copy(configurator, options, environ=()):
     return steps
 
 pg_remote_copy.final_cleanup_steps = final_dropdb
+
+
+def template_pool(configurator, options, environ=()):
+    """Create the testing database from a pool of pre-installed templates.
+
+    Templates have a base set of modules installed, and are identified by the
+    revisions of the addons and the list of modules. They are kept in the
+    PostgreSQL cluster, with LRU eviction.
+    See ``build_utils/db_template_pool.py`` for details.
+
+    options:
+
+    :db-template-pool.modules: comma separated list of modules to install in
+                               the templates. Defaults to ``base``.
+    :db-template-pool.size: maximum number of templates to keep in
+                            each cluster (defaults to 5)
+    :install.demo-data: (case-insensitive, ``'false'`` or ``'true'``,
+                        default=``'true'``). If ``'true'``, templates get
+                        the demo data.
+    :db_template: used as the template of templates, see
+                  :func:`simple_create`.
+    """
+    buildout_part = options.get('buildout-part', DEFAULT_BUILDOUT_PART)
+    command = [
+        'python', 'db_template_pool.py',
+        '--db', Property('testing_db'),
+        '--config', 'etc/%s.cfg' % buildout_part,
+        '--install-command', options.get('start-command',
+                                         'bin/start_' + buildout_part),
+        '--modules', options.get('db-template-pool.modules', 'base'),
+        '--pool-size', options.get('db-template-pool.size', '5').strip(),
+        '--source-template', options.get('db_template', 'template1'),
+        '--post-install-sql', DISABLED_MAIL_SERVER_SQL,
+    ]
+    with_demo = options.get('install.demo-data', 'true').lower()
+    if with_demo == 'false':
+        command.append('--without-demo')
+    elif with_demo != 'true':
+        raise ValueError("install.demo-data must be either 'true' or 'false'")
+
+    return [
+        FileDownload(
+            mastersrc=os.path.join(BUILD_UTILS_PATH, name),
+            slavedest=name,
+            haltOnFailure=True)
+        for name in ('odoo_addons.py', 'db_template_pool.py')
+    ] + [ShellCommand(
+        command=command,
+        name='createdb',
+        description=["createdb", "from", "template", "pool"],
+        descriptionDone=["createdb", Property('testing_db')],
+        locks=[template_pool_lock.access('exclusive')],
+        env=environ,
+        haltOnFailure=True,
+        timeout=3600,
+    )]
+
+template_pool.final_cleanup_steps = final_dropdb
+
+
+def dump_cache(configurator, options, environ=()):
+    """Mount the DB from a reference dump, through a slave-side cache.
+
+    The dump is kept in a content-addressed store shared by all builders of
+    the slave, and is transferred again only if the source has changed.
+    See ``build_utils/dump_cache.py`` for details.
+
+    options:
+
+    :dump_cache.source: URL, SSH location (``[user@]host:/path``) or local
+                        path of the dump (required). Dumps in PostgreSQL
+                        custom format are restored with parallel jobs.
+    :dump_cache.max-size: maximum size of the cache, in MB (defaults to
+                          10240)
+    :dump_cache.jobs: number of parallel jobs for ``pg_restore``
+                      (defaults to 4)
+    :dump_cache.timeout: time (seconds) allowed to complete the step.
+                         Default is to use buildbot's default.
+    """
+    steps = []
+    steps.append(ShellCommand(
+        command=[
+            'psql', 'postgres', '-c',
+            WithProperties('DROP DATABASE IF EXISTS "%(testing_db)s"'),
+        ],
+        name='dropdb',
+        description=["dropdb", Property('testing_db')],
+        env=environ,
+        haltOnFailure=True,
+    ))
+    steps.append(FileDownload(
+        mastersrc=os.path.join(BUILD_UTILS_PATH, 'dump_cache.py'),
+        slavedest='dump_cache.py',
+        haltOnFailure=True))
+
+    timeout = options.get('dump_cache.timeout')
+    if timeout is not None:
+        timeout = int(timeout.strip())
+
+    steps.append(ShellCommand(
+        command=['python', 'dump_cache.py',
+                 '--db', Property('testing_db'),
+                 '--source', options['dump_cache.source'].strip(),
+                 '--cache-dir', WithProperties(BUILDOUT_CACHES + '/dumps'),
+                 '--max-size', options.get('dump_cache.max-size',
+                                           '10240').strip(),
+                 '--jobs', options.get('dump_cache.jobs', '4').strip()],
+        name='dump_cache',
+        description=['restore', 'cached', 'dump'],
+        descriptionDone=['restored', 'cached', 'dump'],
+        env=environ,
+        haltOnFailure=True,
+        timeout=timeout,
+    ))
+    return steps
+
+dump_cache.final_cleanup_steps = final_dropdb
+
+
+EPHEMERAL_STATE_FILE = '%(builddir)s/ephemeral-pg.json'
+
+
+def extract_ephemeral_props(rc, stdout, stderr):
+    """Read the properties output by ``pg_ephemeral.py start``."""
+    if rc != 0:
+        return {}
+    return dict(line.strip().split('=', 1)
+                for line in stdout.splitlines() if '=' in line)
+
+
+def ephemeral_pre_buildout(configurator, options, environ=()):
+    """Start the ephemeral cluster, and make the build use it.
+
+    This overrides the ``cap_postgresql_port`` and ``cap_postgresql_host``
+    properties set from the slave capability, on which the buildout
+    options and the environment of all subsequent steps depend.
+
+    The port is leased through the same file as the Odoo ports (see
+    ``build_utils/port_lease.py``), under a distinct owner.
+    """
+    port_min, port_max = options.get('ephemeral_cluster.port-range',
+                                     '15432-16432').strip().split('-')
+    return [
+        FileDownload(
+            mastersrc=os.path.join(BUILD_UTILS_PATH, 'pg_ephemeral.py'),
+            slavedest='pg_ephemeral.py',
+            haltOnFailure=True),
+        FileDownload(
+            mastersrc=os.path.join(BUILD_UTILS_PATH, 'port_lease.py'),
+            slavedest='port_lease.py',
+            haltOnFailure=True),
+        SetPropertyFromCommand(
+            command=['python', 'pg_ephemeral.py', 'start',
+                     '--state-file', WithProperties(EPHEMERAL_STATE_FILE),
+                     '--base-dir', WithProperties(
+                         '%(cap_postgresql_ephemeral:-/dev/shm)s'),
+                     '--lease-file', WithProperties(PORT_LEASE_FILE),
+                     '--owner', WithProperties('%(builddir)s:postgresql'),
+                     '--port-min', port_min.strip(),
+                     '--port-max', port_max.strip()],
+            extract_fn=extract_ephemeral_props,
+            name='ephemeral_cluster',
+            description=["starting", "ephemeral", "cluster"],
+            descriptionDone=["started", "ephemeral", "cluster"],
+            env=environ,
+            haltOnFailure=True,
+        )]
+
+
+def ephemeral_stop(configurator, options, environ=()):
+    return [ShellCommand(
+        command=['python', 'pg_ephemeral.py', 'stop',
+                 '--state-file', WithProperties(EPHEMERAL_STATE_FILE)],
+        name='final_ephemeral_cluster',
+        description=["stopping", "ephemeral", "cluster"],
+        descriptionDone=["stopped", "ephemeral", "cluster"],
+        env=environ,
+        haltOnFailure=False,
+        flunkOnFailure=False,
+        alwaysRun=True,  # don't leave a server holding RAM behind
+    )]
+
+
+def ephemeral_cluster(configurator, options, environ=()):
+    """Create the testing database in a throwaway cluster.
+
+    The cluster is initialized in a RAM-backed directory before the buildout
+    and runs with ``fsync`` and the like disabled. It is wiped as a final
+    cleanup, hence there is no need to drop the testing database.
+    See ``build_utils/pg_ephemeral.py`` for details.
+
+    The ``bin`` option of the ``postgresql`` capability must point to the
+    directory holding ``initdb`` and ``pg_ctl``, which are usually not in
+    the ``PATH``. The ``ephemeral`` capability option can be used to
+    specify where to put the clusters (defaults to ``/dev/shm``)::
+
+       capability = postgresql 9.3 bin=/usr/lib/postgresql/9.3/bin
+                    ephemeral=/run/shm
+
+    options:
+
+    :ephemeral_cluster.port-range: range of ports to lease for the cluster,
+                                   as ``min-max`` (defaults to
+                                   ``15432-16432``)
+    :db_template: see :func:`simple_create`.
+    """
+    return simple_create(configurator, options, environ=environ)
+
+ephemeral_cluster.pre_buildout_steps = ephemeral_pre_buildout
+ephemeral_cluster.final_cleanup_steps = ephemeral_stop
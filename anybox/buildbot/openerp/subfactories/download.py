@@ -25,7 +25,11 @@ from buildbot.steps.shell import ShellCommand
 from buildbot.steps.transfer import FileDownload
 from buildbot.process.properties import Property
 from buildbot.process.properties import Interpolate
+from buildbot.process.properties import WithProperties
 from ..utils import BUILD_UTILS_PATH
+from ..utils import BUILDOUT_CACHES
+from ..utils import bool_opt
+from ..utils import archive_format
 
 
 def standalone_buildout(configurator, options, cfg_tokens, manifest_dir):
@@ -53,11 +57,26 @@ def standalone_buildout(configurator, options, cfg_tokens, manifest_dir):
     )
 
 
+def hg_share_options(options):
+    """Command line options for buildout_hg_dl.py to use the shared pool."""
+    if not bool_opt(options, 'hg-buildout.share'):
+        return []
+    return ['--share-dir', WithProperties(BUILDOUT_CACHES + '/hg')]
+
+
 def hg_buildout(self, options, cfg_tokens, manifest_dir):
     """Steps to retrieve the buildout using Mercurial.
 
     See module docstring for signature and return values.
     manifest_dir is not used in this downloader.
+
+    Available manifest file options:
+
+      :hg-buildout.share: if ``true``, changesets are pulled in a
+                          repository pooled in the slave-wide buildout caches,
+                          of which the buildout directory is a mere share
+                          (requires Mercurial's share extension, shipped
+                          with Mercurial itself).
     """
     if len(cfg_tokens) != 3:
         raise ValueError(
@@ -70,7 +89,8 @@ def hg_buildout(self, options, cfg_tokens, manifest_dir):
             slavedest='buildout_hg_dl.py',
             haltOnFailure=True),
         ShellCommand(
-            command=['python', 'buildout_hg_dl.py', url, branch],
+            command=['python', 'buildout_hg_dl.py', url, branch] +
+            hg_share_options(options),
             description=("Retrieve buildout", "from hg",),
             haltOnFailure=True,
         )
@@ -78,7 +98,7 @@ def hg_buildout(self, options, cfg_tokens, manifest_dir):
 
 
 def git_buildout(self, options, cfg_tokens, manifest_dir, subdir=None):
-    """Steps to retruve the buildout using Mercurial.
+    """Steps to retrieve the buildout using Git.
 
     See module docstring for signature and return values.
     manifest_dir is not used in this downloader.
@@ -86,6 +106,21 @@ def git_buildout(self, options, cfg_tokens, manifest_dir, subdir=None):
     :param subdir: if not ``None``, then branch will be set aside and
                    the default workdir, 'build' will be set as a link
                    to the specified subdir in branch.
+
+    Available manifest file options:
+
+      :git-buildout.reference: if ``true``, a bare mirror of the buildout
+                               repository is kept in the slave-wide
+                               buildout caches, and used as a reference
+                               (git alternates) by the clones of all
+                               builders.
+      :git-buildout.reference-gc-interval: days between two garbage
+                                           collections of the mirror
+                                           (default 7, 0 to disable).
+      :git-buildout.filter: object filter for a partial clone, typically
+                            ``blob:none``. Requires recent git on both sides.
+      :git-buildout.single-branch: if ``true``, clone and fetch only the
+                                   wished branch.
     """
     def conf_error(cfg_tokens):
         raise ValueError(
@@ -96,8 +131,7 @@ def git_buildout(self, options, cfg_tokens, manifest_dir, subdir=None):
 
     subdir = None
     if len(cfg_tokens) > 3:
-        options = cfg_tokens[3:]
-        for opt in options:
+        for opt in cfg_tokens[3:]:
             split = opt.split('=')
             if split[0].strip() == 'subdir':
                 subdir = split[1].strip()
@@ -105,6 +139,20 @@ def git_buildout(self, options, cfg_tokens, manifest_dir, subdir=None):
                 conf_error(cfg_tokens)
 
     url, branch, conf_path = cfg_tokens[:3]
+    dl_options = []
+    if bool_opt(options, 'git-buildout.reference'):
+        dl_options.extend(('--reference-dir',
+                           WithProperties(BUILDOUT_CACHES + '/git')))
+        gc_interval = options.get('git-buildout.reference-gc-interval',
+                                  '').strip()
+        if gc_interval:
+            dl_options.append('--gc-interval=' + gc_interval)
+    git_filter = options.get('git-buildout.filter', '').strip()
+    if git_filter:
+        dl_options.append('--filter=' + git_filter)
+    if bool_opt(options, 'git-buildout.single-branch'):
+        dl_options.append('--single-branch')
+
     steps = [
         FileDownload(
             mastersrc=os.path.join(BUILD_UTILS_PATH, 'buildout_git_dl.py'),
@@ -115,7 +163,8 @@ def git_buildout(self, options, cfg_tokens, manifest_dir, subdir=None):
     if subdir is None:
         steps.append(
             ShellCommand(
-                command=['python', 'buildout_git_dl.py', url, branch, 'build'],
+                command=['python', 'buildout_git_dl.py', url, branch,
+                         'build'] + dl_options,
                 description=("Retrieve buildout", "from git",),
                 workdir='.',
                 haltOnFailure=True,
@@ -125,7 +174,7 @@ def git_buildout(self, options, cfg_tokens, manifest_dir, subdir=None):
         steps.append(ShellCommand(
             command=['python', 'buildout_git_dl.py', url, branch, 'build',
                      '--subdir', subdir,
-                     '--force-remove-subdir'],
+                     '--force-remove-subdir'] + dl_options,
             description=("Retrieve buildout", "from git",),
             descriptionDone=("retrieved", "buildout", "from git"),
             haltOnFailure=True,
@@ -197,6 +246,7 @@ def hg_tag_buildout(self, options, cfg_tokens, manifest_dir):
     stay pristine to test the produced packages.
 
     See module docstring for signature and return values.
+    The ``hg-buildout.share`` option is honoured, see :func:`hg_buildout`.
     """
 
     if len(cfg_tokens) != 2:
@@ -212,7 +262,8 @@ def hg_tag_buildout(self, options, cfg_tokens, manifest_dir):
             workdir='src',
             haltOnFailure=True),
         ShellCommand(
-            command=['python', 'buildout_hg_dl.py', '-t', 'tag', url, tag],
+            command=['python', 'buildout_hg_dl.py', '-t', 'tag', url,
+                     tag] + hg_share_options(options),
             workdir='./src',
             description=("Retrieve buildout", "tag", tag, "from hg",),
             haltOnFailure=True,
@@ -223,7 +274,8 @@ def hg_tag_buildout(self, options, cfg_tokens, manifest_dir):
 def archive_buildout(self, options, cfg_tokens, manifest_dir):
     """Steps to retrieve an archive (tarball, zip...) buildout from the master.
 
-    Currently only .tar.bz2 is supported.
+    The archive format is given by the ``packaging.format`` option, see
+    :func:`postdownload.packaging`.
 
     The path of the archive to retrieve is made of:
          - a base directory from the same option as upload options for
@@ -240,16 +292,30 @@ def archive_buildout(self, options, cfg_tokens, manifest_dir):
 
     For example, one could use this for a generic binary builder that produces
     a docker image based on debian:7.7 for any archive produced by this master.
+
+    The archive is read only once slave-side, its checksum being computed
+    while it gets extracted in a temporary directory, which then replaces
+    ``build/`` (see ``build_utils/archive_extract.py``).
+
+    Available manifest file options:
+
+      :archive.stream: if ``true``, the archive is not downloaded through
+                       buildbot, but streamed by the slave from the URL
+                       corresponding to ``packaging.root-dir``, given by the
+                       ``packaging.base-url`` option.
+                       This avoids writing it to disk at all.
+      :archive.checksum: the checksum type to verify, among those produced by
+                         packaging, ``md5`` (the default) or ``sha256``.
     """
-    archive_type = '.tar.bz2'
+    archive_type = '.' + archive_format(options)
+    checksum = options.get('archive.checksum', 'md5').strip()
     subdir_prop, archive_prop, conf_name = cfg_tokens
+    archive_sub_path = '/'.join(('%%(prop:%s)s' % subdir_prop,
+                                 '%%(prop:%s)s' % archive_prop + archive_type))
     master_path = os.path.join(options['packaging.root-dir'],
-                               '%%(prop:%s)s' % subdir_prop,
-                               '%%(prop:%s)s' % archive_prop + archive_type)
-    slave_name_unpacked = '%%(prop:%s)s' % archive_prop
-    slave_fname = slave_name_unpacked + archive_type
-    slave_path = '../' + slave_fname
-    return conf_name, [
+                               archive_sub_path)
+    slave_fname = '%%(prop:%s)s' % archive_prop + archive_type
+    steps = [
         ShellCommand(
             command=['find', '.', '-maxdepth', '1',
                      '-name',
@@ -257,31 +323,35 @@ def archive_buildout(self, options, cfg_tokens, manifest_dir):
             workdir='.',
             name='clean_arch',
             description=['remove', 'prev', 'downloads']),
-        FileDownload(slavedest=Interpolate(slave_path),
-                     mastersrc=Interpolate(master_path)),
-        FileDownload(slavedest=Interpolate(slave_path + '.md5'),
-                     mastersrc=Interpolate(master_path + '.md5')),
-        ShellCommand(
-            command=['md5sum', '-c', Interpolate(slave_fname + '.md5')],
-            workdir='.',
-            name="checksum",
-            haltOnFailure=True),
-        ShellCommand(
-            command=['tar', 'xjf', Interpolate(slave_fname)],
+        FileDownload(slavedest=Interpolate(slave_fname + '.' + checksum),
+                     mastersrc=Interpolate(master_path + '.' + checksum),
+                     workdir='.',
+                     haltOnFailure=True),
+        FileDownload(
+            mastersrc=os.path.join(BUILD_UTILS_PATH, 'archive_extract.py'),
+            slavedest='archive_extract.py',
             workdir='.',
-            name="untar",
-            description=['unpacking', 'archive'],
-            descriptionDone=['unpacked', 'archive'],
             haltOnFailure=True),
-        ShellCommand(
-            command=['rm', '-rf', 'build'],
-            workdir='.',
-            name='clean',
-            description=['removing', 'previous', 'build'],
-            descriptionDone=['removed', 'previous', 'build']),
-        ShellCommand(
-            command=['mv', Interpolate(slave_name_unpacked), 'build'],
-            workdir='.',
-            name='mv',
-            description=['setting', 'at', 'build/'])
     ]
+
+    if bool_opt(options, 'archive.stream'):
+        source = Interpolate('/'.join((
+            options['packaging.base-url'].rstrip('/'), archive_sub_path)))
+    else:
+        source = Interpolate(slave_fname)
+        steps.append(FileDownload(slavedest=source,
+                                  mastersrc=Interpolate(master_path),
+                                  workdir='.',
+                                  haltOnFailure=True))
+
+    steps.append(ShellCommand(
+        command=['python', 'archive_extract.py', source,
+                 '--checksum-file', Interpolate(slave_fname + '.' + checksum),
+                 '--checksum-type', checksum,
+                 '--target', 'build'],
+        workdir='.',
+        name="unpack",
+        description=['unpacking', 'archive'],
+        descriptionDone=['unpacked', 'archive'],
+        haltOnFailure=True))
+    return conf_name, steps
@@ -1,52 +1,354 @@
 import os
-from buildbot import locks
+import re
+import sys
 from buildbot.steps.shell import ShellCommand
 from buildbot.steps.shell import SetPropertyFromCommand
 from buildbot.steps.python import Sphinx
 from buildbot.steps.transfer import FileDownload
 from buildbot.steps.transfer import FileUpload
-from buildbot.steps.transfer import DirectoryUpload
 from buildbot.steps.master import MasterShellCommand
 from buildbot.process.properties import WithProperties
 from buildbot.process.properties import Property
 from ..utils import comma_list_sanitize
 from ..utils import bool_opt
 from ..utils import BUILD_UTILS_PATH
+from ..utils import archive_format
+from ..utils import PORT_LEASE_FILE
 from ..constants import DEFAULT_BUILDOUT_PART
+from ..steps import ChangedFilesDownload
+from ..steps import ObservedShellCommand
+from ..steps import OdooLogObserver
+from ..steps import ResourceUsageObserver
+from ..build_utils.run_parallel import log_names
 
-port_lock = locks.SlaveLock("port-reserve")
 
-
-def steps_odoo_port_reservation(configurator, options, environ=()):
+def steps_odoo_port_reservation(configurator, options, environ=(),
+                                port_min='6069', port_max='7068',
+                                blocks=None):
     """Return steps for port reservation.
 
-    The chosen port is stored in ``openerp_port`` property.
+    The chosen port is stored in ``openerp_port`` property. It is the first
+    of a block of consecutive ports leased to the build (see
+    ``build_utils/port_lease.py``), to be released by
+    :func:`steps_odoo_port_release`.
+
+    :param blocks: if not ``None``, number of blocks of
+                   ``odoo.http-port-step`` ports to lease, for as many
+                   concurrent servers (``'0'`` for the number of CPUs).
 
     Available manifest file options:
 
       :odoo.http-port-min: minimal value for the HTTP port (defaults to 6069)
       :odoo.http-port-max: maximal value for the HTTP port (defaults to 7069)
-      :odoo.http-port-step: increment value for the HTTP port (defaults to 5)
+      :odoo.http-port-step: size of the block of leased ports (defaults to 5)
     """
 
     return (
         FileDownload(
-            mastersrc=os.path.join(BUILD_UTILS_PATH, 'port_reserve.py'),
-            slavedest='port_reserve.py'),
+            mastersrc=os.path.join(BUILD_UTILS_PATH, 'port_lease.py'),
+            slavedest='port_lease.py'),
 
         SetPropertyFromCommand(
             property='openerp_port',
             description=['Port', 'reservation'],
-            locks=[port_lock.access('exclusive')],
             command=[
-                'python', 'port_reserve.py',
-                '--port-min=' + options.get('odoo.http-port-min', '6069'),
-                '--port-max=' + options.get('odoo.http-port-max', '7068'),
-                '--step=' + options.get('odoo.http-port-step', '5'),
-            ])
+                'python', 'port_lease.py', 'acquire',
+                '--lease-file', WithProperties(PORT_LEASE_FILE),
+                '--owner', WithProperties('%(builddir)s'),
+                '--port-min=' + options.get('odoo.http-port-min', port_min),
+                '--port-max=' + options.get('odoo.http-port-max', port_max),
+                '--block-size=' + options.get('odoo.http-port-step', '5'),
+            ] + (['--blocks=' + blocks] if blocks is not None else []))
     )
 
 
+def steps_odoo_port_release(configurator, options, environ=()):
+    """Return final cleanup steps to release the ports leased to the build.
+    """
+    return [ShellCommand(
+        command=['python', 'port_lease.py', 'release',
+                 '--lease-file', WithProperties(PORT_LEASE_FILE),
+                 '--owner', WithProperties('%(builddir)s')],
+        name='final_port_release',
+        description=['releasing', 'ports'],
+        descriptionDone=['released', 'ports'],
+        haltOnFailure=False,
+        flunkOnFailure=False,
+        alwaysRun=True,
+    )]
+
+
+def odoo_log_observers(options, logname):
+    """Return observers for an Odoo/OpenERP log, to be analyzed live.
+
+    Available manifest file options:
+
+      :analyze.fail-fast: if set to ``true``, the step is interrupted as soon
+                          as a fatal error (critical log, database
+                          initialization or addons loading failure) is
+                          detected in the log.
+    """
+    fail_fast = bool_opt(options, 'analyze.fail-fast')
+    return [(logname, lambda: OdooLogObserver(fail_fast=fail_fast))]
+
+
+def resource_sampling(options, command, logname='stdio'):
+    """Wrap command in the resource sampler if the options require it.
+
+    Return the command to use, and the log observers that collect the
+    resource usage (see :class:`ResourceUsageObserver`).
+    The sampler itself is downloaded by the configurator, before the
+    buildout step.
+
+    Available manifest file options:
+
+      :resources.sample: if set to ``true``, the main commands (buildout,
+                         installation, tests, functional) are run through
+                         ``build_utils/resource_sampler.py``, that reports
+                         their CPU times, peak resident memory and block I/O.
+      :resources.interval: sampling interval in seconds (defaults to 1)
+    """
+    if not bool_opt(options, 'resources.sample'):
+        return command, []
+    return (['python', 'resource_sampler.py',
+             '--interval', options.get('resources.interval', '1').strip(),
+             '--'] + list(command),
+            [(logname, ResourceUsageObserver)])
+
+
+def steps_analyze(options, logfile):
+    """Return steps to analyze an Odoo/OpenERP log after the run.
+
+    Available manifest file options:
+
+      :analyze.results: if set to ``true``, the results of individual tests
+                        are extracted from the log, and uploaded to the
+                        master in JSON and JUnit XML formats
+                        (see ``build_utils/analyze_oerp_tests.py``)
+      :analyze.results-dest: master-side path of the uploaded results,
+                             without extension, defaults to
+                             ``test-results/%(buildername)s/%(buildnumber)s``
+                             (relative paths are from the master base
+                             directory)
+      :analyze.timing: if set to ``true``, the durations of modules loading
+                       and of tests are extracted from the log, the slowest
+                       ones are reported in the ``timing`` log of the
+                       analyze step, and a summary is put in the
+                       ``timing_summary`` property. Regressions against the
+                       previous build of the same builder are reported.
+      :analyze.timing-top: number of entries in the timing report
+                           (defaults to 10)
+      :analyze.timing-threshold: minimal slowdown, in percent, to report a
+                                 regression (defaults to 20)
+    """
+    command = ["python", "analyze_oerp_tests.py", logfile]
+    before = []
+    steps = []
+    logfiles = {}
+    if bool_opt(options, 'analyze.results'):
+        command.extend(['--json-output', 'test-results.json',
+                        '--junit-output', 'test-results.xml'])
+        dest = options.get('analyze.results-dest',
+                           'test-results/%(buildername)s/%(buildnumber)s')
+        for fmt in ('json', 'xml'):
+            steps.append(FileUpload(
+                slavesrc='test-results.' + fmt,
+                masterdest=WithProperties(dest.strip() + '.' + fmt),
+                name='upload_results_' + fmt,
+                description=['upload', 'results'],
+                descriptionDone=['uploaded', 'results'],
+                haltOnFailure=False,
+                flunkOnFailure=False,
+                mode=0644))
+
+    if bool_opt(options, 'analyze.timing'):
+        master_timing = WithProperties('timing/%(buildername)s.json')
+        before.append(FileDownload(
+            mastersrc=master_timing,
+            slavedest='timing-previous.json',
+            name='download_previous_timing',
+            description=['download', 'previous', 'timing'],
+            haltOnFailure=False,
+            flunkOnFailure=False,
+            warnOnFailure=False))
+        command.extend([
+            '--timing-output', 'timing.json',
+            '--timing-report', 'timing.txt',
+            '--timing-previous', 'timing-previous.json',
+            '--timing-top', options.get('analyze.timing-top', '10').strip(),
+            '--timing-threshold',
+            options.get('analyze.timing-threshold', '20').strip(),
+        ])
+        logfiles['timing'] = 'timing.txt'
+        steps.append(SetPropertyFromCommand(
+            command=['head', '-n', '1', 'timing.txt'],
+            property='timing_summary',
+            name='timing_summary',
+            description=['timing', 'summary'],
+            haltOnFailure=False,
+            flunkOnFailure=False))
+        steps.append(FileUpload(
+            slavesrc='timing.json',
+            masterdest=master_timing,
+            name='upload_timing',
+            description=['upload', 'timing'],
+            descriptionDone=['uploaded', 'timing'],
+            haltOnFailure=False,
+            flunkOnFailure=False,
+            mode=0644))
+
+    return before + [ShellCommand(
+        command=command,
+        name='analyze',
+        description="analyze",
+        logfiles=logfiles,
+    )] + steps
+
+
+def steps_select_changed_addons(options, addons):
+    """Return steps to restrict addons to those affected by the changes.
+
+    The selection is stored in the ``addons_selection`` property.
+    """
+    buildout_part = options.get('buildout-part', DEFAULT_BUILDOUT_PART)
+    return [ChangedFilesDownload(slavedest='changed_files.json')] + [
+        FileDownload(mastersrc=os.path.join(BUILD_UTILS_PATH, name),
+                     slavedest=name)
+        for name in ('odoo_addons.py', 'select_addons.py')
+    ] + [SetPropertyFromCommand(
+        property='addons_selection',
+        name='select_addons',
+        description=['selecting', 'changed', 'addons'],
+        descriptionDone=['selected', 'changed', 'addons'],
+        command=['python', 'select_addons.py',
+                 '--config', 'etc/%s.cfg' % buildout_part,
+                 '--addons', addons,
+                 '--changed-files', 'changed_files.json'],
+        haltOnFailure=True,
+    )]
+
+
+def steps_tree_upload(slavesrc, masterdest, url=None, exclude=(),
+                      name='upload'):
+    """Return steps to upload a directory, transferring changed files only.
+
+    The master keeps a manifest of the uploaded files in ``masterdest``
+    (see ``build_utils/tree_sync.py``). Only the files that aren't in there
+    or whose contents differ are packed and uploaded, and they are the only
+    ones whose permissions get fixed master-side. Files that aren't in the
+    tree anymore are removed from ``masterdest``.
+
+    :param masterdest: path on the master, can use properties in the same
+                       way as :class:`WithProperties` does.
+    :param exclude: names of files or directories not to upload.
+    """
+    archive = masterdest + '.tree-delta.tar.gz'
+    manifest = masterdest + '.tree-manifest.json'
+    pack_cmd = ['python', 'tree_sync.py', 'pack', slavesrc,
+                '--previous', 'tree-manifest.previous.json',
+                '--manifest', 'tree-manifest.json',
+                '--archive', 'tree-delta.tar.gz']
+    for excluded in exclude:
+        pack_cmd.extend(('--exclude', excluded))
+    return [
+        FileDownload(mastersrc=os.path.join(BUILD_UTILS_PATH, 'tree_sync.py'),
+                     slavedest='tree_sync.py'),
+        # missing for the first upload, the whole tree is then packed
+        FileDownload(mastersrc=WithProperties(
+            masterdest + '/.tree-manifest.json'),
+            slavedest='tree-manifest.previous.json',
+            name='%s_manifest' % name,
+            description=['download', 'previous', 'manifest'],
+            flunkOnFailure=False, warnOnFailure=False, haltOnFailure=False),
+        ShellCommand(command=pack_cmd,
+                     name='%s_pack' % name,
+                     description=['pack', 'changes'],
+                     haltOnFailure=True),
+        FileUpload(slavesrc='tree-manifest.json',
+                   masterdest=WithProperties(manifest),
+                   haltOnFailure=True),
+        FileUpload(slavesrc='tree-delta.tar.gz',
+                   masterdest=WithProperties(archive),
+                   name=name,
+                   url=url,
+                   haltOnFailure=True),
+        MasterShellCommand(
+            command=[sys.executable,
+                     os.path.join(BUILD_UTILS_PATH, 'tree_sync.py'), 'apply',
+                     WithProperties(masterdest),
+                     '--manifest', WithProperties(manifest),
+                     '--archive', WithProperties(archive)],
+            name='%s_apply' % name,
+            description=['apply', 'changes'],
+            haltOnFailure=True),
+    ]
+
+
+def steps_blob_upload(slavesrc, masterdest, store, url=None,
+                      name='upload'):
+    """Return steps to upload a directory through a store of blobs.
+
+    This is meant for trees uploaded to a new place for each build, but
+    whose files are mostly the same from one build to the next. The master
+    stores files by content hash in ``store``, which can be shared by
+    many uploads, and requests only the missing ones. The uploaded tree is
+    made of hard links to the stored files, which already have their final
+    permissions (see ``build_utils/tree_sync.py``).
+
+    :param masterdest: path on the master, can use properties in the same
+                       way as :class:`WithProperties` does. So can
+                       ``store``.
+    """
+    archive = masterdest + '.tree-blobs.tar.gz'
+    manifest = masterdest + '.tree-manifest.json'
+    missing = masterdest + '.tree-missing.json'
+    tree_sync = os.path.join(BUILD_UTILS_PATH, 'tree_sync.py')
+    return [
+        FileDownload(mastersrc=tree_sync, slavedest='tree_sync.py'),
+        ShellCommand(command=['python', 'tree_sync.py', 'manifest', slavesrc,
+                              '--manifest', 'tree-manifest.json'],
+                     name='%s_manifest' % name,
+                     description=['hash', 'files'],
+                     haltOnFailure=True),
+        FileUpload(slavesrc='tree-manifest.json',
+                   masterdest=WithProperties(manifest),
+                   haltOnFailure=True),
+        MasterShellCommand(
+            command=[sys.executable, tree_sync, 'missing',
+                     '--store', WithProperties(store),
+                     '--manifest', WithProperties(manifest),
+                     '--missing', WithProperties(missing)],
+            name='%s_missing' % name,
+            description=['list', 'missing', 'files'],
+            haltOnFailure=True),
+        FileDownload(mastersrc=WithProperties(missing),
+                     slavedest='tree-missing.json',
+                     haltOnFailure=True),
+        ShellCommand(command=['python', 'tree_sync.py', 'pack-blobs',
+                              slavesrc,
+                              '--manifest', 'tree-manifest.json',
+                              '--missing', 'tree-missing.json',
+                              '--archive', 'tree-blobs.tar.gz'],
+                     name='%s_pack' % name,
+                     description=['pack', 'missing', 'files'],
+                     haltOnFailure=True),
+        FileUpload(slavesrc='tree-blobs.tar.gz',
+                   masterdest=WithProperties(archive),
+                   name=name,
+                   url=url,
+                   haltOnFailure=True),
+        MasterShellCommand(
+            command=[sys.executable, tree_sync, 'link',
+                     WithProperties(masterdest),
+                     '--store', WithProperties(store),
+                     '--manifest', WithProperties(manifest),
+                     '--archive', WithProperties(archive)],
+            name='%s_link' % name,
+            description=['link', 'files'],
+            haltOnFailure=True),
+    ]
+
+
 def install_modules(configurator, options, buildout_slave_path,
                     environ=()):
     """Return steps to just install modules
@@ -81,21 +383,21 @@ def install_modules(configurator, options, buildout_slave_path,
     elif with_demo != 'true':
         raise ValueError("install.demo-data must be either 'true' or 'false'")
 
-    steps.append(ShellCommand(command=install_cmd,
-                              name='install',
-                              description=['installing', 'modules'],
-                              descriptionDone=['modules', 'installed'],
-                              logfiles=dict(install='install.log'),
-                              haltOnFailure=True,
-                              env=environ,
-                              ))
-
-    steps.append(ShellCommand(
-        command=["python", "analyze_oerp_tests.py", "install.log"],
-        name='analyze',
-        description="analyze",
+    install_cmd, sampling_observers = resource_sampling(options, install_cmd)
+    steps.append(ObservedShellCommand(
+        command=install_cmd,
+        name='install',
+        description=['installing', 'modules'],
+        descriptionDone=['modules', 'installed'],
+        logfiles=dict(install='install.log'),
+        log_observers=odoo_log_observers(options, 'install') + (
+            sampling_observers),
+        haltOnFailure=True,
+        env=environ,
     ))
 
+    steps.extend(steps_analyze(options, 'install.log'))
+
     return steps
 
 
@@ -113,6 +415,12 @@ def install_modules_test(configurator, options, buildout_slave_path,
                       and used in the test run.
                       See :func:`steps_odoo_port_reservation` for port
                       selection tuning options.
+      :test.changed-only: if set to ``true``, only the addons affected by the
+                          files of the build changes are tested, i.e., the
+                          changed ones and those depending on them.
+                          Builds without changes (forced, periodic) still
+                          test the whole list.
+                          See ``build_utils/select_addons.py`` for details.
     """
 
     environ = dict(environ)
@@ -125,10 +433,15 @@ def install_modules_test(configurator, options, buildout_slave_path,
                               descriptionDone=['Cleaned', 'logs'],
                               ))
     buildout_part = options.get('buildout-part', DEFAULT_BUILDOUT_PART)
+    addons = comma_list_sanitize(options.get('openerp-addons', 'all'))
+    if bool_opt(options, 'test.changed-only'):
+        steps.extend(steps_select_changed_addons(options, addons))
+        addons = Property('addons_selection')
+
     test_cmd = [options.get('test-command',
                             'bin/test_' + buildout_part),
                 '-i',
-                comma_list_sanitize(options.get('openerp-addons', 'all')),
+                addons,
                 # openerp --logfile does not work with relative paths !
                 WithProperties('--logfile=%(workdir)s/build/test.log')]
 
@@ -137,23 +450,100 @@ def install_modules_test(configurator, options, buildout_slave_path,
                                                  environ=environ))
         test_cmd.append(WithProperties('--xmlrpc-port=%(openerp_port)s'))
 
-    steps.append(ShellCommand(command=test_cmd,
-                              name='test',
-                              description=['installing', 'testing'],
-                              descriptionDone=['installed', 'tested'],
-                              logfiles=dict(test='test.log'),
-                              haltOnFailure=True,
-                              env=environ,
-                              ))
+    test_cmd, sampling_observers = resource_sampling(options, test_cmd)
+    steps.append(ObservedShellCommand(
+        command=test_cmd,
+        name='test',
+        description=['installing', 'testing'],
+        descriptionDone=['installed', 'tested'],
+        logfiles=dict(test='test.log'),
+        log_observers=odoo_log_observers(options, 'test') + (
+            sampling_observers),
+        haltOnFailure=True,
+        env=environ,
+    ))
 
-    steps.append(ShellCommand(
-        command=["python", "analyze_oerp_tests.py", "test.log"],
-        name='analyze',
-        description="analyze",
+    steps.extend(steps_analyze(options, 'test.log'))
+
+    return steps
+
+
+def install_modules_test_cleanup(configurator, options, environ=()):
+    if options.get('odoo.use-port', '').strip().lower() == 'true':
+        return steps_odoo_port_release(configurator, options,
+                                       environ=environ)
+    return []
+
+install_modules_test.final_cleanup_steps = install_modules_test_cleanup
+
+
+def install_modules_test_sharded(configurator, options, buildout_slave_path,
+                                 environ=()):
+    """Return steps to run bin/test_<PART> -i in concurrent shards.
+
+    The addons are partitioned along their dependency graph, and each
+    shard is tested against its own copy of the testing database, on its own
+    port. The logs of all shards are merged in ``test.log`` for the analysis.
+    See ``build_utils/shard_tests.py`` for details.
+
+    Available manifest file options:
+
+      :openerp-addons: the addons to test. The ``all`` pseudo-addon can't be
+                       partitioned, and leads to a single shard.
+      :test.shards: number of shards (defaults to the number of CPUs of
+                    the slave)
+      :odoo.http-port-min, odoo.http-port-max, odoo.http-port-step:
+                    see :func:`steps_odoo_port_reservation`. A block of
+                    ports is leased for each shard.
+    """
+    buildout_part = options.get('buildout-part', DEFAULT_BUILDOUT_PART)
+    nb_shards = options.get('test.shards', '0').strip()
+    steps = [ShellCommand(command=['rm', '-f', 'test.log'],
+                          name="clean_log",
+                          description=["Log", "cleanup"],
+                          descriptionDone=['Cleaned', 'logs'],
+                          )]
+    steps.extend(FileDownload(
+        mastersrc=os.path.join(BUILD_UTILS_PATH, name),
+        slavedest=name,
+        haltOnFailure=True)
+        for name in ('odoo_addons.py', 'shard_tests.py'))
+    steps.extend(steps_odoo_port_reservation(configurator, options,
+                                             environ=environ,
+                                             blocks=nb_shards))
+
+    shard_cmd = [
+        'python', 'shard_tests.py',
+        '--config', 'etc/%s.cfg' % buildout_part,
+        '--db', Property('testing_db'),
+        '--addons',
+        comma_list_sanitize(options.get('openerp-addons', 'all')),
+        '--shards', nb_shards,
+        '--test-command', options.get('test-command',
+                                      'bin/test_' + buildout_part),
+        '--logfile', 'test.log',
+        '--port', Property('openerp_port'),
+        '--port-step', options.get('odoo.http-port-step', '5'),
+    ]
+    command, sampling_observers = resource_sampling(options, shard_cmd)
+    steps.append(ObservedShellCommand(
+        command=command,
+        name='test',
+        description=['installing', 'testing', 'in', 'shards'],
+        descriptionDone=['installed', 'tested'],
+        logfiles=dict(test='test.log'),
+        log_observers=odoo_log_observers(options, 'test') + (
+            sampling_observers),
+        haltOnFailure=True,
+        env=environ,
     ))
 
+    steps.extend(steps_analyze(options, 'test.log'))
+
     return steps
 
+install_modules_test_sharded.final_cleanup_steps = steps_odoo_port_release
+
 
 def openerp_command_initialize_tests(configurator, options,
                                      buildout_slave_path,
@@ -200,6 +590,9 @@ def openerp_command_initialize_tests(configurator, options,
 
     return steps
 
+openerp_command_initialize_tests.final_cleanup_steps = (
+    install_modules_test_cleanup)
+
 
 def update_modules(configurator, options, buildout_slave_path,
                    environ=()):
@@ -244,21 +637,19 @@ def update_modules(configurator, options, buildout_slave_path,
     # (dedicated script may, but uniformity is best)
     command.append(WithProperties('%(workdir)s/build/update.log'))
 
-    steps.append(ShellCommand(command=command,
-                              name='updating',
-                              description='updating application',
-                              descriptionDone='updated',
-                              logfiles=dict(update='update.log'),
-                              haltOnFailure=True,
-                              env=environ,
-                              ))
-
-    steps.append(ShellCommand(
-        command=["python", "analyze_oerp_tests.py", "update.log"],
-        name='analyze',
-        description="analyze",
+    steps.append(ObservedShellCommand(
+        command=command,
+        name='updating',
+        description='updating application',
+        descriptionDone='updated',
+        logfiles=dict(update='update.log'),
+        log_observers=odoo_log_observers(options, 'update'),
+        haltOnFailure=True,
+        env=environ,
     ))
 
+    steps.extend(steps_analyze(options, 'update.log'))
+
     return steps
 
 
@@ -286,10 +677,25 @@ def install_modules_nose(configurator, options, buildout_slave_path,
       :nose.cover-options: additional options for nosetests invocation
       :nose.upload-path: path on master to upload files produced by nose
       :nose.upload-url: URL to present files produced by nose in waterfall
-
-    In upload-path and upload-url, one may use properties as in the
-    steps definitions, with $ instead of %, to avoid ConfigParser interpret
-    them.
+      :nose.upload-store: path on master of the store of uploaded files
+        (see :func:`steps_blob_upload`), defaults to ``.blobs`` in the
+        parent directory of ``nose.upload-path``. Only the files that aren't
+        in the store already are uploaded. Files are copied instead of
+        linked if it's not on the same filesystem as ``nose.upload-path``.
+      :nose.aggregate-dir: path on master where to aggregate coverage and
+        cProfile output across builds (see ``build_utils/aggregate_nose.py``).
+        Coverage gets merged for all builds of the buildout with the same
+        addons revisions, and cProfile stats are kept as per function time
+        series, with a report of the latest build.
+      :nose.aggregate-name: subdirectory of ``nose.aggregate-dir`` for this
+        buildout, defaults to a sanitized version of the ``buildout``
+        option.
+      :nose.aggregate-history: number of builds kept in the profile time
+        series (defaults to 50)
+
+    In upload-path, upload-url and upload-store, one may use properties as
+    in the steps definitions, with $ instead of %, to avoid ConfigParser
+    interpret them.
     """
 
     environ = dict(environ)
@@ -318,12 +724,15 @@ def install_modules_nose(configurator, options, buildout_slave_path,
             WithProperties(
                 '--logfile=%(workdir)s/build/install.log')]
 
-    steps.append(ShellCommand(
+    install_cmd, sampling_observers = resource_sampling(options, install_cmd)
+    steps.append(ObservedShellCommand(
         command=install_cmd,
         name='install',
         description='install modules',
         descriptionDone='installed modules',
         logfiles=dict(log='install.log'),
+        log_observers=odoo_log_observers(options, 'log') + (
+            sampling_observers),
         haltOnFailure=True,
         env=environ,
     ))
@@ -380,8 +789,10 @@ def install_modules_nose(configurator, options, buildout_slave_path,
                                   haltOnFailure=True,
                                   env=environ))
 
-    steps.append(ShellCommand(
+    nose_cmd, sampling_observers = resource_sampling(options, nose_cmd)
+    steps.append(ObservedShellCommand(
         command=nose_cmd,
+        log_observers=sampling_observers,
         name='tests',
         description="nose tests",
         haltOnFailure=True,
@@ -392,27 +803,45 @@ def install_modules_nose(configurator, options, buildout_slave_path,
     if upload:
         upload_path = options.get('nose.upload-path', '').replace('$', '%')
         upload_url = options.get('nose.upload-url', '').replace('$', '%')
-        steps.append(DirectoryUpload(slavesrc=nose_output_dir,
-                                     haltOnFailure=True,
-                                     compress='gz',
-                                     masterdest=WithProperties(upload_path),
-                                     url=WithProperties(upload_url)))
-
-        # Fixing perms on uploaded files. Yes we could have unmask = 022 in
-        # all slaves, see note at the end of
-        # http://buildbot.net/buildbot/docs/0.8.7/full.html#
-        #     buildbot.steps.source.buildbot.steps.transfer.DirectoryUpload
-        # but it's less work to fix the perms from here than to check all of
-        # them
-        steps.append(MasterShellCommand(
-            description=["nose", "output", "read", "permissions"],
-            command=['chmod', '-R', 'a+r',
-                     WithProperties(upload_path)]))
-        steps.append(MasterShellCommand(
-            description=["nose", "output", "dirx", "permissions"],
-            command=['find', WithProperties(upload_path),
-                     '-type', 'd', '-exec',
-                     'chmod', '755', '{}', ';']))
+        store = options.get('nose.upload-store', '').replace('$', '%')
+        if not store:
+            store = os.path.join(os.path.dirname(upload_path.rstrip('/')),
+                                 '.blobs')
+        aggregate_dir = options.get('nose.aggregate-dir')
+        if aggregate_dir:
+            steps.extend(FileDownload(
+                mastersrc=os.path.join(BUILD_UTILS_PATH, name),
+                slavedest=name) for name in ('odoo_addons.py',
+                                             'collect_nose_output.py'))
+            steps.append(ShellCommand(
+                command=['python', 'collect_nose_output.py',
+                         '--config', 'etc/%s.cfg' % buildout_part,
+                         '--output-dir', nose_output_dir],
+                name='collect_nose',
+                description=['collect', 'nose', 'output'],
+                haltOnFailure=True))
+        steps.extend(steps_blob_upload(nose_output_dir, upload_path, store,
+                                       url=WithProperties(upload_url),
+                                       name='upload_nose'))
+        if aggregate_dir:
+            aggregate_name = options.get('nose.aggregate-name')
+            if aggregate_name is None:
+                aggregate_name = re.sub(r'[^\w.-]+', '_',
+                                        options['buildout']).strip('_')
+            steps.append(MasterShellCommand(
+                command=[sys.executable,
+                         os.path.join(BUILD_UTILS_PATH, 'aggregate_nose.py'),
+                         WithProperties(upload_path),
+                         '--dest', os.path.join(aggregate_dir,
+                                                aggregate_name),
+                         '--builder', Property('buildername'),
+                         '--build', Property('buildnumber'),
+                         '--history',
+                         options.get('nose.aggregate-history', '50')],
+                name='aggregate_nose',
+                description=['aggregate', 'coverage', 'and', 'profile'],
+                flunkOnFailure=False,
+                warnOnFailure=True))
     return steps
 
 
@@ -427,9 +856,16 @@ def functional(configurator, options, buildout_slave_path,
                             ``port`` and ``db_name``
       :functional.parts: buildout parts to install to get the commands to
                          work
-      :functional.wait: time (in seconds) to wait for the server to be ready
-                        for functional testing after starting up
-                        (defaults to 30s)
+      :functional.wait: maximum time (in seconds) to wait for the server to
+                        be ready for functional testing after starting up
+                        (defaults to 30s). Readiness is checked by
+                        XML-RPC calls (see ``build_utils/wait_for_server.py``)
+      :functional.parallel: maximum number of commands to run concurrently
+                            (defaults to 1, meaning one step per command).
+                            All commands run against the same server, which
+                            is started only once for the whole build.
+                            Commands sharing the same base name get their
+                            logs named after their whole path.
     """
 
     steps = []
@@ -450,16 +886,10 @@ def functional(configurator, options, buildout_slave_path,
             env=environ,
         ))
 
-    steps.append(FileDownload(
-        mastersrc=os.path.join(BUILD_UTILS_PATH, 'port_reserve.py'),
-        slavedest='port_reserve.py'))
-
-    steps.append(SetPropertyFromCommand(
-        property='openerp_port',
-        description=['Port', 'reservation'],
-        locks=[port_lock.access('exclusive')],
-        command=['python', 'port_reserve.py', '--port-min=9069',
-                 '--port-max=11069', '--step=5']))
+    steps.extend(steps_odoo_port_reservation(configurator, options,
+                                             environ=environ,
+                                             port_min='9069',
+                                             port_max='11069'))
 
     steps.append(ShellCommand(
         command=['rm', '-f', WithProperties('%(workdir)s/openerp.pid')],
@@ -496,38 +926,96 @@ def functional(configurator, options, buildout_slave_path,
         env=environ,
     ))
 
-    steps.append(ShellCommand(
-        description=['Wait'],
-        command=['sleep', options.get('functional.wait', '30')]))
-
-    steps.extend(ShellCommand(
-        command=[cmd, Property('openerp_port'), Property('testing_db')],
-        name=cmd.rsplit('/')[-1],
-        description="running %s" % cmd,
-        descriptionDone="ran %s" % cmd,
-        flunkOnFailure=True,
-        haltOnFailure=False,
-        logfiles=dict(server='server-functional.log'),
-        env=environ)
-        for cmd in options.get('functional.commands').split())
+    steps.append(FileDownload(
+        mastersrc=os.path.join(BUILD_UTILS_PATH, 'wait_for_server.py'),
+        slavedest='wait_for_server.py'))
 
     steps.append(ShellCommand(
+        command=['python', 'wait_for_server.py',
+                 '--port', Property('openerp_port'),
+                 '--timeout', options.get('functional.wait', '30').strip(),
+                 '--pidfile', WithProperties('%(workdir)s/openerp.pid'),
+                 '--logfile', 'server-functional.log'],
+        name='wait',
+        description=['waiting', 'for', 'server'],
+        descriptionDone=['server', 'ready'],
+        haltOnFailure=True,
+        env=environ,
+    ))
+
+    commands = options.get('functional.commands').split()
+    parallel = int(options.get('functional.parallel', '1').strip())
+    if parallel > 1:
+        steps.append(FileDownload(
+            mastersrc=os.path.join(BUILD_UTILS_PATH, 'run_parallel.py'),
+            slavedest='run_parallel.py'))
+        logfiles = dict((name, 'functional-%s.log' % name)
+                        for name in log_names(commands))
+        logfiles['server'] = 'server-functional.log'
+        command, sampling_observers = resource_sampling(
+            options, ['python', 'run_parallel.py',
+                      '--jobs', str(parallel),
+                      '--port', Property('openerp_port'),
+                      '--db', Property('testing_db')] + commands)
+        steps.append(ObservedShellCommand(
+            command=command,
+            log_observers=sampling_observers,
+            name='functional',
+            description=['running', 'functional', 'tests'],
+            descriptionDone=['ran', 'functional', 'tests'],
+            flunkOnFailure=True,
+            haltOnFailure=False,
+            logfiles=logfiles,
+            env=environ))
+    else:
+        for cmd, name in zip(commands, log_names(commands)):
+            command, sampling_observers = resource_sampling(
+                options, [cmd, Property('openerp_port'),
+                          Property('testing_db')])
+            steps.append(ObservedShellCommand(
+                command=command,
+                log_observers=sampling_observers,
+                name=name,
+                description="running %s" % cmd,
+                descriptionDone="ran %s" % cmd,
+                flunkOnFailure=True,
+                haltOnFailure=False,
+                logfiles=dict(server='server-functional.log'),
+                env=environ))
+
+    return steps
+
+
+def functional_cleanup(configurator, options, environ=()):
+    """Stop the server, even if the build got halted, then release its port.
+    """
+    return [ShellCommand(
         command=['/sbin/start-stop-daemon',
                  '--pidfile', WithProperties('%(workdir)s/openerp.pid'),
                  '--stop', '--oknodo', '--retry', '5'],
-        name='start',
+        name='final_stop',
         description='stoping openerp',
         descriptionDone='openerp stopped',
-        haltOnFailure=True,
+        haltOnFailure=False,
+        alwaysRun=True,
         env=environ,
-    ))
+    )] + steps_odoo_port_release(configurator, options, environ=environ)
 
-    return steps
+functional.final_cleanup_steps = functional_cleanup
 
 
 def static_analysis(configurator, options, buildout_slave_path, environ=()):
     """Adds static analysis to the build.
 
+    Files are analyzed only if they changed since the previous build, and
+    the tools part is installed only if the resolved buildout configuration
+    (``bin/buildout annotate``) changed (see
+    ``build_utils/flake8_incremental.py`` and
+    ``build_utils/install_if_changed.py``).
+
+    The part doesn't have to be listed in ``parts``: it is recorded in its
+    own installed file, so that the main buildout run doesn't uninstall it.
+
     Available manifest file options:
 
        :static-analysis.flake-directories: *mandatory* list of subdirectories
@@ -536,20 +1024,31 @@ def static_analysis(configurator, options, buildout_slave_path, environ=()):
        :static-analysis.part: the buildout part to install to get the tools.
                               (defaults to 'static-analysis')
        :static-analysis.max-line-length: self explanatory
+       :static-analysis.jobs: number of concurrent flake8 processes
+                              (defaults to the number of CPUs)
 
     """
 
-    steps = []
+    steps = [FileDownload(mastersrc=os.path.join(BUILD_UTILS_PATH, name),
+                          slavedest=name)
+             for name in ('install_if_changed.py', 'flake8_incremental.py')]
 
+    part = options.get('static-analysis.part', 'static-analysis')
     steps.append(
-        ShellCommand(command=['bin/buildout',
+        ShellCommand(command=['python', 'install_if_changed.py',
+                              '--stamp', '.%s.stamp' % part,
+                              '--input-command',
+                              'bin/buildout -c %s annotate' % (
+                                  buildout_slave_path),
+                              '--output', 'bin/flake8',
+                              '--',
+                              'bin/buildout',
                               '-c', buildout_slave_path,
                               WithProperties(
                                   'buildout:eggs-directory='
                                   '%(builddir)s/../buildout-caches/eggs'),
-                              'install',
-                              options.get('static-analysis.part',
-                                          'static-analysis')
+                              'buildout:installed=.installed-%s.cfg' % part,
+                              'install', part,
                               ],
                      name="analysis tools",
                      description=['install', 'static', 'analysis', 'tools'],
@@ -568,10 +1067,14 @@ def static_analysis(configurator, options, buildout_slave_path, environ=()):
 
     flake_dirs = flake_dirs.split()
     steps.append(ShellCommand(
-        command=['bin/flake8',
-                 '--max-line-length',
-                 options.get('static-analysis.max-line-length', '100'),
-                 '--show-source',
+        command=['python', 'flake8_incremental.py',
+                 '--flake8', 'bin/flake8',
+                 '--cache-file',
+                 WithProperties('%(builddir)s/flake8-cache.json'),
+                 '--jobs', options.get('static-analysis.jobs', '0').strip(),
+                 '--flake8-arg=--max-line-length=' + options.get(
+                     'static-analysis.max-line-length', '100').strip(),
+                 '--flake8-arg=--show-source',
                  ] + flake_dirs,
         name='flake8',
         description=['flake8'] + flake_dirs,
@@ -615,7 +1118,14 @@ def sphinx_doc(configurator, options,
                               (encapsulation with no need of specifying
                               source/build dirs)
        :doc.sphinx-builddir: *only if* doc.sourcedir is specified: Sphinx build
-                             directory, defaults to ``${doc.sourcedir}/_build``
+                             directory, relative to the build directory.
+                             Defaults to ``../sphinx-cache``, i.e., outside
+                             of the build directory, so that the doctrees
+                             and Sphinx environment survive clean builds,
+                             and incremental builds are really incremental.
+                             Everything else in there is removed before
+                             each build, so that the pages of removed
+                             sources don't get published forever.
        :doc.sphinx-bin: *only if* doc.sourcedir is specified: Sphinx
                         executable, relative to buildout directory; defaults
                         to ``bin/sphinx-build``.
@@ -624,6 +1134,9 @@ def sphinx_doc(configurator, options,
                          ``'full'``, indicates to Sphinx to rebuild
                          everything without re-using the previous build
                          results.
+
+    The upload transfers the files that changed since the previous upload
+    only (see :func:`steps_tree_upload`).
     """
     steps = []
     sphinx_sourcedir = options.get('doc.sphinx-sourcedir')
@@ -632,13 +1145,26 @@ def sphinx_doc(configurator, options,
                                   description=['build', 'doc'],
                                   env=environ))
         html_builddir = 'doc/_build/html'
+        exclude = ()
     else:
         sphinx_builddir = options.get('doc.sphinx-builddir',
-                                      os.path.join(sphinx_sourcedir, '_build'))
+                                      '../sphinx-cache')
         # TODO GR, might want to change that for non-html builds
         html_builddir = sphinx_builddir
+        exclude = ('.doctrees', '.buildinfo')
         sphinx_mode = options.get('doc.sphinx-mode', 'incremental')
         sphinx_bin = options.get('doc.sphinx-bin', 'bin/sphinx-build')
+        # Sphinx never removes outputs: have it write them all again,
+        # it still reads only the sources that changed
+        steps.append(ShellCommand(
+            command=['sh', '-c', 'test ! -d "$0" || find "$0" -mindepth 1 '
+                     '-maxdepth 1 ! -name .doctrees -exec rm -rf {} +',
+                     sphinx_builddir],
+            name='sphinx_clean',
+            description=['cleaning', 'Sphinx', 'output'],
+            descriptionDone=['cleaned', 'Sphinx', 'output'],
+            haltOnFailure=True,
+        ))
         steps.append(Sphinx(sphinx_builddir=sphinx_builddir,
                             sphinx_sourcedir=sphinx_sourcedir,
                             sphinx=sphinx_bin,
@@ -658,32 +1184,11 @@ def sphinx_doc(configurator, options,
         waterfall_url = '/'.join((base_url, sub_path)) if base_url else None
         upload_dir = upload_dir.rstrip('/')
         master_doc_path = '/'.join((base_dir, sub_path))
-        steps.append(
-            DirectoryUpload(
-                slavesrc=html_builddir,
-                haltOnFailure=True,
-                compress='gz',
-                masterdest=WithProperties(master_doc_path),
-                url=WithProperties(waterfall_url) if waterfall_url else None))
-
-        # Fixing perms on uploaded files. Yes we could have unmask = 022 in
-        # all slaves,
-        # see note at the end of
-        #  <http://buildbot.net/buildbot/docs/0.8.7/full.html
-        #   #buildbot.steps.source.buildbot.steps.transfer.DirectoryUpload>
-        # but it's less work to fix the perms from here than to check all of
-        # them
-        steps.append(
-            MasterShellCommand(
-                description=["doc", "read", "permissions"],
-                command=['chmod', '-R', 'a+r',
-                         WithProperties(master_doc_path)]))
-        steps.append(
-            MasterShellCommand(
-                description=["doc", "dirx", "permissions"],
-                command=['find', WithProperties(master_doc_path),
-                         '-type', 'd', '-exec',
-                         'chmod', '755', '{}', ';']))
+        steps.extend(steps_tree_upload(
+            html_builddir, master_doc_path,
+            url=WithProperties(waterfall_url) if waterfall_url else None,
+            exclude=exclude,
+            name='upload_doc'))
 
     return steps
 
@@ -696,26 +1201,18 @@ def packaging(configurator, options,
     """
 
     archive_name_interp = options['packaging.prefix'] + '-%(buildout-tag)s'
+    archive_name_interp += '.' + archive_format(options)
     upload_dir = options['packaging.upload-dir']
     master_dir = os.path.join('/var/www/livraison', upload_dir)
-    master_path = os.path.join(master_dir, archive_name_interp + '.tar.bz2')
+    master_path = os.path.join(master_dir, archive_name_interp)
     base_url = options['packaging.base-url']
     return [
         FileUpload(
-            slavesrc=WithProperties(
-                '../dist/' + archive_name_interp + '.tar.bz2'),
-            masterdest=WithProperties(master_path),
+            slavesrc=WithProperties('../dist/' + archive_name_interp + suffix),
+            masterdest=WithProperties(master_path + suffix),
             url='/'.join((base_url, upload_dir)),
             mode=0644,
-        ),
-        FileUpload(
-            slavesrc=WithProperties(
-                '../dist/' + archive_name_interp + '.tar.bz2.md5'),
-            masterdest=WithProperties(master_path + '.md5'),
-            url='/'.join((base_url, upload_dir)),
-            mode=0644,
-        ),
-    ]
+        ) for suffix in ('', '.md5', '.sha256')]
 
 
 def autocommit(configurator, options, buildout_slave_path, environ=()):
@@ -2,6 +2,10 @@ import os
 from buildbot.process.properties import WithProperties
 from buildbot.steps.shell import ShellCommand
 from buildbot.steps.master import MasterShellCommand
+from buildbot.steps.transfer import FileDownload
+from ..utils import BUILDOUT_CACHES
+from ..utils import BUILD_UTILS_PATH
+from ..utils import archive_format
 
 
 def noop(configurator, options, buildout_slave_path, environ=()):
@@ -38,6 +42,11 @@ def packaging(configurator, options,
     :packaging.parts: buildout parts to extract in the tarball.
     :packaging.base-url: URL corresponding to ``packaging.root-dir``, for
                          display in the waterfall.
+    :packaging.format: archive format, one of ``tar.bz2`` (the default),
+                       ``tar.gz``, ``tar.xz`` or ``tar.zst``. Multi-threaded
+                       compressors are used if available on the slave.
+                       MD5 and SHA256 checksum files are produced along
+                       with the archive.
     """
 
     options['auto-watch'] = 'false'
@@ -59,7 +68,7 @@ def packaging(configurator, options,
                               description="cleaning",
                               workdir='.'))
 
-    cache = '%(builddir)s/../buildout-caches'  # lame duplication
+    cache = BUILDOUT_CACHES
     eggs_cache = cache + '/eggs'
     openerp_cache = cache + '/openerp'
     archive_name_interp = options['packaging.prefix'] + '-%(buildout-tag)s'
@@ -105,20 +114,18 @@ def packaging(configurator, options,
                               workdir='./src',
                               haltOnFailure=True,
                               ))
+    steps.append(FileDownload(
+        mastersrc=os.path.join(BUILD_UTILS_PATH, 'archive_pack.py'),
+        slavedest='archive_pack.py',
+        workdir='.',
+        haltOnFailure=True))
     steps.append(
-        ShellCommand(command=['tar', 'cjf',
-                              WithProperties(archive_name_interp + '.tar.bz2'),
-                              WithProperties(archive_name_interp)],
-                     description=["tar"],
+        ShellCommand(command=['python', '../archive_pack.py',
+                              WithProperties(archive_name_interp),
+                              '--format', archive_format(options)],
+                     description=["archive"],
                      haltOnFailure=True,
                      workdir='./dist'))
-    steps.append(ShellCommand(
-        command=WithProperties('md5sum ' + archive_name_interp +
-                               '.tar.bz2 > ' + archive_name_interp +
-                               '.tar.bz2.md5'),
-        description=["md5"],
-        warnOnFailure=False,
-        workdir='./dist'))
     steps.append(
         ShellCommand(workdir='.',
                      command=['mv',
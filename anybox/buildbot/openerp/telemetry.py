@@ -0,0 +1,300 @@
+"""Timing telemetry of build steps, kept in a SQLite database on the master.
+
+The :class:`TelemetryStatusReceiver` records the start and end times,
+result and slave of every finished step, along with the capability
+versions of the builder (e.g., ``pg_version=9.6``).
+
+The :class:`TelemetryStore` provides the queries, also available from the
+command line, through the ``anybox-buildbot-telemetry`` console script::
+
+  anybox-buildbot-telemetry telemetry.sqlite percentiles --builder b-pg9.6
+  anybox-buildbot-telemetry telemetry.sqlite trend --step buildout
+"""
+
+import sys
+import time
+import sqlite3
+from argparse import ArgumentParser
+
+from twisted.python import log
+from buildbot.status.base import StatusReceiverMultiService
+
+SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS steps ("
+    "builder TEXT, build INTEGER, step TEXT, slave TEXT, capability TEXT, "
+    "start REAL, end REAL, result INTEGER)",
+    "CREATE INDEX IF NOT EXISTS steps_builder_step "
+    "ON steps (builder, step, start)",
+)
+
+FILTERS = ('builder', 'step', 'slave')
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted non empty list."""
+    rank = int(round(fraction * (len(sorted_values) - 1)))
+    return sorted_values[rank]
+
+
+def slope(points):
+    """Least squares slope of a list of (x, y) points, or None."""
+    if len(points) < 2:
+        return None
+    n = float(len(points))
+    mean_x = sum(p[0] for p in points) / n
+    mean_y = sum(p[1] for p in points) / n
+    var_x = sum((p[0] - mean_x) ** 2 for p in points)
+    if not var_x:
+        return None
+    return sum((p[0] - mean_x) * (p[1] - mean_y) for p in points) / var_x
+
+
+def capability_string(properties):
+    """Canonical form of a dict of capability version properties."""
+    return ','.join('%s=%s' % (k, v) for k, v in sorted(properties.items())
+                    if v is not None)
+
+
+class TelemetryStore(object):
+    """Step timings storage and queries."""
+
+    def __init__(self, path):
+        self.path = path
+        self.cnx = sqlite3.connect(path)
+        for statement in SCHEMA:
+            self.cnx.execute(statement)
+        self.cnx.commit()
+
+    def record(self, builder, build, step, slave, capability,
+               start, end, result):
+        self.cnx.execute("INSERT INTO steps VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                         (builder, build, step, slave, capability,
+                          start, end, result))
+
+    def commit(self):
+        self.cnx.commit()
+
+    def close(self):
+        self.cnx.close()
+
+    def durations(self, since=None, capability=None, results=None, **filters):
+        """Return a dict of (start, duration) lists.
+
+        Keys are (builder, step, capability) triples, lists are sorted by
+        start time.
+
+        :param since: a timestamp
+        :param capability: a ``name=version`` string, matching all the
+                           builders having that capability version
+        :param results: if not None, an iterable of accepted step results
+        :param filters: exact values for the columns in :data:`FILTERS`
+        """
+        clauses, params = [], []
+        for col in FILTERS:
+            value = filters.pop(col, None)
+            if value is not None:
+                clauses.append('%s = ?' % col)
+                params.append(value)
+        if filters:
+            raise ValueError("Unknown filters: %r" % sorted(filters))
+        if since is not None:
+            clauses.append('start >= ?')
+            params.append(since)
+        if capability is not None:
+            clauses.append("(',' || capability || ',') LIKE ?")
+            params.append('%%,%s,%%' % capability)
+        if results is not None:
+            results = list(results)
+            clauses.append('result IN (%s)' % ', '.join('?' * len(results)))
+            params.extend(results)
+
+        query = "SELECT builder, step, capability, start, end FROM steps"
+        if clauses:
+            query += ' WHERE ' + ' AND '.join(clauses)
+        query += ' ORDER BY start'
+        series = {}
+        rows = self.cnx.execute(query, params)
+        for builder, step, cap, start, end in rows:
+            series.setdefault((builder, step, cap), []).append(
+                (start, end - start))
+        return series
+
+    def percentiles(self, fractions=(0.5, 0.9, 0.99), **kw):
+        """Return a list of dicts of duration statistics per series.
+
+        Keyword arguments are passed to :meth:`durations`.
+        """
+        stats = []
+        for (builder, step, cap), points in sorted(
+                self.durations(**kw).items()):
+            values = sorted(p[1] for p in points)
+            stats.append(dict(
+                builder=builder, step=step, capability=cap,
+                count=len(values), mean=sum(values) / len(values),
+                percentiles=[(f, percentile(values, f)) for f in fractions]))
+        return stats
+
+    def trends(self, window=10, **kw):
+        """Return a list of dicts describing the evolution of durations.
+
+        For each series, the median of the last ``window`` durations is
+        compared to the median of the ``window`` ones before, and the
+        least squares slope is given, in seconds per day.
+
+        Keyword arguments are passed to :meth:`durations`.
+        """
+        trends = []
+        for (builder, step, cap), points in sorted(
+                self.durations(**kw).items()):
+            recent = sorted(p[1] for p in points[-window:])
+            before = sorted(p[1] for p in points[-2 * window:-window])
+            trend = dict(builder=builder, step=step, capability=cap,
+                         count=len(points),
+                         recent=percentile(recent, 0.5),
+                         before=percentile(before, 0.5) if before else None,
+                         slope=slope(points))
+            if trend['slope'] is not None:
+                trend['slope'] *= 86400
+            trends.append(trend)
+        return trends
+
+
+class TelemetryStatusReceiver(StatusReceiverMultiService):
+    """Record the timings of all steps in a :class:`TelemetryStore`.
+
+    Rows are committed at the end of each build, and when the receiver is
+    replaced by a reconfig. The new receiver then takes over the running
+    builds.
+    """
+
+    compare_attrs = ('path', 'capability_properties')
+
+    def __init__(self, path, capability_properties=()):
+        StatusReceiverMultiService.__init__(self)
+        self.path = path
+        self.capability_properties = capability_properties
+        self.store = None
+
+    def setServiceParent(self, parent):
+        StatusReceiverMultiService.setServiceParent(self, parent)
+        self.master_status = self.parent
+        self.store = TelemetryStore(self.path)
+        self.master_status.subscribe(self)
+        for name in self.master_status.getBuilderNames():
+            builder = self.master_status.getBuilder(name)
+            for build in builder.getCurrentBuilds():
+                build.subscribe(self)
+
+    def disownServiceParent(self):
+        self.master_status.unsubscribe(self)
+        store, self.store = self.store, None
+        try:
+            store.commit()
+        except sqlite3.Error:
+            log.err(None, "Could not commit telemetry before reconfig")
+        store.close()
+        return StatusReceiverMultiService.disownServiceParent(self)
+
+    def builderAdded(self, name, builder):
+        return self  # subscribe to builds
+
+    def buildStarted(self, name, build):
+        return self  # subscribe to steps
+
+    def build_capability(self, build):
+        props = build.getProperties()
+        return capability_string(
+            dict((p, props.getProperty(p))
+                 for p in self.capability_properties))
+
+    def stepFinished(self, build, step, results):
+        if self.store is None:
+            return  # disowned, but still subscribed to a running build
+        start, end = step.getTimes()
+        if start is None or end is None:
+            return  # skipped step
+        try:
+            self.store.record(build.getBuilder().getName(),
+                              build.getNumber(), step.getName(),
+                              build.getSlavename(),
+                              self.build_capability(build),
+                              start, end, results[0])
+        except sqlite3.Error:
+            log.err(None, "Could not record telemetry of step %r" % (
+                step.getName()))
+
+    def buildFinished(self, name, build, results):
+        if self.store is None:
+            return
+        try:
+            self.store.commit()
+        except sqlite3.Error:
+            log.err(None, "Could not commit telemetry of build %r" % name)
+
+
+def format_duration(seconds):
+    if seconds is None:
+        return '-'
+    return '%.1fs' % seconds
+
+
+def print_percentiles(store, arguments, out):
+    fractions = [float(f) / 100 for f in arguments.percentiles.split(',')]
+    for stat in store.percentiles(fractions=fractions,
+                                  **query_kwargs(arguments)):
+        out.write('%s %s [%s] count=%d mean=%s %s\n' % (
+            stat['builder'], stat['step'], stat['capability'], stat['count'],
+            format_duration(stat['mean']),
+            ' '.join('p%g=%s' % (f * 100, format_duration(v))
+                     for f, v in stat['percentiles'])))
+
+
+def print_trends(store, arguments, out):
+    for trend in store.trends(window=arguments.window,
+                              **query_kwargs(arguments)):
+        change = ''
+        if trend['before']:
+            change = ' (%+.0f%%)' % (
+                100 * (trend['recent'] - trend['before']) / trend['before'])
+        out.write('%s %s [%s] count=%d median=%s before=%s%s '
+                  'slope=%s/day\n' % (
+                      trend['builder'], trend['step'], trend['capability'],
+                      trend['count'], format_duration(trend['recent']),
+                      format_duration(trend['before']), change,
+                      format_duration(trend['slope'])))
+
+
+def query_kwargs(arguments):
+    kw = dict((f, getattr(arguments, f)) for f in FILTERS)
+    kw['capability'] = arguments.capability
+    if arguments.days is not None:
+        kw['since'] = time.time() - arguments.days * 86400
+    if not arguments.all_results:
+        kw['results'] = (0, 1)  # SUCCESS, WARNINGS
+    return kw
+
+
+def main(argv=None, out=sys.stdout):
+    parser = ArgumentParser(description="Query build steps timings")
+    parser.add_argument('database')
+    parser.add_argument('query', choices=('percentiles', 'trend'))
+    for col in FILTERS:
+        parser.add_argument('--' + col)
+    parser.add_argument('--capability',
+                        help="Capability version, e.g., pg_version=9.6")
+    parser.add_argument('--days', type=float,
+                        help="Consider the given number of days only")
+    parser.add_argument('--all-results', action='store_true',
+                        help="Take failed steps into account")
+    parser.add_argument('--percentiles', default='50,90,99')
+    parser.add_argument('--window', type=int, default=10,
+                        help="Number of runs to compare for trends")
+    arguments = parser.parse_args(argv)
+
+    store = TelemetryStore(arguments.database)
+    if arguments.query == 'percentiles':
+        print_percentiles(store, arguments, out)
+    else:
+        print_trends(store, arguments, out)
+    store.close()
+    return 0
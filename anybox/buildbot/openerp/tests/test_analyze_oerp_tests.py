@@ -0,0 +1,95 @@
+import unittest
+from StringIO import StringIO
+from ..build_utils.analyze_oerp_tests import FailureScanner
+from ..build_utils.analyze_oerp_tests import match_label
+from ..build_utils.analyze_oerp_tests import ResultsCollector
+from ..build_utils.analyze_oerp_tests import timing_report
+
+LOG = """\
+2015-03-04 10:00:00,000 1 INFO db openerp.modules.loading: loading 1 modules
+2015-03-04 10:00:01,000 1 ERROR db openerp.addons.x: ERROR:tests.x: oops
+2015-03-04 10:00:02,000 1 ERROR db openerp.addons.y: ERROR:tests.y: oops
+2015-03-04 10:00:03,000 1 ERROR db openerp.addons.z: ERROR:tests.z: oops
+2015-03-04 10:00:04,000 1 CRITICAL db openerp.service: boom
+"""
+
+TESTS_LOG = """\
+2015-03-04 10:00:01,000 1 INFO db openerp.modules.module: \
+module sale: loading test/sale_demo.yml
+2015-03-04 10:00:01,500 1 ERROR db openerp.tools.yaml_import: oops
+2015-03-04 10:00:02,000 1 INFO db openerp.modules.loading: loading 4 modules
+2015-03-04 10:00:02,000 1 INFO db openerp.addons.sale.tests.test_sale: \
+test_one (openerp.addons.sale.tests.test_sale.TestSale) ...{space}
+2015-03-04 10:00:02,100 1 INFO db openerp.models: unrelated
+2015-03-04 10:00:02,250 1 INFO db openerp.addons.sale.tests.test_sale: ok
+2015-03-04 10:00:02,250 1 INFO db openerp.addons.sale.tests.test_sale: \
+test_two (openerp.addons.sale.tests.test_sale.TestSale) ... FAIL
+""".format(space=' ')
+
+
+class TestAnalyze(unittest.TestCase):
+
+    def test_match_label(self):
+        self.assertIsNone(match_label('INFO nothing to see'))
+        self.assertEqual(match_label('WARNING:tests.x: AssertionError'),
+                         'Failure in Python block')
+        self.assertEqual(
+            match_label('ERROR db openerp: Failed to load registry'),
+            'Errors loading addons')
+
+    def test_scanner(self):
+        scanner = FailureScanner(max_examples=2)
+        for line in StringIO(LOG):
+            scanner.feed(line)
+        self.assertEqual(scanner.total(), 4)
+        self.assertEqual(scanner.counts['Errors during x/yml tests'], 3)
+        self.assertEqual(len(scanner.examples['Errors during x/yml tests']),
+                         2)
+
+        out = StringIO()
+        scanner.report(out=out)
+        report = out.getvalue()
+        self.assertTrue(report.startswith('FAILURES DETECTED'))
+        self.assertTrue('... (1 more)' in report)
+        self.assertTrue(report.endswith('Total: 4 failures \n'))
+
+    def test_several_patterns_count_once(self):
+        line = ('2015-03-04 10:00:00,000 1 CRITICAL db '
+                'openerp.modules.loading: At least one test failed '
+                'when loading the modules.\n')
+        self.assertEqual(match_label(line), 'Critical logs')
+        scanner = FailureScanner()
+        scanner.feed(line)
+        self.assertEqual(scanner.total(), 1)
+        self.assertEqual(scanner.counts, {'Critical logs': 1})
+
+    def test_no_failure(self):
+        scanner = FailureScanner()
+        scanner.feed('INFO all good\n')
+        out = StringIO()
+        scanner.report(out=out)
+        self.assertEqual(out.getvalue(), "No failure detected\n")
+
+    def test_results(self):
+        collector = ResultsCollector()
+        for line in StringIO(TESTS_LOG):
+            collector.feed(line)
+        self.assertEqual([(r['module'], r['name'], r['status'], r['duration'])
+                          for r in collector.results],
+                         [('sale', 'test/sale_demo.yml', 'error', 1.0),
+                          ('sale', 'test_one', 'success', 0.25),
+                          ('sale', 'test_two', 'failure', 0.0)])
+        self.assertEqual(collector.totals(), dict(error=1, success=1,
+                                                  failure=1))
+
+    def test_timing_report(self):
+        timing = dict(modules=dict(sale=3.0, stock=10.0),
+                      tests={'sale: a.test_one': 0.5})
+        previous = dict(modules=dict(sale=1.0, stock=9.5), tests={})
+        lines = timing_report(timing, previous=previous, top=1)
+        self.assertEqual(lines[0], "slowest module: stock (10.0s); "
+                         "slowest test: sale: a.test_one (0.5s); "
+                         "1 regressions")
+        self.assertTrue("  %9.3fs  stock" % 10.0 in lines)
+        self.assertFalse("  %9.3fs  sale" % 3.0 in lines)
+        self.assertTrue("  %+9.3fs  sale (1.000s -> 3.000s)" % 2.0 in lines)
@@ -1,5 +1,7 @@
 from base import BaseTestCase
 
+from buildbot.process.properties import Property
+from buildbot.process.properties import WithProperties
 from ..configurator import BuildoutsConfigurator
 from ..steps import SetCapabilityProperties
 
@@ -389,3 +391,395 @@ class TestBuilders(BaseTestCase):
         # other option are unchanged
         factory = builders['inheritor-pg8.4'].factory
         self.assertEquals(factory.options['openerp-addons'], ('stock, crm'))
+
+    def test_git_buildout_reference(self):
+        self.configurator.register_build_factories(
+            self.data_join('manifest_git_reference.cfg'))
+        factory = self.configurator.build_factories['git-ref']
+
+        for step in factory.steps:
+            command = step.kwargs.get('command')
+            if command and 'buildout_git_dl.py' in command:
+                break
+        else:
+            self.fail("No git retrieval step found")
+
+        i = command.index('--reference-dir')
+        self.assertEqual(command[i + 1].fmtstring,
+                         '%(builddir)s/../buildout-caches/git')
+        self.assertTrue('--filter=blob:none' in command)
+        self.assertTrue('--single-branch' in command)
+        self.assertTrue('--gc-interval=3' in command)
+
+    def test_hg_buildout_share(self):
+        self.configurator.register_build_factories(
+            self.data_join('manifest_hg_share.cfg'))
+        factory = self.configurator.build_factories['hg-share']
+
+        for step in factory.steps:
+            command = step.kwargs.get('command')
+            if command and 'buildout_hg_dl.py' in command:
+                break
+        else:
+            self.fail("No hg retrieval step found")
+
+        i = command.index('--share-dir')
+        self.assertEqual(command[i + 1].fmtstring,
+                         '%(builddir)s/../buildout-caches/hg')
+
+    def test_archive_buildout(self):
+        self.configurator.register_build_factories(
+            self.data_join('manifest_archive.cfg'))
+        factories = self.configurator.build_factories
+
+        steps = dict((step_name(s), s)
+                     for s in factories['from-archive'].steps)
+        command = steps['unpack'].kwargs['command']
+        self.assertEqual(command[:2], ['python', 'archive_extract.py'])
+        self.assertEqual(command[2].fmtstring,
+                         '%(prop:archive_name)s.tar.bz2')
+
+        steps = dict((step_name(s), s)
+                     for s in factories['from-archive-stream'].steps)
+        command = steps['unpack'].kwargs['command']
+        self.assertEqual(command[2].fmtstring,
+                         'http://upload.server.example/'
+                         '%(prop:upload_subdir)s/'
+                         '%(prop:archive_name)s.tar.bz2')
+
+    def test_packaging_format(self):
+        self.configurator.register_build_factories(
+            self.data_join('manifest_packaging.cfg'))
+        factory = self.configurator.build_factories['project-release-xz']
+
+        for step in factory.steps:
+            command = step.kwargs.get('command')
+            if command and '../archive_pack.py' in command:
+                break
+        else:
+            self.fail("No archiving step found")
+        self.assertEqual(command[-2:], ['--format', 'tar.xz'])
+
+        uploaded = [step.kwargs['masterdest'].fmtstring
+                    for step in factory.steps
+                    if 'masterdest' in step.kwargs]
+        self.assertEqual(uploaded, [
+            '/var/www/livraison/somewhere/myproject-oerp-%(buildout-tag)s'
+            '.tar.xz' + suffix for suffix in ('', '.md5', '.sha256')])
+
+    def test_template_pool(self):
+        self.configurator.register_build_factories(
+            self.data_join('manifest_template_pool.cfg'))
+        factory = self.configurator.build_factories['pooled']
+        steps = dict((step_name(s), s) for s in factory.steps)
+
+        command = steps['createdb'].kwargs['command']
+        self.assertEqual(command[:2], ['python', 'db_template_pool.py'])
+        i = command.index('--modules')
+        self.assertEqual(command[i + 1], 'base,mail')
+        self.assertTrue('--without-demo' in command)
+        self.assertTrue('final_dropdb' in steps)
+
+    def test_sharded_tests(self):
+        self.configurator.register_build_factories(
+            self.data_join('manifest_sharded.cfg'))
+        factory = self.configurator.build_factories['sharded']
+        steps = dict((step_name(s), s) for s in factory.steps)
+
+        command = steps['test'].kwargs['command']
+        self.assertEqual(command[:2], ['python', 'shard_tests.py'])
+        i = command.index('--addons')
+        self.assertEqual(command[i:i + 4],
+                         ['--addons', 'stock,crm,sale', '--shards', '3'])
+        i = command.index('--port')
+        self.assertEqual(command[i + 1], Property('openerp_port'))
+
+        # one block of ports per shard, released even if the build fails
+        names = [step_name(s) for s in factory.steps]
+        acquire = factory.steps[names.index('test') - 1]
+        self.assertEqual(acquire.kwargs['command'][:3],
+                         ['python', 'port_lease.py', 'acquire'])
+        self.assertTrue('--blocks=3' in acquire.kwargs['command'])
+        self.assertTrue('final_port_release' in names)
+        self.assertTrue('analyze' in steps)
+
+    def test_changed_only(self):
+        self.configurator.register_build_factories(
+            self.data_join('manifest_changed_only.cfg'))
+        factory = self.configurator.build_factories['changed-only']
+        steps = dict((step_name(s), s) for s in factory.steps)
+
+        command = steps['select_addons'].kwargs['command']
+        i = command.index('--addons')
+        self.assertEqual(command[i + 1], 'stock,crm')
+        command = steps['test'].kwargs['command']
+        i = command.index('-i')
+        self.assertEqual(command[i + 1], Property('addons_selection'))
+
+    def test_log_observers(self):
+        self.configurator.register_build_factories(
+            self.data_join('manifest_1.cfg'))
+        factory = self.configurator.build_factories['simple']
+        steps = dict((step_name(s), s) for s in factory.steps)
+        observers = steps['test'].kwargs['log_observers']
+        self.assertEqual([logname for logname, _ in observers], ['test'])
+        self.assertFalse(observers[0][1]().fail_fast)
+
+        factory = self.configurator.build_factories['fail-fast']
+        steps = dict((step_name(s), s) for s in factory.steps)
+        observers = steps['test'].kwargs['log_observers']
+        self.assertTrue(observers[0][1]().fail_fast)
+
+    def test_analyze_results(self):
+        self.configurator.register_build_factories(
+            self.data_join('manifest_1.cfg'))
+        factory = self.configurator.build_factories['results']
+        steps = dict((step_name(s), s) for s in factory.steps)
+
+        command = steps['analyze'].kwargs['command']
+        self.assertEqual(command[-4:], ['--json-output', 'test-results.json',
+                                        '--junit-output', 'test-results.xml'])
+        upload = steps['upload_results_json']
+        self.assertEqual(upload.kwargs['slavesrc'], 'test-results.json')
+        self.assertEqual(upload.kwargs['masterdest'].fmtstring,
+                         'test-results/%(buildername)s/%(buildnumber)s.json')
+
+        factory = self.configurator.build_factories['simple']
+        names = [step_name(s) for s in factory.steps]
+        self.assertFalse('upload_results_json' in names)
+
+    def test_analyze_timing(self):
+        self.configurator.register_build_factories(
+            self.data_join('manifest_1.cfg'))
+        factory = self.configurator.build_factories['timing']
+        names = [step_name(s) for s in factory.steps]
+        i = names.index('analyze')
+        self.assertEqual(names[i - 1:i + 3],
+                         ['download_previous_timing', 'analyze',
+                          'timing_summary', 'upload_timing'])
+
+        analyze = factory.steps[i]
+        command = analyze.kwargs['command']
+        j = command.index('--timing-top')
+        self.assertEqual(command[j + 1], '5')
+        self.assertEqual(analyze.kwargs['logfiles'], dict(timing='timing.txt'))
+
+    def test_functional_wait(self):
+        self.configurator.register_build_factories(
+            self.data_join('manifest_functional.cfg'))
+        factory = self.configurator.build_factories['functional']
+        names = [step_name(s) for s in factory.steps]
+        i = names.index('wait')
+        self.assertEqual(names[i + 1:i + 3], ['check_ui', 'check_api'])
+
+        command = factory.steps[i].kwargs['command']
+        self.assertEqual(command[:2], ['python', 'wait_for_server.py'])
+        j = command.index('--timeout')
+        self.assertEqual(command[j + 1], '90')
+        self.assertTrue(factory.steps[i].kwargs['haltOnFailure'])
+
+        # the server gets stopped even if the build has been halted,
+        # before its database is dropped
+        self.assertEqual(names[-3:],
+                         ['final_stop', 'final_port_release', 'final_dropdb'])
+        self.assertTrue(factory.steps[-3].kwargs['alwaysRun'])
+
+    def test_port_lease(self):
+        self.configurator.register_build_factories(
+            self.data_join('manifest_1.cfg'))
+        factory = self.configurator.build_factories['with-port']
+        names = [step_name(s) for s in factory.steps]
+        acquire = factory.steps[names.index('test') - 1]
+        self.assertFalse(acquire.kwargs.get('locks'))
+        self.assertEqual(acquire.kwargs['command'][:3],
+                         ['python', 'port_lease.py', 'acquire'])
+        self.assertEqual(names[-2:], ['final_port_release', 'final_dropdb'])
+        release = factory.steps[names.index('final_port_release')]
+        self.assertTrue(release.kwargs['alwaysRun'])
+
+        factory = self.configurator.build_factories['simple']
+        names = [step_name(s) for s in factory.steps]
+        self.assertFalse('final_port_release' in names)
+
+        factory = self.configurator.build_factories['oecommand-with-port']
+        names = [step_name(s) for s in factory.steps]
+        self.assertEqual(names[-2:], ['final_port_release', 'final_dropdb'])
+
+        factory = self.configurator.build_factories['oecommand']
+        names = [step_name(s) for s in factory.steps]
+        self.assertFalse('final_port_release' in names)
+
+    def test_functional_parallel(self):
+        self.configurator.register_build_factories(
+            self.data_join('manifest_functional.cfg'))
+        factory = self.configurator.build_factories['functional-parallel']
+        steps = dict((step_name(s), s) for s in factory.steps)
+        self.assertFalse('check_ui' in steps)
+
+        command = steps['functional'].kwargs['command']
+        self.assertEqual(command[:4],
+                         ['python', 'run_parallel.py', '--jobs', '4'])
+        self.assertEqual(command[-2:], ['bin/check_ui', 'bin/check_api'])
+        self.assertEqual(steps['functional'].kwargs['logfiles']['check_api'],
+                         'functional-check_api.log')
+
+        factory = self.configurator.build_factories['functional-same-name']
+        steps = dict((step_name(s), s) for s in factory.steps)
+        logfiles = steps['functional'].kwargs['logfiles']
+        self.assertEqual(logfiles['bin_check'], 'functional-bin_check.log')
+        self.assertEqual(logfiles['tests_bin_check'],
+                         'functional-tests_bin_check.log')
+
+    def test_static_analysis(self):
+        self.configurator.register_build_factories(
+            self.data_join('manifest_static_analysis.cfg'))
+        factory = self.configurator.build_factories['static']
+        steps = dict((step_name(s), s) for s in factory.steps)
+
+        command = steps['analysis tools'].kwargs['command']
+        self.assertEqual(command[:2], ['python', 'install_if_changed.py'])
+        self.assertEqual(command[-2:], ['install', 'static-analysis'])
+        self.assertTrue('buildout:installed=.installed-static-analysis.cfg'
+                        in command)
+        i = command.index('--input-command')
+        self.assertTrue(command[i + 1].endswith(' annotate'))
+
+        command = steps['flake8'].kwargs['command']
+        self.assertEqual(command[:2], ['python', 'flake8_incremental.py'])
+        i = command.index('--jobs')
+        self.assertEqual(command[i + 1], '8')
+        self.assertEqual(command[-1], 'addons-custom')
+
+    def test_sphinx_doc(self):
+        self.configurator.register_build_factories(
+            self.data_join('manifest_sphinx.cfg'))
+        factory = self.configurator.build_factories['doc']
+        steps = dict((step_name(s), s) for s in factory.steps)
+
+        self.assertEqual(steps['sphinx'].kwargs['sphinx_builddir'],
+                         '../sphinx-cache')
+        self.assertFalse('upload' in steps)  # no more DirectoryUpload
+        # stale outputs removed, doctrees kept
+        names = [step_name(s) for s in factory.steps]
+        self.assertEqual(names.index('sphinx_clean') + 1,
+                         names.index('sphinx'))
+        self.assertEqual(steps['sphinx_clean'].kwargs['command'][-1],
+                         '../sphinx-cache')
+
+        command = steps['upload_doc_pack'].kwargs['command']
+        self.assertEqual(command[:4], ['python', 'tree_sync.py', 'pack',
+                                       '../sphinx-cache'])
+        i = command.index('--exclude')
+        self.assertEqual(command[i + 1], '.doctrees')
+
+        self.assertEqual(steps['upload_doc_manifest'].kwargs['mastersrc'],
+                         WithProperties('/srv/doc/project/%(buildout-tag:-'
+                                        'current)s/.tree-manifest.json'))
+        self.assertEqual(steps['upload_doc'].kwargs['url'],
+                         WithProperties('http://docs.example/project/'
+                                        '%(buildout-tag:-current)s'))
+        command = steps['upload_doc_apply'].kwargs['command']
+        self.assertEqual(command[2:4], [
+            'apply',
+            WithProperties('/srv/doc/project/%(buildout-tag:-current)s')])
+
+    def test_nose_upload(self):
+        self.configurator.register_build_factories(
+            self.data_join('manifest_nose.cfg'))
+        factory = self.configurator.build_factories['nose']
+        steps = dict((step_name(s), s) for s in factory.steps)
+
+        upload_path = '/srv/nose/%(buildername)s/%(buildnumber)s'
+        command = steps['upload_nose_missing'].kwargs['command']
+        i = command.index('--store')
+        self.assertEqual(command[i + 1],
+                         WithProperties('/srv/nose/%(buildername)s/.blobs'))
+        command = steps['upload_nose_pack'].kwargs['command']
+        self.assertEqual(command[:4], ['python', 'tree_sync.py', 'pack-blobs',
+                                       'nose_output'])
+        command = steps['upload_nose_link'].kwargs['command']
+        self.assertEqual(command[2:4], ['link', WithProperties(upload_path)])
+        # no more permission fixing of the whole tree
+        self.assertFalse(any(isinstance(s.kwargs.get('command'), list) and
+                             s.kwargs['command'][0] in ('chmod', 'find')
+                             for s in factory.steps))
+
+    def test_nose_aggregate(self):
+        self.configurator.register_build_factories(
+            self.data_join('manifest_nose.cfg'))
+        factory = self.configurator.build_factories['nose']
+        self.assertFalse('aggregate_nose' in [step_name(s)
+                                              for s in factory.steps])
+
+        factory = self.configurator.build_factories['nose-aggregate']
+        names = [step_name(s) for s in factory.steps]
+        self.assertTrue(names.index('collect_nose') <
+                        names.index('upload_nose_manifest') <
+                        names.index('aggregate_nose'))
+        steps = dict((step_name(s), s) for s in factory.steps)
+        command = steps['aggregate_nose'].kwargs['command']
+        i = command.index('--dest')
+        self.assertEqual(command[i + 1], '/srv/nose-aggregates/'
+                         'standalone_buildouts_6.0-anybox.cfg')
+
+    def test_resources_sample(self):
+        self.configurator.register_build_factories(
+            self.data_join('manifest_resources.cfg'))
+        factory = self.configurator.build_factories['resources']
+        steps = dict((step_name(s), s) for s in factory.steps)
+        for name in ('buildout', 'test'):
+            command = steps[name].kwargs['command']
+            self.assertEqual(command[:2], ['python', 'resource_sampler.py'])
+            i = command.index('--')
+            self.assertEqual(command[i + 1][:4], 'bin/')
+            self.assertEqual(len(steps[name].kwargs['log_observers']),
+                             1 if name == 'buildout' else 2)
+
+        factory = self.configurator.build_factories['no-resources']
+        steps = dict((step_name(s), s) for s in factory.steps)
+        self.assertEqual(steps['buildout'].kwargs['command'][0],
+                         'bin/buildout')
+        self.assertEqual(steps['buildout'].kwargs['log_observers'], [])
+
+    def test_dump_cache(self):
+        self.configurator.register_build_factories(
+            self.data_join('manifest_dump_cache.cfg'))
+        factory = self.configurator.build_factories['upgrade']
+        steps = dict((step_name(s), s) for s in factory.steps)
+
+        command = steps['dump_cache'].kwargs['command']
+        i = command.index('--source')
+        self.assertEqual(command[i + 1], 'backup.example:/srv/dumps/prod.dump')
+        self.assertTrue('final_dropdb' in steps)
+
+    def test_ephemeral_cluster(self):
+        self.configurator.register_build_factories(
+            self.data_join('manifest_ephemeral.cfg'))
+        factory = self.configurator.build_factories['ephemeral']
+        names = [step_name(s) for s in factory.steps]
+
+        # the cluster must be there before buildout writes its port
+        self.assertTrue(names.index('ephemeral_cluster') <
+                        names.index('buildout') < names.index('createdb'))
+        command = factory.steps[names.index('ephemeral_cluster')].kwargs[
+            'command']
+        i = command.index('--port-min')
+        self.assertEqual(command[i:i + 4],
+                         ['--port-min', '20000', '--port-max', '20100'])
+        i = command.index('--lease-file')
+        self.assertEqual(command[i + 1].fmtstring,
+                         '%(builddir)s/../port-leases.json')
+        self.assertEqual(names[-1], 'final_ephemeral_cluster')
+        self.assertTrue(factory.steps[-1].kwargs['alwaysRun'])
+        self.assertFalse('final_dropdb' in names)
+
+    def test_cleanup_steps_deferred(self):
+        self.configurator.register_build_factories(
+            self.data_join('manifest_1.cfg'))
+        factory = self.configurator.build_factories['deferred-cleanup']
+
+        step = factory.steps[-1]
+        self.assertEqual(step_name(step), 'final_dropdb')
+        command = step.kwargs['command']
+        self.assertEqual(command[:2], ['python', 'db_reaper.py'])
+        self.assertTrue('--detach' in command)
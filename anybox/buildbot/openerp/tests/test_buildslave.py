@@ -1,5 +1,10 @@
 import unittest
 from anybox.buildbot.openerp import buildslave
+from anybox.buildbot.openerp.configurator import BuildoutsConfigurator
+from base import BaseTestCase
+from test_telemetry import FakeMasterStatus
+from test_telemetry import FakeBuilder as FakeStatusBuilder
+from test_telemetry import FakeBuild as FakeStatusBuild
 
 FAKE_PRIOS = dict(low1=0, low2=0, low3=0,
                   med1=1, med2=1, med3=1,
@@ -37,3 +42,190 @@ class TestNextSlave(unittest.TestCase):
         next_slave = buildslave.priorityAwareNextSlave
         self.assertEqual(next_slave(None, ['low1'], get_priority=fake_prio),
                          'low1')
+
+
+class FakeProperties(object):
+
+    def __init__(self, **props):
+        self.props = props
+
+    def getProperty(self, name, default=None):
+        return self.props.get(name, default)
+
+    def asList(self):
+        return [(k, v, 'test') for k, v in self.props.items()]
+
+
+class FakeSlaveBuilder(object):
+
+    def __init__(self, slave, busy=False):
+        self.slave = slave
+        self.busy = busy
+
+    def isBusy(self):
+        return self.busy
+
+
+class FakeSlave(object):
+
+    def __init__(self, name, priority=0, max_builds=None, running=0):
+        self.slavename = name
+        self.properties = FakeProperties(slave_priority=priority)
+        self.max_builds = max_builds
+        self.slavebuilders = dict(('b%d' % i, FakeSlaveBuilder(self, True))
+                                  for i in range(running))
+        self.slavebuilders['candidate'] = FakeSlaveBuilder(self)
+
+
+def candidate(*args, **kwargs):
+    return FakeSlave(*args, **kwargs).slavebuilders['candidate']
+
+
+class FakeBuilder(object):
+    name = 'builder'
+
+
+class TestLoadAwareNextSlave(unittest.TestCase):
+
+    def setUp(self):
+        self.stats = buildslave.SlaveStats()
+        self.next_slave = buildslave.LoadAwareNextSlave(stats=self.stats)
+
+    def test_slowness(self):
+        stats = self.stats
+        self.assertEqual(stats.slowness('s1'), 1.0)
+        for d in (100, 110, 120):
+            stats.record_step('builder', 'buildout', 's1', d)
+            stats.record_step('builder', 'buildout', 's2', d * 2)
+        stats.record_step('other', 'buildout', 's3', 10)
+        self.assertTrue(stats.slowness('s1', builder='builder') < 1)
+        self.assertTrue(stats.slowness('s2', builder='builder') > 1)
+        self.assertEqual(stats.slowness('s3'), 1.0)  # nothing to compare to
+        self.assertEqual(stats.slowness('s1', builder='unknown'),
+                         stats.slowness('s1'))
+
+    def test_busy(self):
+        busy = candidate('busy', priority=1, max_builds=2, running=2)
+        idle = candidate('idle', priority=1, max_builds=2)
+        for i in xrange(20):
+            self.assertTrue(self.next_slave(FakeBuilder(), [busy, idle])
+                            is idle)
+
+    def test_priority_still_matters(self):
+        half_busy = candidate('high', priority=2, max_builds=4, running=2)
+        idle = candidate('low', priority=1, max_builds=4)
+        self.assertTrue(self.next_slave(FakeBuilder(), [idle, half_busy])
+                        is half_busy)
+
+    def test_reported_resources(self):
+        loaded = candidate('loaded')
+        full = candidate('full')
+        fine = candidate('fine')
+        self.stats.record_resources('loaded', dict(load_avg=8, cpus=2))
+        self.stats.record_resources('full', dict(disk_free=1000))
+        self.stats.record_resources('fine', dict(load_avg=1, cpus=2,
+                                                 disk_free=10 ** 8))
+        ranked = buildslave.rank_slaves(FakeBuilder(), [loaded, full, fine],
+                                        stats=self.stats)
+        self.assertEqual([slb.slave.slavename for score, slb in ranked],
+                         ['fine', 'loaded', 'full'])
+
+    def test_custom_score(self):
+        next_slave = buildslave.LoadAwareNextSlave(
+            score=lambda slb, stats, builder_name=None: len(
+                slb.slave.slavename),
+            stats=self.stats)
+        chosen = next_slave(FakeBuilder(), [
+            candidate('a'), candidate('abc'), candidate('ab')])
+        self.assertEqual(chosen.slave.slavename, 'abc')
+
+    def test_no_slaves(self):
+        self.assertIsNone(self.next_slave(FakeBuilder(), []))
+
+
+class FakeStep(object):
+
+    def __init__(self, name, start, end):
+        self.name = name
+        self.times = start, end
+
+    def getName(self):
+        return self.name
+
+    def getTimes(self):
+        return self.times
+
+
+class FakeBuild(object):
+
+    def __init__(self, slave, **props):
+        self.slave = slave
+        self.props = FakeProperties(**props)
+
+    def getBuilder(self):
+        return FakeBuilder()
+
+    def getSlavename(self):
+        return self.slave
+
+    def getProperties(self):
+        return self.props
+
+
+FakeBuilder.getName = lambda self: self.name
+
+
+class TestSlaveStatsReceiver(unittest.TestCase):
+
+    def test_receiver(self):
+        stats = buildslave.SlaveStats()
+        receiver = buildslave.SlaveStatsReceiver(stats)
+        build = FakeBuild('s1', resources_test=dict(load_avg=3.0),
+                          other='x')
+        receiver.stepFinished(build, FakeStep('test', 10, 70), (0, []))
+        receiver.stepFinished(build, FakeStep('failed', 10, 20), (2, []))
+        receiver.stepFinished(build, FakeStep('skip', None, None), (3, []))
+        receiver.buildFinished('builder', build, 0)
+        self.assertEqual(stats.durations.keys(), [('builder', 'test')])
+        self.assertEqual(list(stats.durations[('builder', 'test')]['s1']),
+                         [60])
+        self.assertEqual(stats.resources, dict(s1=dict(load_avg=3.0)))
+
+    def test_reconfig(self):
+        """Builds running across a reconfig are still followed."""
+        stats = buildslave.SlaveStats()
+        build = FakeStatusBuild('b', 1, 's1')
+        master_status = FakeMasterStatus(FakeStatusBuilder('b', [build]))
+
+        old = buildslave.SlaveStatsReceiver(stats)
+        old.setServiceParent(master_status)
+        old.disownServiceParent()
+
+        new = buildslave.SlaveStatsReceiver(stats)
+        new.setServiceParent(master_status)
+        self.assertEqual(master_status.watchers, [new])
+        self.assertEqual(build.watchers, [old, new])
+        new.stepFinished(build, FakeStep('test', 10, 70), (0, []))
+        self.assertEqual(list(stats.durations[('b', 'test')]['s1']), [60])
+        new.disownServiceParent()
+
+
+class TestPopulate(BaseTestCase):
+
+    def test_populate(self):
+        self.configurator = BuildoutsConfigurator(self.bm_dir)
+        next_slave = buildslave.LoadAwareNextSlave()
+        self.configurator.next_slave = next_slave
+        master = self.populate('manifest_capability.cfg', 'one_slave.cfg')
+        receivers = [s for s in master['status']
+                     if isinstance(s, buildslave.SlaveStatsReceiver)]
+        self.assertEqual(len(receivers), 1)
+        self.assertTrue(receivers[0].stats is next_slave.stats)
+        for builder in master['builders']:
+            self.assertTrue(builder.nextSlave is next_slave)
+
+    def test_populate_default(self):
+        self.configurator = BuildoutsConfigurator(self.bm_dir)
+        master = self.populate('manifest_capability.cfg', 'one_slave.cfg')
+        self.assertFalse([s for s in master.get('status', ())
+                          if isinstance(s, buildslave.SlaveStatsReceiver)])
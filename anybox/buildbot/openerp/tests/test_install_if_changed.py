@@ -0,0 +1,41 @@
+import os
+
+from base import BaseTestCase
+from ..build_utils import install_if_changed
+
+
+class TestInstallIfChanged(BaseTestCase):
+
+    def run_install(self, config):
+        """Run a fake installation, with config as resolved configuration.
+
+        Return True if the installation command actually ran.
+        """
+        output = self.master_join('flake8')
+        marker = self.master_join('ran')
+        if os.path.exists(marker):
+            os.unlink(marker)
+        code = install_if_changed.main([
+            '--stamp', self.master_join('stamp'),
+            '--input-command', 'echo ' + config,
+            '--output', output,
+            '--', 'touch', output, marker])
+        self.assertEqual(code, 0)
+        return os.path.exists(marker)
+
+    def test_skip(self):
+        self.assertTrue(self.run_install('flake8==3.5'))
+        self.assertFalse(self.run_install('flake8==3.5'))
+        self.assertTrue(self.run_install('flake8==3.6'))
+
+        # the part got uninstalled by some other buildout run
+        os.unlink(self.master_join('flake8'))
+        self.assertTrue(self.run_install('flake8==3.6'))
+
+    def test_failing_input_command(self):
+        stamp = self.master_join('stamp')
+        code = install_if_changed.main([
+            '--stamp', stamp, '--input-command', 'false',
+            '--', 'true'])
+        self.assertEqual(code, 0)
+        self.assertFalse(os.path.exists(stamp))
@@ -0,0 +1,143 @@
+import unittest
+from twisted.internet import defer
+
+from base import BaseTestCase
+from ..configurator import BuildoutsConfigurator
+from .. import metrics
+
+
+class FakePoller(object):
+
+    def __init__(self, fail=False):
+        self.fail = fail
+
+    def poll(self):
+        if self.fail:
+            return defer.fail(RuntimeError("unreachable"))
+        return defer.succeed(None)
+
+
+class FakeRequest(object):
+
+    def __init__(self):
+        self.headers = {}
+
+    def setHeader(self, name, value):
+        self.headers[name] = value
+
+
+class FakeSlaveBuilder(object):
+
+    def __init__(self, busy):
+        self.busy = busy
+
+    def isBusy(self):
+        return self.busy
+
+
+class FakeSlave(object):
+
+    def __init__(self, connected, *busy):
+        self.connected = connected
+        self.slavebuilders = dict(('b%d' % i, FakeSlaveBuilder(b))
+                                  for i, b in enumerate(busy))
+
+    def isConnected(self):
+        return self.connected
+
+
+class FakeBuildRequests(object):
+
+    def getBuildRequests(self, claimed=None, complete=None):
+        assert claimed is False and complete is False
+        return defer.succeed([dict(buildername='b1'),
+                              dict(buildername='b1'),
+                              dict(buildername='b3')])
+
+
+class FakeMaster(object):
+
+    def __init__(self):
+        self.db = type('FakeDB', (object,),
+                       dict(buildrequests=FakeBuildRequests()))()
+        self.botmaster = type('FakeBotMaster', (object,), dict(
+            builderNames=['b1', 'b2'],
+            slaves=dict(s1=FakeSlave(True, False, True),
+                        s2=FakeSlave(True, False),
+                        s3=FakeSlave(False))))()
+
+
+class TestRegistry(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = metrics.MetricsRegistry()
+
+    def test_render(self):
+        self.registry.set('buildbot_pending_build_requests', 3,
+                          builder='b"1')
+        self.registry.inc('buildbot_polls_total', vcs='hg', url='http://h')
+        self.registry.inc('buildbot_polls_total', vcs='hg', url='http://h')
+        text = self.registry.render()
+        self.assertTrue('# TYPE buildbot_polls_total counter\n' in text)
+        self.assertTrue('buildbot_pending_build_requests{builder="b\\"1"} '
+                        '3.0\n' in text)
+        self.assertTrue('buildbot_polls_total{url="http://h",vcs="hg"} 2.0\n'
+                        in text)
+
+    def test_instrument_poller(self):
+        poller = metrics.instrument_poller(FakePoller(),
+                                           registry=self.registry, url='u')
+        poller.poll()
+        self.assertEqual(self.registry.get('buildbot_polls_total', url='u'),
+                         1)
+        self.assertEqual(
+            self.registry.get('buildbot_poll_errors_total', url='u'), 0)
+
+        poller = metrics.instrument_poller(FakePoller(fail=True),
+                                           registry=self.registry, url='v')
+        errors = []
+        poller.poll().addErrback(errors.append)
+        self.assertEqual(len(errors), 1)  # failure still propagated
+        self.assertEqual(
+            self.registry.get('buildbot_poll_errors_total', url='v'), 1)
+        self.assertTrue(self.registry.get('buildbot_poll_duration_seconds',
+                                          url='v') >= 0)
+
+    def test_resource(self):
+        self.registry.set('buildbot_reconfig_duration_seconds', 2.5)
+        request = FakeRequest()
+        text = metrics.MetricsResource(self.registry).render_GET(request)
+        self.assertTrue('buildbot_reconfig_duration_seconds 2.5\n' in text)
+        self.assertTrue(request.headers['Content-Type'].startswith(
+            'text/plain'))
+
+    def test_refresh(self):
+        receiver = metrics.MetricsStatusReceiver('tcp:0',
+                                                 registry=self.registry)
+        receiver.master = FakeMaster()
+        receiver.refresh()
+        get = self.registry.get
+        self.assertEqual(get('buildbot_pending_build_requests',
+                             builder='b1'), 2)
+        self.assertEqual(get('buildbot_pending_build_requests',
+                             builder='b2'), 0)
+        self.assertEqual(get('buildbot_pending_build_requests',
+                             builder='b3'), 1)
+        self.assertEqual(get('buildbot_slaves', state='busy'), 1)
+        self.assertEqual(get('buildbot_slaves', state='idle'), 1)
+        self.assertEqual(get('buildbot_slaves', state='disconnected'), 1)
+
+
+class TestPopulate(BaseTestCase):
+
+    def test_populate(self):
+        self.configurator = BuildoutsConfigurator(self.bm_dir)
+        self.configurator.metrics_port = 'tcp:9101:interface=127.0.0.1'
+        metrics.REGISTRY.clear('buildbot_reconfig_duration_seconds')
+        master = self.populate('manifest_capability.cfg', 'one_slave.cfg')
+        receivers = [s for s in master['status']
+                     if isinstance(s, metrics.MetricsStatusReceiver)]
+        self.assertEqual(len(receivers), 1)
+        self.assertEqual(receivers[0].port, 'tcp:9101:interface=127.0.0.1')
+        self.assertTrue(metrics.REGISTRY.get(
+            'buildbot_reconfig_duration_seconds') >= 0)
@@ -0,0 +1,103 @@
+import os
+from argparse import Namespace
+from subprocess import check_call
+
+from base import BaseTestCase
+from ..build_utils import odoo_addons
+from ..build_utils import db_template_pool
+from ..build_utils import select_addons
+
+
+def write(path, content):
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    with open(path, 'w') as f:
+        f.write(content)
+
+
+def git(cwd, *args):
+    check_call(('git', '-c', 'user.name=test', '-c', 'user.email=t@test',
+                ) + args, cwd=cwd)
+
+
+class TestRevisionsKey(BaseTestCase):
+
+    def setUp(self):
+        super(TestRevisionsKey, self).setUp()
+        # the buildout repository, with tracked addons
+        origin = self.master_join('origin')
+        write(os.path.join(origin, 'addons', 'a', '__manifest__.py'),
+              "{'depends': ['base']}")
+        write(os.path.join(origin, '.gitignore'), 'parts/\n')
+        git(origin, 'init', '-q')
+        git(origin, 'add', '.')
+        git(origin, 'commit', '-q', '-m', 'initial')
+
+        self.builders = []
+        for name in ('builder1', 'builder2'):
+            build = self.master_join(name, 'build')
+            git(self.bm_dir, 'clone', '-q', origin, build)
+            # ignored by the buildout repository, e.g., a downloaded tarball
+            write(os.path.join(build, 'parts', 'local', 'b',
+                               '__openerp__.py'), "{'depends': ['a']}")
+            addons_path = ','.join(os.path.join(build, p) for p in (
+                'addons', 'parts/local'))
+            write(os.path.join(build, 'etc', 'odoo.cfg'),
+                  '[options]\naddons_path = %s\n' % addons_path)
+            self.builders.append(build)
+
+    def key(self, build):
+        return odoo_addons.revisions_key(
+            odoo_addons.read_addons_path(
+                os.path.join(build, 'etc', 'odoo.cfg')),
+            base_dir=build)
+
+    def test_same_code(self):
+        self.assertEqual(self.key(self.builders[0]),
+                         self.key(self.builders[1]))
+
+    def test_untracked_change(self):
+        key = self.key(self.builders[0])
+        write(os.path.join(self.builders[0], 'parts', 'local', 'b', 'x.py'),
+              '')
+        self.assertNotEqual(self.key(self.builders[0]), key)
+
+    def test_tracked_modification(self):
+        key = self.key(self.builders[1])
+        write(os.path.join(self.builders[1], 'addons', 'a', 'x.py'), '')
+        self.assertNotEqual(self.key(self.builders[1]), key)
+
+    def test_template_pool(self):
+        names = [db_template_pool.template_name(Namespace(
+            config=os.path.join(build, 'etc', 'odoo.cfg'),
+            modules='b, a', without_demo=False, source_template='template1',
+            post_install_sql=None, prefix='buildbot_tpl'), base_dir=build)
+            for build in self.builders]
+        self.assertEqual(names[0], names[1])
+        self.assertTrue(names[0].startswith('buildbot_tpl_'))
+
+
+class TestManifests(BaseTestCase):
+
+    def test_non_literal(self):
+        manifest = odoo_addons.parse_manifest(
+            "# comment\n{'name': 'x', 'depends': ['base'],\n"
+            " 'description': open('README.rst').read()}")
+        self.assertEqual(manifest, dict(name='x', depends=['base']))
+        self.assertRaises(odoo_addons.ManifestError,
+                          odoo_addons.parse_manifest,
+                          "{'depends': ['base'] + EXTRA}")
+        self.assertRaises(odoo_addons.ManifestError,
+                          odoo_addons.parse_manifest, "{'depends': [")
+
+    def test_select_fallback(self):
+        addons_dir = self.master_join('addons')
+        write(os.path.join(addons_dir, 'a', '__manifest__.py'),
+              "{'depends': ['base']}")
+        write(os.path.join(addons_dir, 'b', '__manifest__.py'),
+              "{'depends': ['a'] + ['mail']}")
+        write(os.path.join(addons_dir, '.git', 'HEAD'), '')
+        self.assertEqual(select_addons.select([addons_dir], ['a', 'b'],
+                                              ['a/models.py']),
+                         ['a', 'b'])
@@ -0,0 +1,38 @@
+import os
+
+from base import BaseTestCase
+from ..build_utils.run_parallel import log_names
+from ..build_utils import run_parallel
+
+
+class TestRunParallel(BaseTestCase):
+
+    def test_log_names(self):
+        self.assertEqual(log_names(['bin/check_ui', 'bin/check_api']),
+                         ['check_ui', 'check_api'])
+        self.assertEqual(log_names(['bin/check', 'tools/check', 'bin/ui']),
+                         ['bin_check', 'tools_check', 'ui'])
+        self.assertEqual(log_names(['./bin/check', 'bin/check', 'bin/ui']),
+                         ['bin_check-1', 'bin_check-2', 'ui'])
+
+    def test_same_basename(self):
+        for sub in ('one', 'two'):
+            os.mkdir(self.master_join(sub))
+            script = self.master_join(sub, 'check')
+            with open(script, 'w') as f:
+                f.write('#!/bin/sh\necho %s $1 $2\n' % sub)
+            os.chmod(script, 0755)
+
+        prefix = self.master_join('functional-')
+        cwd = os.getcwd()
+        os.chdir(self.bm_dir)
+        try:
+            code = run_parallel.main(['--port', '8069', '--db', 'test',
+                                      '--log-prefix', prefix,
+                                      'one/check', 'two/check'])
+        finally:
+            os.chdir(cwd)
+        self.assertEqual(code, 0)
+        for sub in ('one', 'two'):
+            with open(prefix + sub + '_check.log') as log:
+                self.assertEqual(log.read(), '%s 8069 test\n' % sub)
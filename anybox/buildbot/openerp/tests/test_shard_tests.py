@@ -0,0 +1,63 @@
+import os
+import unittest
+
+from base import BaseTestCase
+from ..build_utils import shard_tests
+
+GRAPH = dict(
+    base=[],
+    product=['base'],
+    stock=['product'],
+    sale=['product'],
+    sale_stock=['sale', 'stock'],
+    crm=['base'],
+    project=['base'],
+    hr=['base'],
+)
+
+
+class TestPartition(unittest.TestCase):
+
+    def test_dependent_together(self):
+        shards = shard_tests.partition(
+            GRAPH, ['stock', 'sale_stock', 'crm', 'hr'], 3)
+        self.assertEqual(len(shards), 3)
+        # sale_stock depends on stock: same shard
+        self.assertTrue(['sale_stock', 'stock'] in shards)
+        self.assertEqual(sorted(a for s in shards for a in s),
+                         ['crm', 'hr', 'sale_stock', 'stock'])
+
+    def test_balanced(self):
+        shards = shard_tests.partition(
+            GRAPH, ['crm', 'hr', 'project', 'stock'], 2)
+        sizes = sorted(len(shard_tests.dependency_closure(GRAPH, s))
+                       for s in shards)
+        # stock brings product, the three others are alone with base
+        self.assertEqual(sizes, [3, 4])
+
+    def test_more_shards_than_groups(self):
+        self.assertEqual(shard_tests.partition(GRAPH, ['sale', 'product'],
+                                               4),
+                         [['product', 'sale']])
+
+
+class TestShardLog(BaseTestCase):
+
+    def test_records(self):
+        path = self.master_join('test.log.shard0')
+        log = shard_tests.ShardLog(path)
+        self.assertEqual(log.read(), '')  # not created yet
+
+        with open(path, 'w') as f:
+            f.write('2015-03-04 10:00:00,000 1 ERROR db boom\n'
+                    'Traceback (most recent call last):\n')
+        self.assertEqual(log.read(), '')  # the traceback may go on
+        with open(path, 'a') as f:
+            f.write('  File "x.py"\n'
+                    '2015-03-04 10:00:01,000 1 INFO db next\n')
+        self.assertEqual(log.read(), '2015-03-04 10:00:00,000 1 ERROR db '
+                         'boom\nTraceback (most recent call last):\n'
+                         '  File "x.py"\n')
+        self.assertEqual(log.read(final=True),
+                         '2015-03-04 10:00:01,000 1 INFO db next\n')
+        self.assertTrue(os.path.exists(path))
@@ -2,6 +2,10 @@ import unittest
 from buildbot.process.buildstep import SUCCESS
 from buildbot.process.properties import Properties
 from ..steps import SetCapabilityProperties
+from ..steps import ChangedFilesDownload
+from ..steps import ObservedShellCommand
+from ..steps import OdooLogObserver
+from ..steps import ResourceUsageObserver
 from ..constants import CAPABILITY_PROP_FMT
 
 
@@ -72,3 +76,139 @@ class TestSetCapabilityProperties(unittest.TestCase):
 
         # TODO for now, but we should get status=FAILURE
         self.assertRaises(AssertionError, step.start)
+
+
+class FakeChange(object):
+
+    def __init__(self, *files):
+        self.files = files
+
+
+class FakeBuild(object):
+
+    def __init__(self, *changes):
+        self.changes = changes
+
+    def allChanges(self):
+        return iter(self.changes)
+
+
+class TestChangedFilesDownload(unittest.TestCase):
+
+    def test_no_changes(self):
+        step = ChangedFilesDownload()
+        step.build = FakeBuild()
+        self.assertIsNone(step.changed_files())
+
+    def test_changes(self):
+        step = ChangedFilesDownload()
+        step.build = FakeBuild(FakeChange('sale/a.py', 'stock/b.py'),
+                               FakeChange('sale/a.py'))
+        self.assertEqual(step.changed_files(), ['sale/a.py', 'stock/b.py'])
+
+
+class FakeStepStatus(object):
+
+    text = None
+
+    def setText(self, text):
+        self.text = text
+
+
+class FakeStep(object):
+
+    interrupted = None
+    name = 'test'
+
+    def __init__(self):
+        self.step_status = FakeStepStatus()
+        self.statistics = {}
+        self.properties = {}
+
+    def setStatistic(self, name, value):
+        self.statistics[name] = value
+
+    def setProperty(self, name, value, source):
+        self.properties[name] = value
+
+    def describe(self, done=False):
+        return ['testing']
+
+    def interrupt(self, reason):
+        self.interrupted = reason
+
+
+class TestOdooLogObserver(unittest.TestCase):
+
+    def observe(self, lines, fail_fast=False):
+        observer = OdooLogObserver(fail_fast=fail_fast)
+        step = FakeStep()
+        observer.setStep(step)
+        observer.outReceived(''.join(line + '\n' for line in lines))
+        return observer, step
+
+    def test_counts(self):
+        observer, step = self.observe([
+            '2015-03-04 INFO db openerp.modules.loading: loading',
+            '2015-03-04 ERROR db openerp.addons.x: ERROR:tests.x: boom',
+            '2015-03-04 CRITICAL db openerp.service: boom',
+        ])
+        self.assertEqual(observer.scanner.counts,
+                         {'Errors during x/yml tests': 1,
+                          'Critical logs': 1})
+        self.assertEqual(step.step_status.text, ['testing', '2 failures'])
+        self.assertIsNone(step.interrupted)
+
+    def test_fail_fast(self):
+        observer, step = self.observe([
+            '2015-03-04 ERROR db openerp.addons.x: ERROR:tests.x: boom',
+        ], fail_fast=True)
+        self.assertIsNone(step.interrupted)
+        observer.outReceived('2015-03-04 CRITICAL db openerp: boom\n')
+        self.assertTrue('CRITICAL' in step.interrupted)
+
+
+class TestResourceUsageObserver(unittest.TestCase):
+
+    def test_summary(self):
+        observer = ResourceUsageObserver()
+        step = FakeStep()
+        observer.setStep(step)
+        observer.outReceived('Ran 3 tests\n')
+        self.assertEqual(observer.summary(), [])
+        observer.outReceived(
+            'RESOURCE USAGE: {"cpu_system": 2.5, "cpu_user": 30.0, '
+            '"rss_peak": 524288, "wall": 50.2}\n')
+        self.assertEqual(step.statistics['wall'], 50.2)
+        self.assertEqual(step.properties['resources_test']['rss_peak'],
+                         524288)
+        self.assertEqual(observer.summary(), ['cpu 32s', 'rss 512MB'])
+
+
+class FakeObservedStepStatus(FakeStepStatus):
+
+    def setStatistic(self, name, value):
+        pass
+
+
+class TestObservedShellCommand(unittest.TestCase):
+
+    def test_text_from_all_observers(self):
+        step = ObservedShellCommand(
+            log_observers=[('stdio', OdooLogObserver),
+                           ('stdio', ResourceUsageObserver)],
+            command=['bin/test'], description=['testing'])
+        step.setStepStatus(FakeObservedStepStatus())
+        step.build = Properties()
+        odoo, resources = step.log_observers
+        odoo.outReceived(
+            '2015-03-04 CRITICAL db openerp.service: boom\n')
+        self.assertEqual(step.step_status.text, ['testing', '1 failure'])
+        resources.outReceived(
+            'RESOURCE USAGE: {"cpu_system": 2.5, "cpu_user": 30.0, '
+            '"rss_peak": 524288, "wall": 50.2}\n')
+        self.assertEqual(step.step_status.text,
+                         ['testing', '1 failure', 'cpu 32s', 'rss 512MB'])
+        odoo.outReceived('2015-03-04 CRITICAL db openerp.service: boom\n')
+        self.assertEqual(step.step_status.text,
+                         ['testing', '2 failures', 'cpu 32s', 'rss 512MB'])
@@ -0,0 +1,201 @@
+from StringIO import StringIO
+from twisted.application.service import MultiService
+
+from base import BaseTestCase
+from ..configurator import BuildoutsConfigurator
+from .. import telemetry
+
+
+class FakeProperties(object):
+
+    def __init__(self, props):
+        self.props = props
+
+    def getProperty(self, name):
+        return self.props.get(name)
+
+
+class FakeBuilder(object):
+
+    def __init__(self, name, current_builds=()):
+        self.name = name
+        self.current_builds = current_builds
+
+    def getName(self):
+        return self.name
+
+    def getCurrentBuilds(self):
+        return self.current_builds
+
+
+class FakeBuild(object):
+
+    def __init__(self, builder, number, slave, **props):
+        self.builder = FakeBuilder(builder)
+        self.number = number
+        self.slave = slave
+        self.props = FakeProperties(props)
+        self.watchers = []
+
+    def subscribe(self, receiver):
+        self.watchers.append(receiver)
+
+    def getBuilder(self):
+        return self.builder
+
+    def getNumber(self):
+        return self.number
+
+    def getSlavename(self):
+        return self.slave
+
+    def getProperties(self):
+        return self.props
+
+
+class FakeStep(object):
+
+    def __init__(self, name, start, end):
+        self.name = name
+        self.times = start, end
+
+    def getName(self):
+        return self.name
+
+    def getTimes(self):
+        return self.times
+
+
+class FakeMasterStatus(MultiService):
+
+    def __init__(self, *builders):
+        MultiService.__init__(self)
+        self.builders = dict((b.getName(), b) for b in builders)
+        self.watchers = []
+
+    def subscribe(self, receiver):
+        self.watchers.append(receiver)
+
+    def unsubscribe(self, receiver):
+        self.watchers.remove(receiver)
+
+    def getBuilderNames(self):
+        return self.builders.keys()
+
+    def getBuilder(self, name):
+        return self.builders[name]
+
+
+class TestTelemetry(BaseTestCase):
+
+    def setUp(self):
+        super(TestTelemetry, self).setUp()
+        self.store = telemetry.TelemetryStore(
+            self.master_join('telemetry.sqlite'))
+
+    def tearDown(self):
+        self.store.close()
+        super(TestTelemetry, self).tearDown()
+
+    def record_builds(self):
+        day = 86400
+        for i in range(20):
+            self.store.record('b-pg9.6', i, 'buildout', 's1',
+                              'pg_version=9.6', i * day, i * day + 100 + i,
+                              0)
+            self.store.record('b-pg9.3', i, 'buildout', 's2',
+                              'pg_version=9.3', i * day, i * day + 50, 0)
+        self.store.record('b-pg9.3', 20, 'buildout', 's2',
+                          'pg_version=9.3', 20 * day, 20 * day + 5000, 2)
+        self.store.commit()
+
+    def test_percentiles(self):
+        self.record_builds()
+        stats = self.store.percentiles(capability='pg_version=9.6')
+        self.assertEqual(len(stats), 1)
+        stat = stats[0]
+        self.assertEqual(stat['builder'], 'b-pg9.6')
+        self.assertEqual(stat['count'], 20)
+        self.assertEqual(dict(stat['percentiles'])[0.5], 110)
+
+        stats = self.store.percentiles(builder='b-pg9.3', results=(0, 1))
+        self.assertEqual(stats[0]['count'], 20)
+        self.assertEqual(stats[0]['mean'], 50)
+
+    def test_trends(self):
+        self.record_builds()
+        trends = dict((t['builder'], t)
+                      for t in self.store.trends(window=5, step='buildout',
+                                                 results=(0,)))
+        trend = trends['b-pg9.6']
+        self.assertEqual(trend['recent'], 117)
+        self.assertEqual(trend['before'], 112)
+        self.assertAlmostEqual(trend['slope'], 1)
+        self.assertEqual(trends['b-pg9.3']['slope'], 0)
+
+    def test_unknown_filter(self):
+        self.assertRaises(ValueError, self.store.durations, buildername='b')
+
+    def test_status_receiver(self):
+        receiver = telemetry.TelemetryStatusReceiver(
+            self.master_join('telemetry.sqlite'),
+            capability_properties=('pg_version', 'py_version'))
+        receiver.store = self.store
+        build = FakeBuild('b-pg9.6', 3, 's1', pg_version='9.6')
+        receiver.stepFinished(build, FakeStep('buildout', 10, 70), (0, []))
+        receiver.stepFinished(build, FakeStep('skipped', None, None), (3, []))
+        receiver.buildFinished('b-pg9.6', build, 0)
+
+        self.assertEqual(self.store.durations(), {
+            ('b-pg9.6', 'buildout', 'pg_version=9.6'): [(10, 60)]})
+
+    def test_reconfig(self):
+        path = self.master_join('telemetry.sqlite')
+        build = FakeBuild('b-pg9.6', 3, 's1', pg_version='9.6')
+        master_status = FakeMasterStatus(FakeBuilder('b-pg9.6', [build]))
+
+        old = telemetry.TelemetryStatusReceiver(path)
+        old.setServiceParent(master_status)
+        self.assertEqual(build.watchers, [old])  # took over running build
+        old.stepFinished(build, FakeStep('buildout', 10, 70), (0, []))
+        old.disownServiceParent()
+        old.stepFinished(build, FakeStep('late', 70, 80), (0, []))
+
+        new = telemetry.TelemetryStatusReceiver(path)
+        new.setServiceParent(master_status)
+        self.assertEqual(master_status.watchers, [new])
+        self.assertEqual(build.watchers, [old, new])
+        new.stepFinished(build, FakeStep('test', 70, 90), (0, []))
+        new.buildFinished('b-pg9.6', build, 0)
+        self.assertEqual(sorted(k[1] for k in new.store.durations()),
+                         ['buildout', 'test'])
+        new.disownServiceParent()
+
+    def test_cli(self):
+        self.record_builds()
+        self.store.close()
+        out = StringIO()
+        telemetry.main([self.master_join('telemetry.sqlite'), 'percentiles',
+                        '--builder', 'b-pg9.3', '--all-results'], out=out)
+        self.assertTrue(out.getvalue().startswith(
+            'b-pg9.3 buildout [pg_version=9.3] count=21'))
+
+        out = StringIO()
+        telemetry.main([self.master_join('telemetry.sqlite'), 'trend',
+                        '--builder', 'b-pg9.6'], out=out)
+        self.assertTrue('(+' in out.getvalue())
+        # for tearDown
+        self.store = telemetry.TelemetryStore(
+            self.master_join('telemetry.sqlite'))
+
+    def test_populate(self):
+        self.configurator = BuildoutsConfigurator(self.bm_dir)
+        self.configurator.telemetry_db = 'telemetry.sqlite'
+        master = self.populate('manifest_capability.cfg',
+                               'one_slave.cfg')
+        receivers = [s for s in master['status']
+                     if isinstance(s, telemetry.TelemetryStatusReceiver)]
+        self.assertEqual(len(receivers), 1)
+        self.assertEqual(receivers[0].path,
+                         self.master_join('telemetry.sqlite'))
+        self.assertTrue('pg_version' in receivers[0].capability_properties)
@@ -2,8 +2,16 @@ import os
 import hashlib
 import subprocess
 
+from .constants import ARCHIVE_FORMATS
+
 BUILD_UTILS_PATH = os.path.join(os.path.split(__file__)[0], 'build_utils')
 
+# slave-side directory shared by all builders, meant for WithProperties
+BUILDOUT_CACHES = '%(builddir)s/../buildout-caches'
+
+# slave-side port leases shared by all builders (see build_utils/port_lease.py)
+PORT_LEASE_FILE = '%(builddir)s/../port-leases.json'
+
 
 # can be overridden from command line tools such as update-mirrors,
 # for the version that has the buildbot hooks.
@@ -102,3 +110,12 @@ def comma_list_sanitize(comma_list):
 def bool_opt(options, name):
     """Parse a boolean from a config section dict."""
     return options.get(name, '').strip().lower() == 'true'
+
+
+def archive_format(options):
+    """Read and check the archive format from packaging options."""
+    fmt = options.get('packaging.format', 'tar.bz2').strip()
+    if fmt not in ARCHIVE_FORMATS:
+        raise ValueError("Unsupported packaging.format %r, must be one of "
+                         "%r" % (fmt, ARCHIVE_FORMATS))
+    return fmt
@@ -14,6 +14,7 @@ from .bzr_buildbot import BzrPoller
 from . import utils
 from .buildouts import parse_manifest
 from .scheduler import PollerChangeFilter
+from .metrics import instrument_poller
 
 logger = logging.getLogger(__name__)
 
@@ -105,22 +106,31 @@ class MultiWatcher(object):
         self.rewritten_urls = {}  # original -> final
 
     def make_pollers(self, poll_interval=10 * 60):
-        """Return an iterable of pollers for the watched repos."""
+        """Return an iterable of pollers for the watched repos.
+
+        They are instrumented to record metrics, see :mod:`metrics`.
+        """
         for h, (vcs, url, minor_specs) in self.repos.items():
             if vcs == 'hg':
                 for ms in minor_specs:
-                    yield HgPoller(url, branch=ms[0],
-                                   workdir=os.path.join('hgpoller', h),
-                                   pollInterval=poll_interval)
+                    yield instrument_poller(
+                        HgPoller(url, branch=ms[0],
+                                 workdir=os.path.join('hgpoller', h),
+                                 pollInterval=poll_interval),
+                        vcs=vcs, url=url, branch=ms[0])
             elif vcs == 'bzr':
                 branch_name = url
-                yield BzrPoller(url, poll_interval=poll_interval,
-                                branch_name=branch_name)
+                yield instrument_poller(
+                    BzrPoller(url, poll_interval=poll_interval,
+                              branch_name=branch_name),
+                    vcs=vcs, url=url, branch='')
             elif vcs == 'git':
                 branches = [ms[0] for ms in minor_specs]
-                yield GitPoller(url, branches=branches,
-                                workdir=os.path.join('gitpoller', h),
-                                pollInterval=poll_interval)
+                yield instrument_poller(
+                    GitPoller(url, branches=branches,
+                              workdir=os.path.join('gitpoller', h),
+                              pollInterval=poll_interval),
+                    vcs=vcs, url=url, branch=','.join(branches))
 
     def check_paths(self, paths):
         missing = [path for path in paths if not os.path.isfile(path)]
@@ -33,5 +33,6 @@ setup(
     ],
     entry_points="""
     [console_scripts]
+    anybox-buildbot-telemetry = anybox.buildbot.openerp.telemetry:main
     """
 )